@@ -0,0 +1,166 @@
+"""
+Load test of the sync (threaded WSGI) and async (ASGI) serving modes on the
+same machine and database. Each mode is started with benchmarks.serve and
+driven by keep-alive connections issuing a mix of GET /questions,
+GET /categories/<id>/questions, POST /questions/search and POST /quizzes.
+Reports requests/s, latency percentiles and the server's resident memory
+per open connection. Point BENCH_DATABASE_URL at Postgres for numbers that
+reflect production; SQLite serialises the database work.
+
+    python -m benchmarks.bench_async_load --size 100000 --concurrency 10,100,500 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from benchmarks.common import make_app, seed_bank, parse_sizes
+
+MODES = {'sync': 8101, 'async': 8102}
+
+
+def request_mix(rng):
+    # (method, path, JSON body) of the next request a client sends
+    choice = rng.random()
+    if choice < 0.3:
+        return "GET", f"/questions?page={rng.randint(1, 50)}", None
+    if choice < 0.6:
+        return "GET", f"/categories/{rng.randint(1, 6)}/questions?per_page=10&page={rng.randint(1, 20)}", None
+    if choice < 0.8:
+        return "POST", "/questions/search", { "searchTerm": rng.choice(["planet", "title", "who"]), "page": 1 }
+    return "POST", "/quizzes", { "previous_questions": [], "quiz_category": { "id": rng.randint(0, 6) } }
+
+
+async def send_request(reader, writer, method, path, body):
+    payload = json.dumps(body).encode() if body is not None else b""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+    )
+    await writer.drain()
+    status_line = await reader.readline()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    await reader.readexactly(int(headers.get("content-length", 0)))
+    keep_alive = headers.get("connection", "").lower() != "close"
+    return int(status_line.split()[1]), keep_alive
+
+
+async def client(port, deadline, latencies, errors, seed):
+    rng = random.Random(seed)
+    connection = None
+    while time.perf_counter() < deadline:
+        if connection is None:
+            connection = await asyncio.open_connection('127.0.0.1', port)
+        started = time.perf_counter()
+        try:
+            status, keep_alive = await send_request(*connection, *request_mix(rng))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            errors.append("connection")
+            connection = None
+            continue
+        latencies.append(time.perf_counter() - started)
+        if status >= 500:
+            errors.append(status)
+        if not keep_alive:
+            connection[1].close()
+            connection = None
+    if connection is not None:
+        connection[1].close()
+
+
+def resident_kb(pid):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+async def run_load(port, pid, concurrency, duration):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    tasks = [asyncio.create_task(client(port, deadline, latencies, errors, seed))
+             for seed in range(concurrency)]
+    peak_kb = 0
+    while not all(task.done() for task in tasks):
+        peak_kb = max(peak_kb, resident_kb(pid))
+        await asyncio.sleep(0.2)
+    await asyncio.gather(*tasks)
+    return latencies, errors, peak_kb
+
+
+async def wait_until_serving(port, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            await send_request(reader, writer, "GET", "/categories", None)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def percentile(samples, quantile):
+    return samples[min(len(samples) - 1, int(len(samples) * quantile))] * 1000
+
+
+def benchmark_mode(mode, port, args):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.serve", mode, "--port", str(port), "--pool-size", str(args.pool_size)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    try:
+        asyncio.run(wait_until_serving(port))
+        # Warm the pools and caches, then read the idle footprint
+        asyncio.run(run_load(port, server.pid, 4, 2))
+        idle_kb = resident_kb(server.pid)
+        for concurrency in args.concurrency:
+            latencies, errors, peak_kb = asyncio.run(run_load(port, server.pid, concurrency, args.duration))
+            latencies.sort()
+            print(json.dumps({
+                "mode": mode,
+                "concurrency": concurrency,
+                "requests_per_second": round(len(latencies) / args.duration, 1),
+                "p50_ms": round(percentile(latencies, 0.5), 2) if latencies else None,
+                "p99_ms": round(percentile(latencies, 0.99), 2) if latencies else None,
+                "errors": len(errors),
+                "idle_rss_mb": round(idle_kb / 1024, 1),
+                "peak_rss_mb": round(peak_kb / 1024, 1),
+                "kb_per_connection": round(max(peak_kb - idle_kb, 0) / concurrency, 1),
+            }), flush=True)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--concurrency', type=parse_sizes, default=[10, 100, 500])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--pool-size', type=int, default=20)
+    parser.add_argument('--modes', default='sync,async')
+    args = parser.parse_args()
+
+    app = make_app()
+    with app.app_context():
+        seed_bank(app, args.size)
+
+    for mode in args.modes.split(','):
+        benchmark_mode(mode, MODES[mode], args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Reports rows/s of the bulk import path against one Question.insert() per row.
+
+    python -m benchmarks.bench_bulk_import --rows 100000 --batch-size 1000
+"""
+import argparse
+import time
+
+from models import db, Question
+from flaskr.bulk import import_questions
+from benchmarks.common import make_app, seed_bank, synthetic_questions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--single-rows', type=int, default=2000,
+                        help='rows inserted one by one for the baseline')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    app = make_app()
+    with app.app_context():
+        seed_bank(app, 0)
+        start = time.perf_counter()
+        for row in synthetic_questions(args.single_rows):
+            Question(**row).insert()
+        seconds = time.perf_counter() - start
+        print(f"insert() per row: {args.single_rows} rows in {seconds:.2f}s, "
+              f"{args.single_rows / seconds:.1f} rows/s")
+
+        seed_bank(app, 0)
+        records = ((index, row, None) for index, row in enumerate(synthetic_questions(args.rows), start=1))
+        report = import_questions(records, batch_size=args.batch_size)
+        print(f"bulk import:      {report.inserted} rows in {report.seconds:.2f}s, "
+              f"{report.rows_per_second} rows/s")
+        db.session.remove()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Shows query plans and latency of the category lookups before and after the
+0001_question_category_integer_fk migration (text column without indexes
+to an integer foreign key with (category, id) and (category, difficulty)
+indexes).
+
+    python -m benchmarks.bench_category_schema --size 200000
+"""
+import argparse
+
+from sqlalchemy import Table, MetaData, Column, Integer, String, insert, text
+
+from models import db, Question, Category, SchemaMigration
+from flaskr.migrations import run_migrations
+from test_data import categories_data
+from benchmarks.common import make_app, measure, synthetic_questions, SEED_BATCH_SIZE
+
+QUERIES = {
+    "category page": "SELECT id FROM questions WHERE category = {category} ORDER BY id LIMIT 10",
+    "category + difficulty": "SELECT id FROM questions WHERE category = {category} AND difficulty = 2",
+}
+
+
+def seed_legacy_bank(size):
+    # Questions table as older versions created it: text category, no index, no FK
+    db.drop_all()
+    db.create_all()
+    Question.__table__.drop(db.engine)
+    legacy_questions = Table(
+        'questions', MetaData(),
+        Column('id', Integer, primary_key=True),
+        Column('question', String, nullable=False),
+        Column('answer', String, nullable=False),
+        Column('category', String, nullable=False),
+        Column('difficulty', Integer, nullable=False)
+    )
+    legacy_questions.create(db.engine)
+    db.session.execute(insert(Category), categories_data)
+    batch = []
+    for row in synthetic_questions(size):
+        batch.append({**row, 'category': str(row['category'])})
+        if len(batch) == SEED_BATCH_SIZE:
+            db.session.execute(insert(legacy_questions), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(legacy_questions), batch)
+    db.session.query(SchemaMigration).delete()
+    db.session.commit()
+
+
+def explain(sql):
+    prefix = "EXPLAIN QUERY PLAN " if db.engine.dialect.name == 'sqlite' else "EXPLAIN ANALYZE "
+    rows = db.session.execute(text(prefix + sql)).all()
+    return [" ".join(str(value) for value in row) for row in rows]
+
+
+def report(label, category_literal, repeat):
+    print(f"== {label}")
+    for name, template in QUERIES.items():
+        sql = template.format(category=category_literal)
+        stats = measure(lambda: db.session.execute(text(sql)).all(), repeat)
+        print(f"{name:<22} p50={stats['p50_ms']:>8.3f}ms p99={stats['p99_ms']:>8.3f}ms")
+        for line in explain(sql):
+            print(f"    {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    app = make_app(AUTO_MIGRATE=False)
+    with app.app_context():
+        seed_legacy_bank(args.size)
+        report("before: text category, no index", "'3'", args.repeat)
+        db.session.commit()
+        run_migrations()
+        report("after: integer foreign key, composite indexes", "3", args.repeat)
+
+
+if __name__ == '__main__':
+    main()
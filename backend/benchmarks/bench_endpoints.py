@@ -0,0 +1,237 @@
+"""
+Load test of the read endpoints: GET /questions, GET
+/categories/<id>/questions, POST /questions/search and POST /quizzes.
+
+Each endpoint is driven for every bank size (synthetic questions built from
+test_data.py) and every concurrency level by that many threads, each with
+its own test client, so there is no network noise. The request parameters
+come from seeded generators, so two runs send the same requests. For each
+run the suite reports throughput, p50/p95/p99 latency and SQL statements
+per request, as one JSON document (stdout or --output).
+
+Pass the document of an earlier run as --baseline to compare the two. The
+exit status is 1 when a throughput or p95 change is worse than --tolerance.
+Runs against SQLite by default; point BENCH_DATABASE_URL at Postgres for
+production numbers.
+
+    python -m benchmarks.bench_endpoints --sizes 10000,100000,1000000 --concurrency 1,8,32 \\
+        --output results.json --baseline previous.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from models import db
+from flaskr.pagination import QUESTIONS_PER_PAGE
+from flaskr.querylog import current_statements
+from benchmarks.common import make_app, ensure_bank, percentile, parse_sizes
+
+CATEGORIES = 6
+SEARCH_TERMS = ["title", "planet", "who", "what", "#1"]
+# Pages the listing scenarios draw from, the deepest ones cost the most with OFFSET
+MAX_PAGE = 50
+# Ids sent as previous_questions by the quiz scenario
+PREVIOUS_QUESTIONS = 10
+
+
+def list_questions(rng, size):
+    return "GET", f"/questions?page={rng.randint(1, min(MAX_PAGE, size // QUESTIONS_PER_PAGE))}", None
+
+
+def list_category(rng, size):
+    pages = max(1, min(MAX_PAGE, size // CATEGORIES // QUESTIONS_PER_PAGE))
+    return "GET", f"/categories/{rng.randint(1, CATEGORIES)}/questions?page={rng.randint(1, pages)}", None
+
+
+def search(rng, size):
+    return "POST", "/questions/search", { "searchTerm": rng.choice(SEARCH_TERMS), "page": 1 }
+
+
+def quiz(rng, size):
+    return "POST", "/quizzes", {
+        "previous_questions": [rng.randint(1, size) for _ in range(PREVIOUS_QUESTIONS)],
+        "quiz_category": { "id": rng.randint(0, CATEGORIES) }
+    }
+
+
+SCENARIOS = {
+    "GET /questions": list_questions,
+    "GET /categories/<id>/questions": list_category,
+    "POST /questions/search": search,
+    "POST /quizzes": quiz,
+}
+
+
+class SqlCounter:
+    # Statements run by each request, read from the query log before teardown
+    def __init__(self, app):
+        self.counts = []
+        app.after_request(self.record)
+
+    def record(self, response):
+        statements = current_statements()
+        if statements is not None:
+            self.counts.append(len(statements))
+        return response
+
+
+def worker(app, scenario, size, requests, seed, latencies, errors):
+    client = app.test_client()
+    rng = random.Random(seed)
+    for _ in range(requests):
+        method, url, body = scenario(rng, size)
+        started = time.perf_counter()
+        response = client.open(url, method=method, json=body)
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+
+
+def run(app, counter, name, size, concurrency, requests, warmup, seed):
+    scenario = SCENARIOS[name]
+    # Warm the pools, caches and quiz/search indexes, then keep only the measured requests
+    worker(app, scenario, size, warmup, seed - 1, [], [])
+    counter.counts = []
+
+    latencies, errors = [], []
+    per_thread = max(1, requests // concurrency)
+    threads = [
+        threading.Thread(target=worker, args=(app, scenario, size, per_thread, seed + index, latencies, errors))
+        for index in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    counts = counter.counts
+    return {
+        "endpoint": name,
+        "size": size,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "sql_per_request": round(sum(counts) / len(counts), 2) if counts else 0,
+        "sql_max": max(counts, default=0),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the change of every run also found in `baseline` and return the
+    runs whose throughput dropped or p95 grew by more than `tolerance`.
+    """
+    previous = {(run["endpoint"], run["size"], run["concurrency"]): run for run in baseline["results"]}
+    regressions = []
+    for run in results:
+        before = previous.get((run["endpoint"], run["size"], run["concurrency"]))
+        if before is None:
+            continue
+        throughput = run["throughput_rps"] / before["throughput_rps"] - 1 if before["throughput_rps"] else 0
+        p95 = run["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0
+        sql = run["sql_per_request"] - before["sql_per_request"]
+        regressed = throughput < -tolerance or p95 > tolerance
+        print(f"{'REGRESSED' if regressed else 'ok':>9}  {run['endpoint']:<32} size={run['size']:<8} "
+              f"c={run['concurrency']:<4} throughput {throughput:+.1%}  p95 {p95:+.1%}  sql/request {sql:+.2f}",
+              file=sys.stderr)
+        if regressed:
+            regressions.append(run)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=parse_sizes, default=[10000, 100000, 1000000])
+    parser.add_argument('--concurrency', type=parse_sizes, default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=1000, help='measured requests per run')
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--endpoints', default=','.join(SCENARIOS),
+                        help='comma separated, any of: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--response-cache', action='store_true',
+                        help="Keep the response cache on (off by default so every request reaches the database).")
+    parser.add_argument('--output', help='write the JSON document to this file instead of stdout')
+    parser.add_argument('--baseline', help='JSON document of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    endpoints = args.endpoints.split(',')
+    unknown = [name for name in endpoints if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(unknown)}")
+
+    config = {
+        # Enough connections that the pool never queues the threads
+        "DB_POOL_SIZE": max(args.concurrency),
+        "DB_MAX_OVERFLOW": 0,
+        "METRICS_ENABLED": False,
+        "QUIZ_RANDOM_SEED": args.seed,
+    }
+    if not args.response_cache:
+        config["RESPONSE_CACHE_TTL"] = 0
+
+    results = []
+    for size in args.sizes:
+        seeder = make_app()
+        with seeder.app_context():
+            ensure_bank(seeder, size)
+            db.engine.dispose()
+        # A fresh app per bank, so no pool or index from the previous size is reused
+        app = make_app(**config)
+        counter = SqlCounter(app)
+        for name in endpoints:
+            for concurrency in args.concurrency:
+                run_result = run(app, counter, name, size, concurrency, args.requests, args.warmup, args.seed)
+                results.append(run_result)
+                print(json.dumps(run_result), file=sys.stderr, flush=True)
+        with app.app_context():
+            db.engine.dispose()
+
+    with make_app().app_context():
+        database = db.engine.dialect.name
+    document = {
+        "suite": "endpoints",
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "database": database,
+        },
+        "settings": {
+            "sizes": args.sizes,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "response_cache": args.response_cache,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(document, output, indent=2)
+    else:
+        print(json.dumps(document, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
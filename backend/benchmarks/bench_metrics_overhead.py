@@ -0,0 +1,83 @@
+"""
+Measures the per-request cost of the Prometheus instrumentation, including
+the SQL statement recording of the query log it reads from.
+
+The hooks are timed directly, for a request running 0 to 8 SQL statements,
+since that cost is far below the run-to-run noise of a request that queries
+the database. A cached GET /categories (no SQL) is also served end to end by
+an app with METRICS_ENABLED off and one with it on. Exits with status 1 when
+the hook cost exceeds the budget.
+
+    python -m benchmarks.bench_metrics_overhead --repeat 20000 --budget-us 50
+"""
+import argparse
+import sys
+import time
+
+from flask import Response
+
+from benchmarks.common import make_app, seed_bank, measure
+
+STATEMENTS = (0, 1, 3, 8)
+
+
+class Connection:
+    # Stands in for the SQLAlchemy connection the cursor events receive
+    def __init__(self):
+        self.info = {}
+
+
+def hook_cost_us(app, statements, repeat):
+    metrics, query_log = app.extensions['metrics'], app.extensions['query_log']
+    connection, response = Connection(), Response()
+    with app.test_request_context('/questions'):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            query_log.start()
+            metrics.before_request()
+            for _ in range(statements):
+                query_log.before_cursor_execute(connection, None, "SELECT 1", None, None, False)
+                query_log.after_cursor_execute(connection, None, "SELECT 1", None, None, False)
+            metrics.after_request(response)
+            query_log.finish(response)
+            metrics.teardown_request(None)
+            query_log.teardown(None)
+        return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--budget-us', type=float, default=50)
+    args = parser.parse_args()
+
+    app = make_app()
+    with app.app_context():
+        seed_bank(app, args.size)
+    plain, instrumented = make_app(METRICS_ENABLED=False), make_app(METRICS_ENABLED=True)
+
+    over_budget = False
+    for statements in STATEMENTS:
+        cost = min(hook_cost_us(instrumented, statements, args.repeat) for _ in range(args.rounds))
+        over_budget = over_budget or cost > args.budget_us
+        print(f"hooks, {statements} statements: {cost:.1f}us per request")
+
+    # Interleaved rounds keeping the best p50 of each side, so machine noise hits both alike
+    results = {}
+    for _ in range(args.rounds):
+        for name, target in (("off", plain), ("on", instrumented)):
+            client = target.test_client()
+            sample = measure(lambda: client.get("/categories"), args.repeat // 10)
+            if name not in results or sample["p50_ms"] < results[name]["p50_ms"]:
+                results[name] = sample
+    print(f"GET /categories (cached) off p50={results['off']['p50_ms']:.3f}ms "
+          f"on p50={results['on']['p50_ms']:.3f}ms "
+          f"difference={(results['on']['p50_ms'] - results['off']['p50_ms']) * 1000:.1f}us")
+
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Compares OFFSET and keyset (WHERE id > :last) pagination latency of
+GET /questions as the requested page gets deeper.
+
+    python -m benchmarks.bench_pagination --size 200000 --depths 1,100,1000,10000
+"""
+import argparse
+
+from models import Question
+from flaskr.pagination import QUESTIONS_PER_PAGE
+from benchmarks.common import make_app, seed_bank, measure, parse_sizes
+
+
+def offset_page(page):
+    return Question.query.order_by(Question.id).limit(QUESTIONS_PER_PAGE).offset(
+        (page - 1) * QUESTIONS_PER_PAGE
+    ).all()
+
+
+def keyset_page(after_id):
+    return Question.query.filter(Question.id > after_id).order_by(Question.id).limit(
+        QUESTIONS_PER_PAGE
+    ).all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=200000)
+    parser.add_argument('--depths', type=parse_sizes, default=[1, 100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    app = make_app()
+    with app.app_context():
+        seed_bank(app, args.size)
+        for page in args.depths:
+            # Seeded ids are contiguous, so the keyset equivalent of a page is exact
+            after_id = (page - 1) * QUESTIONS_PER_PAGE
+            offset = measure(lambda: offset_page(page), args.repeat)
+            keyset = measure(lambda: keyset_page(after_id), args.repeat)
+            print(f"page={page:>7}  offset p50={offset['p50_ms']:>8.3f}ms p99={offset['p99_ms']:>8.3f}ms"
+                  f"  keyset p50={keyset['p50_ms']:>7.3f}ms p99={keyset['p99_ms']:>7.3f}ms")
+
+
+if __name__ == '__main__':
+    main()
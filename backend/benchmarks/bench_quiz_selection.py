@@ -0,0 +1,94 @@
+"""
+Compares the legacy POST /quizzes selection (load every unseen question, then
+random.choice) against the in-memory id pool, sweeping the bank size. Then
+plays one category to the end through a quiz session, dealing from the
+shuffled deck, against drawing from the id pool with the session's bitmap.
+The difficulty band picks (difficulty 2 to 3) draw from the per-(category,
+difficulty) buckets and are compared with the indexed SQL filter.
+
+    python -m benchmarks.bench_quiz_selection --sizes 1000,10000,100000
+"""
+import argparse
+import random
+import time
+
+from models import db, Question
+from flaskr.cache import LocalCacheBackend
+from flaskr.quiz import DifficultyPlan, QuestionPool, QuizSessionStore, ServedIds
+from benchmarks.common import make_app, seed_bank, measure, parse_sizes
+
+
+def legacy_select(category, previous_questions):
+    questions = Question.query.filter(
+        Question.category == category
+    ).filter(
+        Question.id.notin_(previous_questions)
+    ).all()
+    return random.choice(questions) if questions else None
+
+
+def legacy_band_select(category, previous_questions, low, high):
+    # The same, filtered on (category, difficulty) by ix_questions_category_difficulty
+    questions = Question.query.filter(
+        Question.category == category, Question.difficulty.between(low, high)
+    ).filter(
+        Question.id.notin_(previous_questions)
+    ).all()
+    return random.choice(questions) if questions else None
+
+
+def play_session(store, category):
+    # Mean milliseconds per step of a session played to the end
+    session = store.get(store.start(category))
+    steps, started = 0, time.perf_counter()
+    while store.next_question(session) is not None:
+        steps += 1
+    return (time.perf_counter() - started) * 1000 / max(steps, 1)
+
+
+def play_pool(pool, category):
+    # The same game drawing random ids from the pool and rejecting served ones
+    served = ServedIds()
+    steps, started = 0, time.perf_counter()
+    while True:
+        question = pool.fetch(pool.get_pool(category), served, served.count)
+        if question is None:
+            break
+        served.add(question.id)
+        steps += 1
+    return (time.perf_counter() - started) * 1000 / max(steps, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=parse_sizes, default=[1000, 10000, 100000])
+    parser.add_argument('--previous', type=int, default=20,
+                        help='length of the previous_questions list')
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    app = make_app()
+    with app.app_context():
+        for size in args.sizes:
+            seed_bank(app, size)
+            previous_questions = list(range(1, args.previous + 1))
+            pool = QuestionPool(ttl=None)
+            pool.load()
+
+            legacy = measure(lambda: legacy_select(1, previous_questions), args.repeat)
+            pooled = measure(lambda: pool.next_question('1', previous_questions), args.repeat)
+            legacy_band = measure(lambda: legacy_band_select(1, previous_questions, 2, 3), args.repeat)
+            band = DifficultyPlan(2, 3)
+            banded = measure(lambda: pool.next_question('1', previous_questions, band), args.repeat)
+            deck_step = play_session(QuizSessionStore(pool, LocalCacheBackend()), '1')
+            pool_step = play_pool(pool, '1')
+            db.session.remove()
+
+            print(f"size={size:>9}  legacy p50={legacy['p50_ms']:>9.3f}ms p99={legacy['p99_ms']:>9.3f}ms"
+                  f"  pool p50={pooled['p50_ms']:>7.3f}ms p99={pooled['p99_ms']:>7.3f}ms"
+                  f"  band: legacy p50={legacy_band['p50_ms']:>8.3f}ms pool p50={banded['p50_ms']:>7.3f}ms"
+                  f"  full session: deck {deck_step:.3f}ms/step, pool draws {pool_step:.3f}ms/step")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""
+Measures POST /questions/search latency (p50/p99) per search backend over a
+large synthetic corpus. The fts backend needs SQLite (the default), the
+trigram backend Postgres with pg_trgm, so point BENCH_DATABASE_URL at one
+to include it.
+
+    python -m benchmarks.bench_search --size 1000000 --backends ilike,memory,fts
+    BENCH_DATABASE_URL=postgresql://user@localhost/bench python -m benchmarks.bench_search --backends ilike,memory,trigram
+"""
+import argparse
+
+from models import db
+from flaskr.search import SEARCH_BACKENDS
+from benchmarks.common import make_app, seed_bank, measure
+
+SEARCH_TERMS = ['planet', 'what', 'mona lisa', '#4242', 'no such words']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=1000000)
+    parser.add_argument('--backends', default='ilike,memory')
+    parser.add_argument('--per-page', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = make_app(SEARCH_BACKEND='ilike')
+    with app.app_context():
+        seed_bank(app, args.size)
+        for name in args.backends.split(','):
+            backend = SEARCH_BACKENDS[name]()
+            backend.setup()
+            for term in SEARCH_TERMS:
+                stats = measure(
+                    lambda: backend.search(term, page=1, per_page=args.per_page), args.repeat
+                )
+                print(f"backend={name:<8} term={term!r:<16} p50={stats['p50_ms']:>9.3f}ms"
+                      f" p99={stats['p99_ms']:>9.3f}ms")
+                db.session.remove()
+
+
+if __name__ == '__main__':
+    main()
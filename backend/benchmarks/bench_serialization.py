@@ -0,0 +1,67 @@
+"""
+Measures the cost per row of turning a page of questions into a JSON
+response: ORM objects through Question.format() and the standard library
+json provider (the previous path) against Question.columns() tuples through
+Question.format_row() and the orjson provider. Each step (fetch, format,
+encode) is timed on its own, then the whole GET /categories/<id>/questions
+response with each provider.
+
+    python -m benchmarks.bench_serialization --rows 1000
+"""
+import argparse
+
+from flask.json.provider import DefaultJSONProvider
+
+from models import db, Question
+from flaskr.jsonprovider import OrjsonProvider, orjson
+from benchmarks.common import make_app, seed_bank, measure
+
+
+def per_row_us(sample, rows):
+    return sample["p50_ms"] * 1000 / rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000,
+                        help='rows in the serialized list (and questions per category)')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    categories = 6
+    app = make_app(RESPONSE_CACHE_TTL=0)
+    with app.app_context():
+        seed_bank(app, args.rows * categories)
+
+    providers = [("json", DefaultJSONProvider(app))]
+    if orjson is not None:
+        providers.append(("orjson", OrjsonProvider(app)))
+
+    with app.test_request_context():
+        query = Question.query.filter(Question.category == 1).order_by(Question.id).limit(args.rows)
+        objects = query.all()
+        rows = query.with_entities(*Question.columns()).all()
+        fetch_objects = measure(lambda: (db.session.expunge_all(), query.all()), args.repeat)
+        fetch_rows = measure(lambda: query.with_entities(*Question.columns()).all(), args.repeat)
+        format_objects = measure(lambda: [question.format() for question in objects], args.repeat)
+        format_rows = measure(lambda: [Question.format_row(row) for row in rows], args.repeat)
+        print(f"fetch   ORM objects {per_row_us(fetch_objects, len(rows)):7.2f}us/row"
+              f"  tuples {per_row_us(fetch_rows, len(rows)):7.2f}us/row")
+        print(f"format  format()    {per_row_us(format_objects, len(rows)):7.2f}us/row"
+              f"  format_row() {per_row_us(format_rows, len(rows)):7.2f}us/row")
+
+        document = {"success": True, "questions": [Question.format_row(row) for row in rows]}
+        for name, provider in providers:
+            encode = measure(lambda: provider.response(document), args.repeat)
+            print(f"encode  {name:<11} {per_row_us(encode, len(rows)):7.2f}us/row")
+
+    # Whole responses (tuples and format_row()) with each provider
+    for name in [name for name, _ in providers]:
+        client = make_app(RESPONSE_CACHE_TTL=0, JSON_PROVIDER='default' if name == 'json' else name).test_client()
+        response = measure(lambda: client.get("/categories/1/questions"), args.repeat)
+        print(f"GET /categories/1/questions ({len(rows)} rows) with {name}: "
+              f"p50={response['p50_ms']:.2f}ms {per_row_us(response, len(rows)):.2f}us/row")
+
+
+if __name__ == '__main__':
+    main()
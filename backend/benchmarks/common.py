@@ -0,0 +1,95 @@
+import os
+import statistics
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from flaskr import create_app
+from models import db, Question, Category, QuestionCount
+from test_data import categories_data, questions_data
+
+# Benchmarks run against a throwaway SQLite file unless told otherwise
+DEFAULT_DATABASE_PATH = 'sqlite:////tmp/trivia_bench.db'
+SEED_BATCH_SIZE = 10000
+
+
+def make_app(database_path=None, **config):
+    database_path = database_path or os.environ.get('BENCH_DATABASE_URL', DEFAULT_DATABASE_PATH)
+    return create_app({
+        "SQLALCHEMY_DATABASE_URI": database_path,
+        "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+        **config
+    })
+
+
+def synthetic_questions(size):
+    # Cycle through the test data so every category gets a share of the bank
+    for index in range(size):
+        template = questions_data[index % len(questions_data)]
+        yield {
+            'question': f"{template['question']} #{index}",
+            'answer': template['answer'],
+            'category': categories_data[index % len(categories_data)]['id'],
+            'difficulty': template['difficulty']
+        }
+
+
+def seed_bank(app, size):
+    """
+    Recreate the schema and fill it with `size` synthetic questions using
+    batched inserts. Must run inside `app.app_context()`.
+    """
+    db.drop_all()
+    db.create_all()
+    db.session.execute(insert(Category), categories_data)
+    batch = []
+    for row in synthetic_questions(size):
+        batch.append(row)
+        if len(batch) == SEED_BATCH_SIZE:
+            db.session.execute(insert(Question), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(Question), batch)
+    db.session.commit()
+    QuestionCount.rebuild()
+
+
+def ensure_bank(app, size):
+    """
+    Seed `size` synthetic questions unless the database already holds that
+    bank (the synthetic rows are deterministic), so repeated runs skip the
+    seeding. Must run inside `app.app_context()`.
+    """
+    try:
+        seeded = QuestionCount.total_for() == size and db.session.get(Question, size) is not None
+    except SQLAlchemyError:
+        seeded = False
+    # End the read transaction, seed_bank() rewrites the schema from another connection
+    db.session.rollback()
+    if not seeded:
+        seed_bank(app, size)
+
+
+def percentile(samples, quantile):
+    # Nearest-rank percentile of already sorted samples
+    return samples[min(len(samples) - 1, int(len(samples) * quantile))]
+
+
+def measure(fn, repeat=50):
+    # Time `fn` and summarise the samples in milliseconds
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'mean_ms': round(statistics.fmean(samples), 3),
+        'p50_ms': round(samples[len(samples) // 2], 3),
+        'p99_ms': round(percentile(samples, 0.99), 3),
+    }
+
+
+def parse_sizes(value):
+    return [int(size) for size in value.split(',') if size]
@@ -0,0 +1,45 @@
+"""
+Serves the benchmark database in sync mode (threaded WSGI server, one
+thread per connection) or async mode (uvicorn running flaskr.asgi).
+Used by the load benchmarks, which start it as a subprocess.
+
+    python -m benchmarks.serve async --port 8001
+"""
+import argparse
+import logging
+
+from benchmarks.common import make_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('mode', choices=['sync', 'async'])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--pool-size', type=int, default=20)
+    parser.add_argument('--response-cache', action='store_true',
+                        help="Keep the response cache on (off by default so every request reaches the database).")
+    args = parser.parse_args()
+
+    config = {
+        "DB_POOL_SIZE": args.pool_size,
+        "DB_MAX_OVERFLOW": args.pool_size,
+        "SLOW_REQUEST_THRESHOLD": 0,
+    }
+    if not args.response_cache:
+        config["RESPONSE_CACHE_TTL"] = 0
+    app = make_app(**config)
+
+    if args.mode == 'sync':
+        from werkzeug.serving import WSGIRequestHandler, run_simple
+        # Keep-alive like the async server, so both sides serve the same connections
+        WSGIRequestHandler.protocol_version = "HTTP/1.1"
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        run_simple('127.0.0.1', args.port, app, threaded=True)
+    else:
+        import uvicorn
+        from flaskr.asgi import AsyncApp
+        uvicorn.run(AsyncApp(app), host='127.0.0.1', port=args.port, log_level='warning', access_log=False)
+
+
+if __name__ == '__main__':
+    main()
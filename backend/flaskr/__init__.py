@@ -1,25 +1,245 @@
-from flask import Flask, request, abort, jsonify
+from flask import Flask, request, abort, jsonify, current_app
 from flask_cors import CORS
+import io
 import random
+from werkzeug.exceptions import HTTPException
+from sqlalchemy import inspect
+
+from models import setup_db, Question, Category, db, on_write, database_path as default_database_path
+from .quiz import QUESTIONS_PER_LEVEL, DifficultyPlan, QuestionPool, QuizOptionsError, QuizSessionStore
+from .pagination import (
+    QUESTIONS_PER_PAGE, MAX_QUESTIONS_PER_PAGE, check_page_exists, is_paginated, paginate
+)
+from .search import create_search_backend
+from .cache import CategoryCache, LocalCacheBackend, ResponseCache, create_cache_backend
+from .counts import count_questions, ensure_question_counts
+from .streaming import iter_questions, ndjson_lines, json_document, stream_response
+from .bulk import (
+    PARSERS, EXPORT_FORMATS, INPUT_ERRORS, QuestionValidationError,
+    import_questions, export_questions, validate_question
+)
+from .commands import register_commands
+from .migrations import run_migrations
+from .pool import DB_SLOW_CHECKOUT, PoolMetrics, engine_options, prewarm
+from .metrics import Metrics
+from .querylog import SLOW_REQUEST_THRESHOLD, QueryLog
+from .profiling import RequestProfiler
+from .jsonprovider import create_json_provider
+from .sqlite import configure_sqlite, sqlite_pragmas
+from .replicas import ReplicaRouter, replica_uris
+
+# Seconds before the in-memory quiz pools are reloaded from the database
+QUIZ_POOL_TTL = 60
+# Idle seconds before a quiz session expires, and how many are kept per process
+QUIZ_SESSION_TTL = 3600
+QUIZ_MAX_SESSIONS = 1000
+# Seconds before the in-memory search index is rebuilt (SEARCH_BACKEND='memory')
+SEARCH_INDEX_TTL = 300
+# Seconds before the category cache is reloaded even without a category write
+CATEGORY_CACHE_TTL = 300
+# Seconds a cached GET response is served for
+RESPONSE_CACHE_TTL = 30
+
+
+@on_write
+def sync_question_indexes(action, instance, changes=None):
+    # Keep the quiz pools and search index of the running app in step with question writes
+    if not (isinstance(instance, Question) or instance is Question):
+        return
+    for name in ('question_pool', 'search'):
+        index = current_app.extensions.get(name)
+        if index is None:
+            continue
+        if action == 'insert':
+            index.added(instance)
+        elif action == 'update':
+            index.updated(instance, changes)
+        elif action == 'bulk_insert':
+            index.bulk_added(changes)
+        elif action == 'delete':
+            index.removed(instance)
+
+
+@on_write
+def sync_category_cache(action, instance, changes=None):
+    # Any category write drops the cached category map of the running app
+    if not isinstance(instance, Category):
+        return
+    cache = current_app.extensions.get('category_cache')
+    if cache is not None:
+        cache.invalidate()
+
+
+@on_write
+def sync_response_cache(action, instance, changes=None):
+    # Any question or category write makes every cached response stale
+    cache = current_app.extensions.get('response_cache')
+    if cache is not None:
+        cache.bump()
+
+
+@on_write
+def stick_to_primary(action, instance, changes=None):
+    # Read from the primary until the replicas have the write too
+    replicas = current_app.extensions.get('replicas')
+    if replicas is not None:
+        replicas.wrote()
+
+
+def difficulty_plan(body):
+    # Difficulty options of a quiz request body (raises QuizOptionsError)
+    return DifficultyPlan.from_body(
+        body, per_level=current_app.config.get('QUIZ_QUESTIONS_PER_LEVEL', QUESTIONS_PER_LEVEL)
+    )
+
+
+# Request parsing and response bodies shared by these views and the async ones of flaskr.asgi
+def search_options(body):
+    """
+    Return (search term, include_answers, page, per_page) of a search request
+    body: 400 without a string term, 422 for invalid pagination. page is None
+    when every match is wanted.
+    """
+    search_term = body.get("searchTerm", None)
+    # Every search backend takes len() of the term or binds it as text
+    if not isinstance(search_term, str):
+        abort(400)
+
+    # Optional answer matching and pagination (every match when page is absent)
+    include_answers = bool(body.get("searchAnswers", False))
+    page = body.get("page", None)
+    per_page = body.get("per_page", QUESTIONS_PER_PAGE)
+    if page is not None:
+        try:
+            page = int(page)
+            per_page = min(int(per_page), MAX_QUESTIONS_PER_PAGE)
+        except (ValueError, TypeError):
+            abort(422)
+        if page <= 0 or per_page <= 0:
+            abort(422)
+    return search_term, include_answers, page, per_page
+
+
+def quiz_category(body):
+    # Category id a quiz request draws from, None for all (id 0); 422 without one
+    category = body.get('quiz_category')
+    if category is None:
+        abort(422)
+    return None if category["id"] == 0 else int(category["id"])
+
+
+def questions_response(rows, total_questions, **fields):
+    # List response of Question.columns() rows
+    return jsonify({
+        "success": True,
+        "questions": [ Question.format_row(row) for row in rows ],
+        "total_questions": total_questions,
+        **fields
+    }), 200
 
-from models import setup_db, Question, Category, db
 
-QUESTIONS_PER_PAGE = 10
+def quiz_response(question, **fields):
+    # Next quiz question, None once the quiz has ended
+    return jsonify({
+        "success": True,
+        **fields,
+        "question": question.format() if question is not None else None
+    })
+
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    # Settings can also come from TRIVIA_* environment variables (e.g. TRIVIA_CACHE_BACKEND=redis)
+    app.config.from_prefixed_env('TRIVIA')
 
     if test_config is None:
-        setup_db(app)
+        # TRIVIA_SQLALCHEMY_DATABASE_URI points a deployment at its database
+        database_path = app.config.get('SQLALCHEMY_DATABASE_URI', default_database_path)
     else:
         database_path = test_config.get('SQLALCHEMY_DATABASE_URI')
-        setup_db(app, database_path=database_path)
+        app.config.from_mapping(test_config)
+    # Pool sizing, pre-ping, recycle and statement timeout from the DB_* settings
+    setup_db(app, database_path=database_path, engine_options=engine_options(app.config, database_path))
 
+    # orjson when installed, the standard library json module otherwise
+    app.json = create_json_provider(app, app.config.get('JSON_PROVIDER', 'auto'))
     CORS(app)
+    register_commands(app)
+
+    app.extensions['question_pool'] = QuestionPool(
+        ttl=app.config.get('QUIZ_POOL_TTL', QUIZ_POOL_TTL),
+        # Seeded for reproducible quizzes (tests, demos), random otherwise
+        rng=random.Random(app.config['QUIZ_RANDOM_SEED']) if 'QUIZ_RANDOM_SEED' in app.config else None
+    )
+    # Local LRU or Redis, shared by the category and response caches
+    app.extensions['cache'] = cache_backend = create_cache_backend(app.config)
+    app.extensions['category_cache'] = CategoryCache(
+        cache_backend,
+        ttl=app.config.get('CATEGORY_CACHE_TTL', CATEGORY_CACHE_TTL)
+    )
+    app.extensions['response_cache'] = response_cache = ResponseCache(
+        cache_backend,
+        ttl=app.config.get('RESPONSE_CACHE_TTL', RESPONSE_CACHE_TTL),
+        max_age=app.config.get('RESPONSE_CACHE_MAX_AGE', 0)
+    )
+    # Quiz sessions share Redis with the other caches, locally they get their own LRU
+    if app.config.get('CACHE_BACKEND', 'local') == 'local':
+        quiz_backend = LocalCacheBackend(max_entries=app.config.get('QUIZ_MAX_SESSIONS', QUIZ_MAX_SESSIONS))
+    else:
+        quiz_backend = cache_backend
+    app.extensions['quiz_sessions'] = QuizSessionStore(
+        app.extensions['question_pool'],
+        quiz_backend,
+        ttl=app.config.get('QUIZ_SESSION_TTL', QUIZ_SESSION_TTL)
+    )
 
     with app.app_context():
+        # WAL, busy timeout and the other pragmas on every new SQLite connection
+        if db.engine.dialect.name == 'sqlite':
+            configure_sqlite(db.engine, sqlite_pragmas(app.config, database_path))
+        app.extensions['pool_metrics'] = PoolMetrics(
+            slow_checkout=app.config.get('DB_SLOW_CHECKOUT', DB_SLOW_CHECKOUT)
+        ).attach(db.engine)
+        # Open connections up front so the first requests skip the connect
+        if app.config.get('DB_POOL_PREWARM'):
+            prewarm(db.engine, app.config['DB_POOL_PREWARM'])
+        # A database without questions table gets the current schema from create_all()
+        fresh_database = not inspect(db.engine).has_table('questions')
         db.create_all()
+        # Bring databases created by older versions up to date (see migrations.py)
+        if app.config.get('AUTO_MIGRATE', True):
+            run_migrations(stamp_only=fresh_database)
+        ensure_question_counts()
+        app.extensions['search'] = create_search_backend(
+            app.config.get('SEARCH_BACKEND', 'auto'),
+            index_ttl=app.config.get('SEARCH_INDEX_TTL', SEARCH_INDEX_TTL)
+        )
+        # Quiz pools up front, rebuilt in the background every QUIZ_POOL_TTL
+        app.extensions['question_pool'].setup()
+        # cProfile of every request (PROFILE_ENABLED) or of those sending PROFILE_TOKEN
+        if app.config.get('PROFILE_ENABLED') or app.config.get('PROFILE_TOKEN'):
+            app.extensions['profiler'] = RequestProfiler(
+                directory=app.config.get('PROFILE_DIR'),
+                token=app.config.get('PROFILE_TOKEN'),
+                always=app.config.get('PROFILE_ENABLED', False)
+            )
+            app.extensions['profiler'].init_app(app)
+        # SQL statements of each request, for the slow request log and /metrics
+        app.extensions['query_log'] = QueryLog(
+            slow_threshold=app.config.get('SLOW_REQUEST_THRESHOLD', SLOW_REQUEST_THRESHOLD)
+        )
+        app.extensions['query_log'].init_app(app, db.engine)
+        # Reads of GET requests and read-only POSTs on the REPLICA_DATABASE_URIS, if any
+        if replica_uris(app.config):
+            app.extensions['replicas'] = ReplicaRouter.from_config(app.config)
+            app.extensions['replicas'].init_app(app)
+            for engine in app.extensions['replicas'].engines:
+                app.extensions['query_log'].watch(engine)
+        # Prometheus /metrics with per-endpoint latency and SQL timing
+        if app.config.get('METRICS_ENABLED', True):
+            app.extensions['metrics'] = Metrics()
+            app.extensions['metrics'].init_app(app)
 
     @app.after_request
     def after_request(response):
@@ -35,54 +255,31 @@ def create_app(test_config=None):
 
     # Questions endpoint
     @app.route('/questions', methods=['GET'])
+    @response_cache.cached
     def get_questions():
         #Get all questions and categories.
-        total_questions = Question.query.count()
-        categories_objects = Category.query.all()
-        categories = { category.id: category.type for category in categories_objects }
+        total_questions = count_questions(app.config.get('QUESTION_COUNT_MODE', 'exact'))
+        categories = app.extensions['category_cache'].get_all()
 
-        page_str = request.args.get("page", '1')
-        # Validate input and calculate offset
-        try:
-            # Attempt conversion to catch non-numeric strings
-            page = int(page_str)
-            # Check for invalid integer values
-            if page <= 0:
-                abort(422)
-            # Calculate offset (the number of items to skip)
-            offset = (page - 1) * QUESTIONS_PER_PAGE
-
-        except ValueError:
-            abort(422)
-        
-        # Pagination query
-        question_query = Question.query.order_by(Question.id)
-        # Apply limit of 10 and the calculated offset
-        questions_on_page = question_query.limit(QUESTIONS_PER_PAGE).offset(offset).all()
+        # Pagination query (page number or keyset cursor), fetching plain tuples
+        questions_on_page, next_cursor = paginate(Question.query.with_entities(*Question.columns()), Question.id)
 
         # Handle out of range page
         if not questions_on_page:
             abort(404)
 
-        # Format questions
-        formatted_questions = [ question.format() for question in questions_on_page ]
-
-        # Return response
-        return jsonify({
-            "success": True,
-            "questions": formatted_questions,
-            "total_questions": total_questions,
-            "categories": categories,
-            "current_category": "All"
-        }), 200
+        return questions_response(
+            questions_on_page, total_questions,
+            categories=categories, current_category="All", next_cursor=next_cursor
+        )
 
 
     # Categories endpoint
     @app.route("/categories", methods=["GET"])
+    @response_cache.cached
     def get_categories():
         # Get categories
-        categories_objects = Category.query.all()
-        categories = { category.id: category.type for category in categories_objects }
+        categories = app.extensions['category_cache'].get_all()
 
         if not categories:
             abort(404)
@@ -115,39 +312,22 @@ def create_app(test_config=None):
     def create_question():
         # Get body
         body = request.get_json()
-        # Get the values from the body
-        new_question = body.get("question", None)
-        new_answer = body.get("answer", None)
-        new_category = body.get("category", None)
-        new_difficulty = body.get("difficulty", None)
-        # Check if any required fields are missing
-        if not all([new_question, new_answer, new_category, new_difficulty]):
-            abort(422)
-        # Catch the bad data type and return 400.
-        # Explicitly validate that 'difficulty' and 'category' are integers.
-        # This is a preventative measure. The database is strict about its Integer
-        # columns and will throw a fatal error if it receives a non-numeric string
-        # (e.g., "three").
+        # Check the required fields (422) and that 'difficulty' and 'category'
+        # are integers (400), exactly like the bulk import does
         try:
-            int(new_difficulty)
-            int(new_category)
-        except (ValueError, TypeError):
-            abort(400)
+            fields = validate_question(body)
+        except QuestionValidationError as e:
+            abort(e.code)
         try:
             # Create a new Question instance
-            question = Question(
-                question=new_question,
-                answer=new_answer,
-                category=new_category,
-                difficulty=new_difficulty
-            )
+            question = Question(**fields)
             # Add new question
             question.insert()
             # Return successful response
             return jsonify({
                 "success": True,
                 "created": question.id,
-                "total_questions": Question.query.count()
+                "total_questions": count_questions(app.config.get('QUESTION_COUNT_MODE', 'exact'))
             }), 201
         except Exception as e:
             db.session.rollback()
@@ -156,55 +336,124 @@ def create_app(test_config=None):
         abort(422)
 
 
-    @app.route("/questions/search", methods=["POST"])
-    def search_questions():
-        # Get body
-        body = request.get_json()
-        # Get the values from the body
-        search_term = body.get("searchTerm", None)
-
-        # Check if search term is None
-        if search_term is None:
+    @app.route("/questions/bulk", methods=["POST"])
+    def bulk_create_questions():
+        # Pick the parser from ?format= or the Content-Type of the body
+        file_format = request.args.get("format")
+        if file_format is None:
+            file_format = "csv" if request.mimetype == "text/csv" else "ndjson"
+        if file_format not in PARSERS:
             abort(400)
-        
-        # Search results
-        search_results = Question.query.filter(
-            Question.question.ilike(f"%{search_term}%")
-        ).all()
 
-        # Format questions
-        formatted_questions = [ question.format() for question in search_results ]
+        # Read the body line by line instead of loading it whole
+        lines = io.TextIOWrapper(request.stream, encoding="utf-8")
+        try:
+            report = import_questions(PARSERS[file_format](lines))
+        except INPUT_ERRORS:
+            abort(400)
 
         return jsonify({
             "success": True,
-            "questions": formatted_questions,
-            "total_questions": len(search_results),
-            "current_category": None
+            **report.format(),
+            "total_questions": count_questions(app.config.get('QUESTION_COUNT_MODE', 'exact'))
         }), 200
 
 
+    @app.route("/questions/export", methods=["GET"])
+    def export_question_bank():
+        file_format = request.args.get("format", "ndjson")
+        if file_format not in EXPORT_FORMATS:
+            abort(400)
+        # Optional integer filters (type=int turns non-numeric values into None)
+        category = request.args.get("category", None, type=int)
+        difficulty = request.args.get("difficulty", None, type=int)
+        if "category" in request.args and category is None:
+            abort(422)
+        if "difficulty" in request.args and difficulty is None:
+            abort(422)
+
+        response = stream_response(
+            export_questions(file_format, category=category, difficulty=difficulty),
+            EXPORT_FORMATS[file_format][1]
+        )
+        response.headers["Content-Disposition"] = f"attachment; filename=questions.{file_format}"
+        return response
+
+
+    @app.route("/questions/search", methods=["POST"])
+    def search_questions():
+        # Search term and options of the body
+        search_term, include_answers, page, per_page = search_options(request.get_json())
+
+        # Search results
+        search_results, total_questions = app.extensions['search'].search(
+            search_term, include_answers=include_answers, page=page, per_page=per_page
+        )
+
+        return questions_response(search_results, total_questions, current_category=None)
+
+
     @app.route("/categories/<int:category_id>/questions", methods=["GET"])
+    @response_cache.cached
     def get_questions_by_category(category_id):
-        # Check if category exists in the db
-        category = Category.query.filter_by(id=category_id).first()
+        # Check if category exists
+        category = app.extensions['category_cache'].get(category_id)
         if category is None:
             abort(404)
 
-        # Search results
-        search_results = Question.query.filter(
-            Question.category == str(category_id)
-        ).all()
-        
-        # Format questions
-        formatted_questions = [ question.format() for question in search_results ]
-        
+        category_query = Question.query.with_entities(*Question.columns()).filter(
+            Question.category == category_id
+        )
+
+        # Opt-in streaming straight from a server-side cursor
+        stream = request.args.get("stream")
+        if stream == "ndjson":
+            return stream_response(
+                ndjson_lines(iter_questions(category_query)), "application/x-ndjson"
+            )
+        if stream == "json":
+            return stream_response(json_document(
+                iter_questions(category_query), success=True, current_category=category_id
+            ), "application/json")
+        if stream is not None:
+            abort(422)
+
+        if is_paginated():
+            # One page (page number or keyset cursor) out of the whole category
+            search_results, next_cursor = paginate(category_query, Question.id)
+            check_page_exists(search_results)
+            total_questions = count_questions(
+                app.config.get('QUESTION_COUNT_MODE', 'exact'), category=category_id
+            )
+        else:
+            # Search results
+            search_results = category_query.order_by(Question.id).all()
+            next_cursor = None
+            total_questions = len(search_results)
+
+        return questions_response(
+            search_results, total_questions, current_category=category_id, next_cursor=next_cursor
+        )
+    
+
+    @app.route("/quizzes/sessions", methods=["POST"])
+    def start_quiz_session():
+        try:
+            # Get body
+            body = request.get_json()
+
+            # Check the category to determine the question pool (None is all)
+            token = app.extensions['quiz_sessions'].start(quiz_category(body), difficulty_plan(body))
+        except QuizOptionsError:
+            abort(400)
+        except Exception as e:
+            abort(422)
+
         return jsonify({
             "success": True,
-            "questions": formatted_questions,
-            "total_questions": len(search_results),
-            "current_category": category_id
-        }), 200
-    
+            "session": token
+        }), 201
+
 
     @app.route("/quizzes", methods=["POST"])
     def get_questions_quiz():
@@ -212,40 +461,38 @@ def create_app(test_config=None):
             # Get body
             body = request.get_json()
 
-            # Get necessary payload information
+            # Serve the next question of a server-side session if a token is given
+            token = body.get('session')
+            if token is not None:
+                session = app.extensions['quiz_sessions'].get(token)
+                if session is None:
+                    abort(404)
+                chosen_question = app.extensions['quiz_sessions'].next_question(
+                    session, last_correct=body.get('last_correct')
+                )
+                return quiz_response(chosen_question, session=token)
+
+            # Get necessary payload information, the category determines the question pool
             previous_questions = body.get('previous_questions')
-            quiz_category = body.get('quiz_category')
-
-            # Check if the required keys are present
-            if previous_questions is None or quiz_category is None:
+            category = quiz_category(body)
+            if previous_questions is None:
                 abort(422)
 
-            # Check the category to determine the question
-            if quiz_category["id"] == 0:
-                # Get all questions
-                questions = Question.query.filter(Question.id.notin_(previous_questions)).all()
-            else:
-                # Get questions based on category
-                questions = Question.query.filter(
-                        Question.category == str(quiz_category["id"])
-                    ).filter(
-                        Question.id.notin_(previous_questions)
-                    ).all()
-            
-            # Check wether the quiz has ended or not
-            if len(questions) == 0:
-                return jsonify ({
-                    "success": True,
-                    "question": None
-                })
-            else:
-                chosen_question = random.choice(questions)
-                next_question = chosen_question.format()
-                return jsonify({
-                    "success": True,
-                    "question": next_question
-                })
+            # Pick a random unseen question (of the requested difficulties) without loading the candidates
+            chosen_question = app.extensions['question_pool'].next_question(
+                category, previous_questions, difficulty_plan(body), last_correct=body.get('last_correct')
+            )
+
+            # None once the quiz has ended
+            return quiz_response(chosen_question)
 
+        except HTTPException as e:
+            # Let an unknown session surface as a 404
+            if e.code == 404:
+                raise
+            abort(422)
+        except QuizOptionsError:
+            abort(400)
         except Exception as e:
             abort(422)
 
@@ -0,0 +1,499 @@
+"""
+Async serving mode. Run with an ASGI server, e.g.
+
+    uvicorn --factory flaskr.asgi:create_asgi_app --workers 4
+
+The read endpoints run as async views over an asyncio engine (asyncpg on
+Postgres, aiosqlite on SQLite), so a worker keeps serving other requests
+while the database works. Writes, bulk import/export, streams and every
+other route are served by the regular Flask views on a thread pool.
+"""
+import asyncio
+import contextvars
+import functools
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g, request, abort, jsonify
+from werkzeug.exceptions import HTTPException
+from sqlalchemy import select, func
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from models import Question, QuestionCount
+from . import (
+    create_app, difficulty_plan, search_options, quiz_category, questions_response, quiz_response
+)
+from .counts import ESTIMATE_QUERY
+from .pagination import check_page_exists, is_paginated, page_query, split_page
+from .pool import engine_options
+from .quiz import QuizOptionsError
+from .sqlite import configure_sqlite, sqlite_pragmas
+from .search import MemorySearch
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+# Threads running the Flask views that are not served asynchronously
+WSGI_THREADS = 8
+
+
+def async_database_uri(database_path):
+    # The same database through its asyncio driver
+    url = make_url(database_path)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"no async driver for {backend} databases")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def async_engine_options(config, database_path):
+    # The DB_* pool settings, minus what only applies to the sync engine
+    options = engine_options(config, database_path)
+    options.pop("poolclass", None)
+    connect_args = options.pop("connect_args", None)
+    if connect_args and config.get('DB_STATEMENT_TIMEOUT'):
+        # asyncpg takes server settings instead of libpq options
+        options["connect_args"] = {
+            "server_settings": { "statement_timeout": str(int(config['DB_STATEMENT_TIMEOUT'])) }
+        }
+    return options
+
+
+def wsgi_environ(scope, stream):
+    # The body is read from `stream` up to its end, whether or not a Content-Length is sent
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin1"),
+        "PATH_INFO": scope["path"].encode().decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": stream,
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    server = scope.get("server") or ("localhost", 80)
+    environ["SERVER_NAME"], environ["SERVER_PORT"] = server[0], str(server[1] or 80)
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope.get("headers", []):
+        name, value = name.decode("latin1"), value.decode("latin1")
+        if name in ("content-length", "content-type"):
+            environ[name.upper().replace("-", "_")] = value
+            continue
+        key = "HTTP_" + name.upper().replace("-", "_")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class ReceiveStream(io.RawIOBase):
+    """
+    ReceiveStream
+        wsgi.input of the views run on the thread pool: pulls the request
+        body from the ASGI `receive` channel, through the event loop, as the
+        view reads it, so large uploads are never held in memory whole.
+    """
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.chunk = memoryview(b"")
+        self.done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.chunk and not self.done:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message["type"] == "http.disconnect":
+                self.done = True
+                break
+            self.chunk = memoryview(message.get("body", b""))
+            self.done = not message.get("more_body", False)
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+
+async def read_body(receive):
+    # Whole body of the requests served by the async views, small JSON documents
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+class AsyncApp:
+    """
+    AsyncApp
+        ASGI application around a Flask app. GET /questions, GET /categories,
+        GET /categories/<id>/questions, POST /questions/search and POST
+        /quizzes run as coroutines on an asyncio engine inside the Flask
+        request context, so the app's hooks, caches, error handlers and
+        response shapes all apply. Everything else runs the Flask views on
+        a thread pool.
+    """
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        config = flask_app.config
+        database_path = config['SQLALCHEMY_DATABASE_URI']
+        self.engine = create_async_engine(
+            config.get('ASYNC_DATABASE_URI') or async_database_uri(database_path),
+            **async_engine_options(config, database_path)
+        )
+        if self.engine.dialect.name == 'sqlite':
+            configure_sqlite(self.engine.sync_engine, sqlite_pragmas(config, database_path))
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        flask_app.extensions['query_log'].watch(self.engine.sync_engine)
+        # Async engine of every replica, picked through g.read_engine like the sync ones
+        self.replica_engines = []
+        self.replica_sessions = {}
+        replicas = flask_app.extensions.get('replicas')
+        for engine in replicas.engines if replicas is not None else []:
+            replica_engine = create_async_engine(
+                async_database_uri(engine.url), **async_engine_options(config, engine.url)
+            )
+            if replica_engine.dialect.name == 'sqlite':
+                configure_sqlite(replica_engine.sync_engine, sqlite_pragmas(config, engine.url))
+            flask_app.extensions['query_log'].watch(replica_engine.sync_engine)
+            self.replica_engines.append(replica_engine)
+            self.replica_sessions[engine] = async_sessionmaker(replica_engine, expire_on_commit=False)
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.get('ASYNC_WSGI_THREADS', WSGI_THREADS), thread_name_prefix='trivia-wsgi'
+        )
+        self.routes = flask_app.url_map.bind("localhost")
+
+        response_cache = flask_app.extensions['response_cache']
+        run = functools.partial(self.cache_call, response_cache.backend)
+        # Flask endpoint -> (async view, whether the async view can serve the request)
+        self.views = {
+            'get_questions': (response_cache.cached_async(self.get_questions, run), None),
+            'get_categories': (response_cache.cached_async(self.get_categories, run), None),
+            'get_questions_by_category': (
+                response_cache.cached_async(self.get_questions_by_category, run),
+                # Streams come from the sync server-side cursor
+                lambda: "stream" not in request.args
+            ),
+            'search_questions': (
+                self.search_questions,
+                # The in-memory index is maintained by the sync views
+                lambda: not isinstance(self.flask_app.extensions['search'], MemorySearch)
+            ),
+            'get_questions_quiz': (self.get_questions_quiz, None),
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+
+        try:
+            endpoint, _ = self.routes.match(scope["path"], method=scope["method"])
+        except HTTPException:
+            endpoint = None
+        loop = asyncio.get_running_loop()
+        if endpoint in self.views:
+            # The async views parse their body on the loop, it has to be read first
+            environ = wsgi_environ(scope, io.BytesIO(await read_body(receive)))
+            response = await self.dispatch(environ, *self.views[endpoint])
+            if response is not None:
+                return await self.send_response(response, send)
+            environ["wsgi.input"].seek(0)
+        else:
+            environ = wsgi_environ(scope, io.BufferedReader(ReceiveStream(receive, loop)))
+        await loop.run_in_executor(self.executor, self.run_wsgi, environ, send, loop)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({ "type": "lifespan.startup.complete" })
+            elif message["type"] == "lifespan.shutdown":
+                await self.dispose()
+                self.executor.shutdown(wait=False)
+                await send({ "type": "lifespan.shutdown.complete" })
+                return
+
+    async def dispose(self):
+        await self.engine.dispose()
+        for engine in self.replica_engines:
+            await engine.dispose()
+
+    def session(self):
+        # Session on the replica the router picked for the request, the primary otherwise
+        return self.replica_sessions.get(g.get('read_engine'), self.sessions)()
+
+    async def cache_call(self, backend, call, *args):
+        """
+        Await call(*args), a method using the cache `backend`. Backends doing
+        I/O (Redis) are called on the thread pool, in the request's context.
+        """
+        if not backend.blocking:
+            return call(*args)
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, context.run, call, *args)
+
+    async def dispatch(self, environ, view, accepts):
+        """
+        Serve the request with `view` the way Flask's full_dispatch_request
+        does. Returns None when `accepts` leaves it to the sync view.
+        """
+        app = self.flask_app
+        ctx = app.request_context(environ)
+        ctx.push()
+        error = None
+        try:
+            if accepts is not None and not accepts():
+                return None
+            try:
+                rv = app.preprocess_request()
+                if rv is None:
+                    rv = await view(**request.view_args)
+            except Exception as e:
+                try:
+                    rv = app.handle_user_exception(e)
+                except Exception as e:
+                    error = e
+                    rv = app.handle_exception(e)
+            return app.finalize_request(rv)
+        finally:
+            ctx.pop(error)
+
+    async def send_response(self, response, send):
+        await send({
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": [
+                (name.lower().encode("latin1"), value.encode("latin1"))
+                for name, value in response.headers.items()
+            ],
+        })
+        await send({ "type": "http.response.body", "body": response.get_data() })
+
+    def run_wsgi(self, environ, send, loop):
+        # Runs on a pool thread; streamed bodies are sent chunk by chunk through the loop
+        def send_now(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = {}
+        def start_response(status, headers, exc_info=None):
+            started["status"], started["headers"] = int(status.split(" ", 1)[0]), headers
+
+        def send_start():
+            send_now({
+                "type": "http.response.start",
+                "status": started["status"],
+                "headers": [(name.lower().encode("latin1"), value.encode("latin1"))
+                            for name, value in started["headers"]],
+            })
+
+        body = self.flask_app(environ, start_response)
+        try:
+            headers_sent = False
+            for chunk in body:
+                if not headers_sent:
+                    send_start()
+                    headers_sent = True
+                if chunk:
+                    send_now({ "type": "http.response.body", "body": chunk, "more_body": True })
+            if not headers_sent:
+                send_start()
+            send_now({ "type": "http.response.body", "body": b"" })
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+
+    # Data access shared by the views
+    async def count_questions(self, session, category=None):
+        # Same as counts.count_questions
+        if self.flask_app.config.get('QUESTION_COUNT_MODE', 'exact') == 'estimate' and category is None \
+                and self.engine.dialect.name == 'postgresql':
+            estimate = (await session.execute(ESTIMATE_QUERY)).scalar()
+            if estimate is not None and estimate >= 0:
+                return estimate
+        return (await session.execute(QuestionCount.total_query(category))).scalar()
+
+    async def categories(self, session):
+        cache = self.flask_app.extensions['category_cache']
+        categories = await self.cache_call(cache.backend, cache.cached)
+        if categories is None:
+            rows = (await session.execute(cache.query)).all()
+            categories = await self.cache_call(cache.backend, cache.fill, rows)
+        return categories
+
+    async def quiz_pool(self, session, category):
+        question_pool = self.flask_app.extensions['question_pool']
+        if question_pool.pools is None:
+            # Only before setup(): load in a worker thread, one build at a time
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.load_quiz_pool)
+        return question_pool.pool_for(category)
+
+    def load_quiz_pool(self):
+        with self.flask_app.app_context():
+            self.flask_app.extensions['question_pool'].get_pool()
+
+    async def fetch(self, session, pool, excluded, seen):
+        # Same as QuestionPool.fetch, with the primary key lookup awaited
+        question_pool = self.flask_app.extensions['question_pool']
+        while True:
+            question_id = pool.pick(excluded, seen, question_pool.rng)
+            if question_id is None:
+                return None
+            question = await session.get(Question, question_id)
+            if question is not None:
+                return question
+            question_pool.forget(question_id)
+
+    async def next_session_question(self, session, quiz_session, last_correct=None):
+        # Same as QuizSessionStore.next_question, with the lookups awaited
+        sessions = self.flask_app.extensions['quiz_sessions']
+        await self.quiz_pool(session, quiz_session.category)
+        for level, pool, seen in sessions.levels(quiz_session, last_correct):
+            while True:
+                question_id = sessions.next_candidate(quiz_session, level)
+                if question_id is None:
+                    question = await self.fetch(session, pool, quiz_session.served, seen)
+                    break
+                question = await session.get(Question, question_id)
+                if question is not None:
+                    break
+                self.flask_app.extensions['question_pool'].forget(question_id)
+            if question is not None:
+                sessions.served(quiz_session, question)
+                break
+        else:
+            question = None
+        await self.cache_call(sessions.backend, sessions.save, quiz_session)
+        return question
+
+    # Async views, mirroring the sync ones in flaskr/__init__.py
+    async def get_questions(self):
+        async with self.session() as session:
+            total_questions = await self.count_questions(session)
+            categories = await self.categories(session)
+            query, per_page = page_query(select(*Question.columns()), Question.id)
+            questions_on_page, next_cursor = split_page((await session.execute(query)).all(), per_page)
+
+        if not questions_on_page:
+            abort(404)
+
+        return questions_response(
+            questions_on_page, total_questions,
+            categories=categories, current_category="All", next_cursor=next_cursor
+        )
+
+    async def get_categories(self):
+        async with self.session() as session:
+            categories = await self.categories(session)
+
+        if not categories:
+            abort(404)
+        return jsonify({
+            "success": True,
+            "categories": categories
+        }), 200
+
+    async def get_questions_by_category(self, category_id):
+        async with self.session() as session:
+            categories = await self.categories(session)
+            if categories.get(category_id) is None:
+                abort(404)
+
+            category_query = select(*Question.columns()).where(Question.category == category_id)
+            if is_paginated():
+                query, per_page = page_query(category_query, Question.id)
+                search_results, next_cursor = split_page((await session.execute(query)).all(), per_page)
+                check_page_exists(search_results)
+                total_questions = await self.count_questions(session, category=category_id)
+            else:
+                search_results = (await session.execute(category_query.order_by(Question.id))).all()
+                next_cursor = None
+                total_questions = len(search_results)
+
+        return questions_response(
+            search_results, total_questions, current_category=category_id, next_cursor=next_cursor
+        )
+
+    async def search_questions(self):
+        search_term, include_answers, page, per_page = search_options(request.get_json())
+
+        # ILIKE or trigram backend, same criterion and ranking as their search()
+        backend = self.flask_app.extensions['search']
+        query = select(*Question.columns()).where(
+            backend.criterion(search_term, include_answers)
+        ).order_by(*backend.ordering(search_term, include_answers))
+        async with self.session() as session:
+            if page is None:
+                search_results = (await session.execute(query)).all()
+                total_questions = len(search_results)
+            else:
+                total_questions = (await session.execute(
+                    select(func.count()).select_from(query.order_by(None).subquery())
+                )).scalar()
+                search_results = (await session.execute(
+                    query.limit(per_page).offset((page - 1) * per_page)
+                )).all()
+
+        return questions_response(search_results, total_questions, current_category=None)
+
+    async def get_questions_quiz(self):
+        try:
+            body = request.get_json()
+
+            token = body.get('session')
+            if token is not None:
+                sessions = self.flask_app.extensions['quiz_sessions']
+                quiz_session = await self.cache_call(sessions.backend, sessions.get, token)
+                if quiz_session is None:
+                    abort(404)
+                async with self.session() as session:
+                    chosen_question = await self.next_session_question(
+                        session, quiz_session, last_correct=body.get('last_correct')
+                    )
+                return quiz_response(chosen_question, session=token)
+
+            previous_questions = body.get('previous_questions')
+            category = quiz_category(body)
+            if previous_questions is None:
+                abort(422)
+
+            plan = difficulty_plan(body)
+            async with self.session() as session:
+                await self.quiz_pool(session, category)
+                chosen_question = None
+                for pool, excluded, seen in self.flask_app.extensions['question_pool'].candidates(
+                    category, previous_questions, plan, last_correct=body.get('last_correct')
+                ):
+                    chosen_question = await self.fetch(session, pool, excluded, seen)
+                    if chosen_question is not None:
+                        break
+
+            return quiz_response(chosen_question)
+
+        except HTTPException as e:
+            # Let an unknown session surface as a 404
+            if e.code == 404:
+                raise
+            abort(422)
+        except QuizOptionsError:
+            abort(400)
+        except Exception as e:
+            abort(422)
+
+
+def create_asgi_app(test_config=None):
+    return AsyncApp(create_app(test_config))
@@ -0,0 +1,172 @@
+import csv
+import json
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Question
+from .streaming import iter_questions, ndjson_lines, csv_lines
+
+# Rows sent to the database per INSERT statement
+IMPORT_BATCH_SIZE = 1000
+# Row errors listed in an import report, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+# An upload that is not UTF-8 or not CSV ends the import, rows of earlier batches stay inserted
+INPUT_ERRORS = (UnicodeDecodeError, csv.Error)
+
+
+class QuestionValidationError(Exception):
+    """
+    QuestionValidationError
+        a question payload was rejected, `code` is the HTTP status that
+        POST /questions answers with
+    """
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def validate_question(data):
+    """
+    Check a question payload the way POST /questions does and return the
+    column values to insert. Raises QuestionValidationError.
+    """
+    if not isinstance(data, dict):
+        raise QuestionValidationError(422, "question must be an object")
+    new_question = data.get("question", None)
+    new_answer = data.get("answer", None)
+    new_category = data.get("category", None)
+    new_difficulty = data.get("difficulty", None)
+    # Check if any required fields are missing
+    if not all([new_question, new_answer, new_category, new_difficulty]):
+        raise QuestionValidationError(422, "question, answer, category and difficulty are required")
+    # Explicitly validate that 'difficulty' and 'category' are integers.
+    # The database is strict about its Integer columns and will throw a fatal
+    # error if it receives a non-numeric string (e.g., "three").
+    try:
+        int(new_difficulty)
+        int(new_category)
+    except (ValueError, TypeError):
+        raise QuestionValidationError(400, "category and difficulty must be integers")
+    return {
+        "question": new_question,
+        "answer": new_answer,
+        "category": int(new_category),
+        "difficulty": int(new_difficulty)
+    }
+
+
+def parse_ndjson(lines):
+    # Yield (line number, payload or None, error or None) per non-blank line
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line), None
+        except ValueError:
+            yield line_number, None, "invalid JSON"
+
+
+def parse_csv(lines):
+    # The header row names the columns; line numbers count it as line 1
+    for line_number, row in enumerate(csv.DictReader(lines), start=2):
+        yield line_number, row, None
+
+
+PARSERS = {
+    "ndjson": parse_ndjson,
+    "csv": parse_csv,
+}
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        self.started_at = time.perf_counter()
+        self.seconds = 0
+
+    def error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({ "line": line_number, "error": message })
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started_at
+        return self
+
+    @property
+    def rows_per_second(self):
+        return round(self.inserted / self.seconds, 1) if self.seconds else 0.0
+
+    def format(self):
+        return {
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+            "rows_per_second": self.rows_per_second
+        }
+
+
+def flush_batch(batch, report):
+    rows = [row for _, row in batch]
+    try:
+        Question.bulk_insert(rows)
+        report.inserted += len(rows)
+    except SQLAlchemyError:
+        db.session.rollback()
+        # Retry row by row so only the offending rows are reported
+        for line_number, row in batch:
+            try:
+                Question.bulk_insert([row])
+                report.inserted += 1
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                report.error(line_number, str(e.orig if hasattr(e, "orig") else e))
+
+
+def import_questions(records, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Validate and insert the (line number, payload, parse error) records of a
+    parser in batches of `batch_size`. Returns an ImportReport.
+    """
+    report = ImportReport()
+    batch = []
+    for line_number, payload, parse_error in records:
+        if parse_error is not None:
+            report.error(line_number, parse_error)
+            continue
+        try:
+            batch.append((line_number, validate_question(payload)))
+        except QuestionValidationError as e:
+            report.error(line_number, e.message)
+            continue
+        if len(batch) == batch_size:
+            flush_batch(batch, report)
+            batch = []
+    if batch:
+        flush_batch(batch, report)
+    return report.finish()
+
+
+EXPORT_FORMATS = {
+    "ndjson": (ndjson_lines, "application/x-ndjson"),
+    "csv": (csv_lines, "text/csv"),
+}
+
+
+def export_questions(file_format="ndjson", category=None, difficulty=None):
+    """
+    Yield the question bank, optionally filtered by category and difficulty,
+    as NDJSON or CSV text read through a server-side cursor.
+    """
+    query = Question.query
+    if category is not None:
+        query = query.filter(Question.category == category)
+    if difficulty is not None:
+        query = query.filter(Question.difficulty == difficulty)
+    formatter, _ = EXPORT_FORMATS[file_format]
+    return formatter(iter_questions(query))
@@ -0,0 +1,256 @@
+import functools
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, request, make_response, current_app
+
+from sqlalchemy import select
+
+from models import db, Category
+
+try:
+    import redis
+except ImportError:  # only needed for CACHE_BACKEND='redis'
+    redis = None
+
+
+class LocalCacheBackend:
+    """
+    LocalCacheBackend
+        process-local LRU of at most `max_entries` values with optional
+        per-key expiry. Every worker process holds its own copy, shared by
+        its threads under a lock.
+    """
+    # Calls never wait on I/O, the async views make them on the event loop
+    blocking = False
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # Reentrant, incr() reads and writes under one hold
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and time.monotonic() > expires_at:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def incr(self, key):
+        with self.lock:
+            value = (self.get(key) or 0) + 1
+            self.set(key, value)
+            return value
+
+
+class RedisCacheBackend:
+    """
+    RedisCacheBackend
+        cache shared by every worker through a Redis-protocol server. Values
+        are stored as JSON under `prefix`; size is bounded by the server's
+        own eviction policy (e.g. maxmemory-policy allkeys-lru).
+    """
+    # Every call is a round trip, the async views make them on a thread
+    blocking = True
+
+    def __init__(self, client, prefix='trivia:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        # Redis rejects ex=0, and such a value would be expired already
+        if ttl is not None and ttl <= 0:
+            return
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+
+def create_cache_backend(config):
+    """
+    Build the cache backend named by CACHE_BACKEND: 'local' (default) or
+    'redis', which connects to CACHE_REDIS_URL unless a ready client is
+    given as CACHE_REDIS_CLIENT (e.g. a fakeredis instance in tests).
+    """
+    name = config.get('CACHE_BACKEND', 'local')
+    if name == 'local':
+        return LocalCacheBackend(max_entries=config.get('CACHE_MAX_ENTRIES', 512))
+    if name == 'redis':
+        client = config.get('CACHE_REDIS_CLIENT')
+        if client is None:
+            if redis is None:
+                raise RuntimeError("CACHE_BACKEND='redis' requires the redis package")
+            client = redis.Redis.from_url(config.get('CACHE_REDIS_URL', 'redis://localhost:6379/0'))
+        return RedisCacheBackend(client, prefix=config.get('CACHE_KEY_PREFIX', 'trivia:'))
+    raise ValueError(f"unknown cache backend {name!r}")
+
+
+class CategoryCache:
+    """
+    CategoryCache
+        {id: type} map of the categories kept in the cache backend. Dropped
+        by the model write hooks and expired after `ttl` seconds as a
+        fallback for writes the hooks never saw.
+    """
+    key = 'categories'
+    query = select(Category.id, Category.type).order_by(Category.id)
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        self.backend.delete(self.key)
+
+    def cached(self):
+        # Stored as [id, type] pairs since JSON object keys are always strings
+        pairs = self.backend.get(self.key)
+        if pairs is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return { category_id: category_type for category_id, category_type in pairs }
+
+    def fill(self, rows):
+        # Cache the (id, type) rows of `query` and return them as a map
+        pairs = [ [category_id, category_type] for category_id, category_type in rows ]
+        self.backend.set(self.key, pairs, ttl=self.ttl)
+        return { category_id: category_type for category_id, category_type in pairs }
+
+    def get_all(self):
+        categories = self.cached()
+        if categories is None:
+            categories = self.fill(db.session.execute(self.query).all())
+        return categories
+
+    def get(self, category_id):
+        # Type of the category, None if it does not exist
+        return self.get_all().get(category_id)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+class ResponseCache:
+    """
+    ResponseCache
+        cache of successful GET responses keyed by path and query string.
+        Keys embed a version stored in the cache backend and bumped on every
+        question/category write, so one increment invalidates every worker.
+        Entries expire after `ttl` seconds. Responses carry a content-based
+        ETag, and a matching If-None-Match on a cached entry is answered with
+        304 without running the view. A `ttl` of 0 turns the cache off, the
+        ETags stay; so does g.skip_response_cache for a single request (clients
+        flaskr.replicas keeps on the primary).
+    """
+    version_key = 'responses:version'
+
+    def __init__(self, backend, ttl=30, max_age=0):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self):
+        self.backend.incr(self.version_key)
+
+    def make_key(self):
+        version = self.backend.get(self.version_key) or 0
+        query = "&".join(f"{name}={value}" for name, value in sorted(request.args.items(multi=True)))
+        return f"responses:{version}:{request.path}?{query}"
+
+    def conditional(self, etag, body, mimetype):
+        # 304 when the client already holds this representation
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(body, status=200, mimetype=mimetype)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = f"max-age={self.max_age}, must-revalidate"
+        return response
+
+    def lookup(self):
+        # (key, cached response or None) for the current request, no key when the cache is off
+        if self.ttl <= 0 or g.get('skip_response_cache'):
+            return None, None
+        key = self.make_key()
+        entry = self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+            return key, None
+        self.hits += 1
+        return key, self.conditional(entry["etag"], entry["body"], entry["mimetype"])
+
+    def store(self, key, response):
+        # Streamed bodies are never buffered into the cache
+        if response.status_code != 200 or response.is_streamed:
+            return response
+        body = response.get_data(as_text=True)
+        etag = hashlib.sha1(body.encode()).hexdigest()
+        if key is not None:
+            self.backend.set(key, {
+                "etag": etag,
+                "body": body,
+                "mimetype": response.mimetype
+            }, ttl=self.ttl)
+        return self.conditional(etag, body, response.mimetype)
+
+    def cached(self, view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key, response = self.lookup()
+            if response is not None:
+                return response
+            return self.store(key, make_response(view(*args, **kwargs)))
+        return wrapper
+
+    def cached_async(self, view, run):
+        # Same as cached() for the async views of flaskr.asgi, backend calls are awaited through run(call, *args)
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            key, response = await run(self.lookup)
+            if response is not None:
+                return response
+            return await run(self.store, key, make_response(await view(*args, **kwargs)))
+        return wrapper
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses
+        }
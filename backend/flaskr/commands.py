@@ -0,0 +1,62 @@
+import click
+from flask.cli import with_appcontext
+
+from .bulk import PARSERS, IMPORT_BATCH_SIZE, INPUT_ERRORS, EXPORT_FORMATS, import_questions, export_questions
+from .streaming import chunked
+from .migrations import run_migrations
+
+
+@click.command("import-questions")
+@click.argument("source", type=click.File("r", encoding="utf-8"))
+@click.option("--format", "file_format", type=click.Choice(sorted(PARSERS)), default=None,
+              help="Input format, guessed from the file extension by default.")
+@click.option("--batch-size", type=int, default=IMPORT_BATCH_SIZE, show_default=True,
+              help="Rows per INSERT statement.")
+@with_appcontext
+def import_questions_command(source, file_format, batch_size):
+    """Bulk load questions from an NDJSON or CSV file ('-' for stdin)."""
+    if file_format is None:
+        file_format = "csv" if source.name.endswith(".csv") else "ndjson"
+    try:
+        report = import_questions(PARSERS[file_format](source), batch_size=batch_size)
+    except INPUT_ERRORS as e:
+        raise click.ClickException(f"unreadable {file_format} input: {e}")
+
+    for error in report.errors:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(
+        f"Imported {report.inserted} questions ({report.failed} failed) "
+        f"in {report.seconds:.2f}s, {report.rows_per_second} rows/s"
+    )
+
+
+@click.command("export-questions")
+@click.argument("target", type=click.File("w", encoding="utf-8"), default="-")
+@click.option("--format", "file_format", type=click.Choice(sorted(EXPORT_FORMATS)), default=None,
+              help="Output format, guessed from the file extension by default.")
+@click.option("--category", type=int, default=None, help="Only export this category id.")
+@click.option("--difficulty", type=int, default=None, help="Only export this difficulty.")
+@with_appcontext
+def export_questions_command(target, file_format, category, difficulty):
+    """Stream the question bank to an NDJSON or CSV file (stdout by default)."""
+    if file_format is None:
+        file_format = "csv" if target.name.endswith(".csv") else "ndjson"
+    for chunk in chunked(export_questions(file_format, category=category, difficulty=difficulty)):
+        target.write(chunk)
+
+
+@click.command("migrate-db")
+@with_appcontext
+def migrate_db_command():
+    """Apply the pending schema migrations."""
+    applied = run_migrations()
+    for name in applied:
+        click.echo(f"Applied {name}")
+    if not applied:
+        click.echo("Schema is up to date")
+
+
+def register_commands(app):
+    app.cli.add_command(import_questions_command)
+    app.cli.add_command(export_questions_command)
+    app.cli.add_command(migrate_db_command)
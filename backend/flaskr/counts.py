@@ -0,0 +1,33 @@
+from sqlalchemy import text
+
+from models import db, QuestionCount
+
+# Planner row estimate of the questions table, refreshed by ANALYZE/autovacuum
+ESTIMATE_QUERY = text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'questions'")
+
+
+def estimate_questions():
+    # Planner estimate from the last ANALYZE, None when there is none
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    estimate = db.session.execute(ESTIMATE_QUERY).scalar()
+    return estimate if estimate is not None and estimate >= 0 else None
+
+
+def count_questions(mode='exact', category=None):
+    """
+    Number of questions, optionally of one category. 'exact' sums the
+    per-category counters; 'estimate' answers totals from pg_class.reltuples
+    on Postgres and falls back to the counters everywhere else.
+    """
+    if mode == 'estimate' and category is None:
+        estimate = estimate_questions()
+        if estimate is not None:
+            return estimate
+    return QuestionCount.total_for(category)
+
+
+def ensure_question_counts():
+    # Backfill the counters of a database created before they existed
+    if db.session.query(QuestionCount).first() is None:
+        QuestionCount.rebuild()
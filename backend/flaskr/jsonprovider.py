@@ -0,0 +1,56 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # only needed for JSON_PROVIDER='orjson' (or 'auto' picking it)
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    OrjsonProvider
+        Flask JSON provider backed by orjson, which encodes responses
+        straight to UTF-8 bytes. Keys are sorted like the default provider
+        and dates, decimals and dataclasses still go through its `default`
+        conversions, so the documents only differ in non-ASCII characters
+        not being escaped.
+    """
+    def options(self):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        return option | orjson.OPT_SORT_KEYS if self.sort_keys else option
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # json.dumps() arguments (indent, separators, ...) orjson does not take
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.options()).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        option = self.options() | orjson.OPT_APPEND_NEWLINE
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=option), mimetype=self.mimetype
+        )
+
+
+def create_json_provider(app, name='auto'):
+    """
+    Build the JSON provider called `name` for `app`: 'orjson', 'default'
+    (the standard library json module) or 'auto', orjson when installed.
+    """
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'default'
+    if name == 'orjson':
+        if orjson is None:
+            raise RuntimeError("JSON_PROVIDER='orjson' requires the orjson package")
+        return OrjsonProvider(app)
+    if name == 'default':
+        return DefaultJSONProvider(app)
+    raise ValueError(f"unknown JSON provider {name!r}")
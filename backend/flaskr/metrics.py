@@ -0,0 +1,141 @@
+import time
+
+from flask import request, current_app
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from .querylog import current_statements
+
+# Request latency buckets in seconds, from a cached hit to a slow search
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# SQL statements per request
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+QUERY_TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+
+class AppStatsCollector:
+    """
+    AppStatsCollector
+        exports the hit/miss counters of the caches and the connection pool
+        stats of an app at scrape time
+    """
+    caches = ('category_cache', 'response_cache')
+
+    def __init__(self, app):
+        self.app = app
+
+    def collect(self):
+        hits = CounterMetricFamily('trivia_cache_hits', 'Cache lookups answered from the cache', labels=['cache'])
+        misses = CounterMetricFamily('trivia_cache_misses', 'Cache lookups that went to the database', labels=['cache'])
+        ratio = GaugeMetricFamily('trivia_cache_hit_ratio', 'Share of cache lookups that were hits', labels=['cache'])
+        for name in self.caches:
+            cache = self.app.extensions.get(name)
+            if cache is None:
+                continue
+            stats = cache.stats()
+            lookups = stats["hits"] + stats["misses"]
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            ratio.add_metric([name], stats["hits"] / lookups if lookups else 0)
+        yield hits
+        yield misses
+        yield ratio
+
+        pool_metrics = self.app.extensions.get('pool_metrics')
+        if pool_metrics is None:
+            return
+        stats = pool_metrics.stats()
+        yield GaugeMetricFamily('trivia_db_pool_checked_out', 'Connections currently checked out', value=stats["checked_out"])
+        yield GaugeMetricFamily('trivia_db_pool_peak_checked_out', 'Most connections checked out at once', value=stats["peak_checked_out"])
+        if stats["saturation"] is not None:
+            yield GaugeMetricFamily('trivia_db_pool_saturation', 'Checked out connections over pool capacity', value=stats["saturation"])
+        if stats["p99_wait_ms"] is not None:
+            yield GaugeMetricFamily('trivia_db_pool_checkout_wait_p99_seconds', 'p99 of recent checkout waits', value=stats["p99_wait_ms"] / 1000)
+        yield CounterMetricFamily('trivia_db_pool_checkouts', 'Connection checkouts', value=stats["checkouts"])
+        yield CounterMetricFamily('trivia_db_pool_timeouts', 'Checkouts that timed out waiting for a connection', value=stats["timeouts"])
+        yield CounterMetricFamily('trivia_db_pool_invalidations', 'Connections invalidated, e.g. after a failed pre-ping', value=stats["invalidations"])
+
+
+class Metrics:
+    """
+    Metrics
+        Prometheus instrumentation of an app: per-endpoint latency, in-flight
+        requests and status counts, plus the SQL statements and SQL time of
+        each request, as recorded by the QueryLog. Every app has its own
+        registry, so each worker process reports its own series.
+    """
+    def __init__(self):
+        self.registry = CollectorRegistry()
+        self.latency = Histogram(
+            'trivia_request_duration_seconds', 'Request latency', ['endpoint', 'method'],
+            buckets=LATENCY_BUCKETS, registry=self.registry
+        )
+        self.in_flight = Gauge(
+            'trivia_requests_in_flight', 'Requests being served', ['endpoint'], registry=self.registry
+        )
+        self.responses = Counter(
+            'trivia_responses', 'Responses sent', ['endpoint', 'method', 'status'], registry=self.registry
+        )
+        self.query_count = Histogram(
+            'trivia_request_queries', 'SQL statements run by a request', ['endpoint'],
+            buckets=QUERY_COUNT_BUCKETS, registry=self.registry
+        )
+        self.query_time = Histogram(
+            'trivia_request_query_seconds', 'Time spent in SQL by a request', ['endpoint'],
+            buckets=QUERY_TIME_BUCKETS, registry=self.registry
+        )
+        self.children = {}
+        self.statuses = {}
+
+    def init_app(self, app):
+        self.registry.register(AppStatsCollector(app))
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        app.add_url_rule('/metrics', 'metrics', self.export, methods=['GET'])
+
+    def series(self, endpoint, method):
+        # labels() is comparatively slow, so the children of each route are looked up once
+        key = (endpoint, method)
+        children = self.children.get(key)
+        if children is None:
+            children = self.children[key] = (
+                self.latency.labels(endpoint, method),
+                self.in_flight.labels(endpoint),
+                self.query_count.labels(endpoint),
+                self.query_time.labels(endpoint),
+            )
+        return children
+
+    def before_request(self):
+        # The route pattern, never the raw path, keeps the label set bounded
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        series = self.series(endpoint, request.method)
+        request.environ['trivia.metrics'] = (time.perf_counter(), endpoint, series)
+        series[1].inc()
+
+    def after_request(self, response):
+        state = request.environ.get('trivia.metrics')
+        if state is None:
+            return response
+        started, endpoint, (latency, _, query_count, query_time) = state
+        latency.observe(time.perf_counter() - started)
+        key = (endpoint, request.method, response.status_code)
+        status = self.statuses.get(key)
+        if status is None:
+            status = self.statuses[key] = self.responses.labels(*key)
+        status.inc()
+        statements = current_statements()
+        if statements is not None:
+            query_count.observe(len(statements))
+            query_time.observe(sum(seconds for _, seconds in statements))
+        return response
+
+    def teardown_request(self, exception):
+        state = request.environ.pop('trivia.metrics', None)
+        if state is None:
+            return
+        state[2][1].dec()
+
+    def export(self):
+        return current_app.response_class(generate_latest(self.registry), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,156 @@
+import logging
+
+from sqlalchemy import Integer, inspect, insert, select, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, SchemaMigration
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key so concurrent workers apply migrations one at a time on Postgres
+MIGRATION_LOCK_ID = 7264921
+
+"""
+MIGRATIONS
+    ordered (name, function, outside_models) triples. Each function receives
+    a connection inside the migration transaction and must be a no-op on a
+    schema that already matches models.py, since create_all() builds new
+    databases. Migrations `outside_models` build what models.py cannot
+    declare, so they run on new databases too.
+"""
+MIGRATIONS = []
+
+
+def migration(name, outside_models=False):
+    def register(apply):
+        MIGRATIONS.append((name, apply, outside_models))
+        return apply
+    return register
+
+
+def run_migrations(stamp_only=False):
+    """
+    Apply the pending migrations in order and record them in
+    schema_migrations. With `stamp_only` those create_all() covers are only
+    recorded, for a schema it has just built. Returns the names of the
+    migrations.
+    """
+    applied_now = []
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        applied = set(connection.execute(select(SchemaMigration.name)).scalars())
+        for name, apply, outside_models in MIGRATIONS:
+            if name in applied:
+                continue
+            if outside_models or not stamp_only:
+                logger.info("Applying schema migration %s", name)
+                apply(connection)
+            connection.execute(insert(SchemaMigration).values(name=name))
+            applied_now.append(name)
+    return applied_now
+
+
+@migration("0001_question_category_integer_fk")
+def question_category_integer_fk(connection):
+    # questions.category used to be free text: make it an indexed integer FK to categories.id
+    inspector = inspect(connection)
+    column = next(c for c in inspector.get_columns('questions') if c['name'] == 'category')
+    is_integer = isinstance(column['type'], Integer)
+    has_foreign_key = any(
+        fk['constrained_columns'] == ['category'] and fk['referred_table'] == 'categories'
+        for fk in inspector.get_foreign_keys('questions')
+    )
+
+    if connection.dialect.name == 'sqlite':
+        # SQLite cannot alter a column type or add a constraint, rebuild the table
+        if not (is_integer and has_foreign_key):
+            connection.execute(text(
+                "CREATE TABLE questions_migrated ("
+                "id INTEGER NOT NULL PRIMARY KEY, "
+                "question VARCHAR NOT NULL, "
+                "answer VARCHAR NOT NULL, "
+                "category INTEGER NOT NULL REFERENCES categories (id), "
+                "difficulty INTEGER NOT NULL)"
+            ))
+            connection.execute(text(
+                "INSERT INTO questions_migrated (id, question, answer, category, difficulty) "
+                "SELECT id, question, answer, CAST(category AS INTEGER), difficulty FROM questions"
+            ))
+            connection.execute(text("DROP TABLE questions"))
+            connection.execute(text("ALTER TABLE questions_migrated RENAME TO questions"))
+    else:
+        if not is_integer:
+            connection.execute(text(
+                "ALTER TABLE questions ALTER COLUMN category TYPE integer USING category::integer"
+            ))
+        if not has_foreign_key:
+            connection.execute(text(
+                "ALTER TABLE questions ADD CONSTRAINT questions_category_fkey "
+                "FOREIGN KEY (category) REFERENCES categories (id)"
+            ))
+
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_category_id ON questions (category, id)"
+    ))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_category_difficulty ON questions (category, difficulty)"
+    ))
+    # Refresh planner statistics for the new column type and indexes
+    connection.execute(text("ANALYZE questions"))
+
+
+@migration("0002_question_counts_category_integer_fk")
+def question_counts_category_integer_fk(connection):
+    # question_counts.category was text too: make it an integer FK to categories.id, like questions.category
+    inspector = inspect(connection)
+    column = next(c for c in inspector.get_columns('question_counts') if c['name'] == 'category')
+    if isinstance(column['type'], Integer):
+        return
+
+    # Counters of deleted categories would break the foreign key, they count no questions
+    connection.execute(text(
+        "DELETE FROM question_counts WHERE category NOT IN (SELECT CAST(id AS VARCHAR) FROM categories)"
+    ))
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text(
+            "CREATE TABLE question_counts_migrated ("
+            "category INTEGER NOT NULL PRIMARY KEY REFERENCES categories (id) ON DELETE CASCADE, "
+            "total INTEGER NOT NULL)"
+        ))
+        connection.execute(text(
+            "INSERT INTO question_counts_migrated (category, total) "
+            "SELECT CAST(category AS INTEGER), total FROM question_counts"
+        ))
+        connection.execute(text("DROP TABLE question_counts"))
+        connection.execute(text("ALTER TABLE question_counts_migrated RENAME TO question_counts"))
+    else:
+        connection.execute(text(
+            "ALTER TABLE question_counts ALTER COLUMN category TYPE integer USING category::integer"
+        ))
+        connection.execute(text(
+            "ALTER TABLE question_counts ADD CONSTRAINT question_counts_category_fkey "
+            "FOREIGN KEY (category) REFERENCES categories (id) ON DELETE CASCADE"
+        ))
+
+
+@migration("0003_question_trigram_indexes", outside_models=True)
+def question_trigram_indexes(connection):
+    # pg_trgm GIN indexes for the trigram search backend, Postgres only
+    if connection.dialect.name != 'postgresql':
+        return
+    try:
+        with connection.begin_nested():
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except SQLAlchemyError as e:
+        # Missing contrib package or privileges: search falls back to ILIKE
+        logger.warning("pg_trgm unavailable, trigram indexes not created: %s", e)
+        return
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_question_trgm "
+        "ON questions USING gin (question gin_trgm_ops)"
+    ))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_answer_trgm "
+        "ON questions USING gin (answer gin_trgm_ops)"
+    ))
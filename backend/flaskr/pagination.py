@@ -0,0 +1,122 @@
+import base64
+import binascii
+
+from flask import request, abort
+
+QUESTIONS_PER_PAGE = 10
+# Upper bound for the per_page query parameter
+MAX_QUESTIONS_PER_PAGE = 100
+
+
+def encode_cursor(last_id):
+    # Opaque token wrapping the id of the last row the client has seen
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        prefix, last_id = base64.urlsafe_b64decode(padded).decode().split(":")
+        if prefix != "id":
+            raise ValueError(cursor)
+        return int(last_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        abort(422)
+
+
+def positive_int_arg(name, default):
+    # Read a positive integer query parameter, 422 on anything else
+    value = request.args.get(name, default)
+    try:
+        value = int(value)
+    except (ValueError, TypeError):
+        abort(422)
+    if value <= 0:
+        abort(422)
+    return value
+
+
+def get_per_page(max_per_page=MAX_QUESTIONS_PER_PAGE):
+    # The page size is capped server-side rather than rejected
+    return min(positive_int_arg("per_page", QUESTIONS_PER_PAGE), max_per_page)
+
+
+def get_after_id():
+    """
+    Return the id to seek after for keyset pagination, taken from the opaque
+    `cursor` or the raw `after_id` parameter, or None when paging by offset.
+    """
+    cursor = request.args.get("cursor")
+    if cursor is not None:
+        return decode_cursor(cursor)
+    if request.args.get("after_id") is not None:
+        try:
+            after_id = int(request.args["after_id"])
+        except ValueError:
+            abort(422)
+        if after_id < 0:
+            abort(422)
+        return after_id
+    return None
+
+
+def get_page():
+    page_str = request.args.get("page", '1')
+    # Validate input
+    try:
+        # Attempt conversion to catch non-numeric strings
+        page = int(page_str)
+    except ValueError:
+        abort(422)
+    # Check for invalid integer values
+    if page <= 0:
+        abort(422)
+    return page
+
+
+def paginate(query, id_column):
+    """
+    Apply the page/cursor/after_id/per_page parameters of the request to a
+    query. Returns the rows of the page and the cursor of the next one
+    (None on the last page).
+    """
+    query, per_page = page_query(query, id_column)
+    return split_page(query.all(), per_page)
+
+
+def page_query(query, id_column):
+    """
+    Apply the pagination parameters of the request to a Query or select().
+    Returns it, limited to one row past the page, and the page size.
+    """
+    per_page = get_per_page()
+    after_id = get_after_id()
+
+    query = query.order_by(id_column)
+    if after_id is not None:
+        # Keyset pagination: seek past the last seen id instead of skipping rows
+        query = query.filter(id_column > after_id)
+    else:
+        # Calculate offset (the number of items to skip)
+        query = query.offset((get_page() - 1) * per_page)
+
+    # Fetch one extra row to know whether there is a next page
+    return query.limit(per_page + 1), per_page
+
+
+def split_page(rows, per_page):
+    # Rows of the page and the cursor of the next one, from page_query() results
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    return rows, encode_cursor(rows[-1].id) if has_more else None
+
+
+def is_paginated():
+    # Whether the request asked for any kind of pagination
+    return any(name in request.args for name in ("page", "per_page", "cursor", "after_id"))
+
+
+def check_page_exists(rows):
+    # 404 for an empty page past the first one of a listing that may be empty
+    if not rows and "page" in request.args and request.args["page"] != "1":
+        abort(404)
@@ -0,0 +1,190 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, StaticPool
+
+logger = logging.getLogger(__name__)
+
+# Seconds before a pooled connection is replaced, so connections never outlive a failover for long
+DB_POOL_RECYCLE = 1800
+# Checkouts waiting longer than this many seconds are logged as a saturated pool
+DB_SLOW_CHECKOUT = 0.1
+# Checkout wait times kept for the latency percentiles
+CHECKOUT_SAMPLES = 1024
+
+
+class MeteredQueuePool(QueuePool):
+    """
+    MeteredQueuePool
+        QueuePool that reports how long every checkout waited to the
+        PoolMetrics attached to it
+    """
+    metrics = None
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            if self.metrics is not None:
+                self.metrics.timed_out()
+            raise
+        if self.metrics is not None:
+            self.metrics.waited(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() swaps in a fresh pool, keep reporting from it
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def is_memory_database(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(config, database_path):
+    """
+    Build SQLALCHEMY_ENGINE_OPTIONS from the DB_* settings. Pool sizing and
+    recycling do not apply to in-memory SQLite, which keeps its one
+    connection for good, the statement timeout only to Postgres.
+    Options set in SQLALCHEMY_ENGINE_OPTIONS win.
+    """
+    options = {
+        "pool_pre_ping": config.get('DB_POOL_PRE_PING', True),
+    }
+    if is_memory_database(database_path):
+        # Each connection to :memory: is a database of its own, so every thread shares a single one
+        options["poolclass"] = StaticPool
+        options["connect_args"] = { "check_same_thread": False }
+    else:
+        options["pool_recycle"] = config.get('DB_POOL_RECYCLE', DB_POOL_RECYCLE)
+        options["poolclass"] = MeteredQueuePool
+        for name, option in (('DB_POOL_SIZE', 'pool_size'),
+                             ('DB_MAX_OVERFLOW', 'max_overflow'),
+                             ('DB_POOL_TIMEOUT', 'pool_timeout')):
+            if config.get(name) is not None:
+                options[option] = config[name]
+
+    statement_timeout = config.get('DB_STATEMENT_TIMEOUT')
+    if statement_timeout and make_url(database_path).get_backend_name() == 'postgresql':
+        # Milliseconds, enforced by the server for every statement of the connection
+        options["connect_args"] = { "options": f"-c statement_timeout={int(statement_timeout)}" }
+
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    return options
+
+
+class PoolMetrics:
+    """
+    PoolMetrics
+        checkout latency and saturation of an engine's connection pool,
+        gathered from the pool events. Checkout waits are only measured on a
+        MeteredQueuePool.
+    """
+    def __init__(self, slow_checkout=DB_SLOW_CHECKOUT, samples=CHECKOUT_SAMPLES):
+        self.slow_checkout = slow_checkout
+        self.lock = threading.Lock()
+        self.pool = None
+        self.connects = 0
+        self.checkouts = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.waits = deque(maxlen=samples)
+        self.max_wait = 0.0
+
+    def attach(self, engine):
+        self.pool = engine.pool
+        if isinstance(self.pool, MeteredQueuePool):
+            self.pool.metrics = self
+        event.listen(engine, 'connect', self.on_connect)
+        event.listen(engine, 'checkout', self.on_checkout)
+        event.listen(engine, 'checkin', self.on_checkin)
+        event.listen(engine, 'invalidate', self.on_invalidate)
+        return self
+
+    def on_connect(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.connects += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self.lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.checked_out = max(self.checked_out - 1, 0)
+
+    def on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self.lock:
+            self.invalidations += 1
+
+    def waited(self, seconds):
+        with self.lock:
+            self.waits.append(seconds)
+            self.max_wait = max(self.max_wait, seconds)
+        if seconds > self.slow_checkout:
+            logger.warning(
+                "Connection pool checkout waited %.3fs with %d connections checked out",
+                seconds, self.checked_out
+            )
+
+    def timed_out(self):
+        with self.lock:
+            self.timeouts += 1
+        logger.warning("Connection pool checkout timed out with %d connections checked out", self.checked_out)
+
+    def capacity(self):
+        # Connections the pool may hand out at once, None when unbounded
+        if not isinstance(self.pool, QueuePool) or self.pool._max_overflow < 0:
+            return None
+        return self.pool.size() + self.pool._max_overflow
+
+    def stats(self):
+        with self.lock:
+            waits = sorted(self.waits)
+            checked_out = self.checked_out
+            stats = {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "checked_out": checked_out,
+                "peak_checked_out": self.peak_checked_out,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+            }
+        capacity = self.capacity()
+        stats["capacity"] = capacity
+        stats["saturation"] = round(checked_out / capacity, 3) if capacity else None
+        for name, quantile in (("p50_wait_ms", 0.5), ("p99_wait_ms", 0.99)):
+            stats[name] = round(waits[int(quantile * (len(waits) - 1))] * 1000, 3) if waits else None
+        return stats
+
+
+def prewarm(engine, connections):
+    """
+    Open `connections` connections at once and return them to the pool, so
+    the first requests do not pay for the connect. Returns how many opened.
+    """
+    if isinstance(engine.pool, QueuePool):
+        # Overflow connections would be closed again on checkin
+        connections = min(connections, engine.pool.size())
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(engine.raw_connection())
+    finally:
+        for connection in opened:
+            connection.close()
+    return len(opened)
@@ -0,0 +1,85 @@
+import cProfile
+import hmac
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from flask import request
+
+logger = logging.getLogger(__name__)
+
+# Header that asks for a profile of one request, its value must be PROFILE_TOKEN
+PROFILE_HEADER = 'X-Trivia-Profile'
+# Profiles kept per route, the oldest are deleted
+PROFILES_PER_ROUTE = 20
+
+
+class RequestProfiler:
+    """
+    RequestProfiler
+        runs requests under cProfile and saves one .prof file per request in
+        a directory per route, readable with `python -m pstats` or snakeviz.
+        Every request is profiled with `always`, otherwise only requests that
+        send the PROFILE_HEADER with the configured `token`. Only one request
+        per process is profiled at a time.
+    """
+    def __init__(self, directory=None, token=None, always=False, keep=PROFILES_PER_ROUTE):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'trivia-profiles')
+        self.token = token
+        self.always = always
+        self.keep = keep
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        app.teardown_request(self.teardown)
+
+    def requested(self):
+        if self.always:
+            return True
+        header = request.headers.get(PROFILE_HEADER)
+        # Without a token the header is ignored, so only trusted callers can profile
+        if not (header and self.token):
+            return False
+        # As bytes: compare_digest rejects non-ASCII str, and TRIVIA_PROFILE_TOKEN=12345 decodes to an int
+        return hmac.compare_digest(header.encode(), str(self.token).encode())
+
+    def start(self):
+        if not self.requested():
+            return
+        if not self.lock.acquire(blocking=False):
+            logger.info("Skipping profile of %s %s, another request is being profiled", request.method, request.path)
+            return
+        profile = cProfile.Profile()
+        request.environ['trivia.profile'] = profile
+        profile.enable()
+
+    def finish(self, response):
+        profile = request.environ.get('trivia.profile')
+        if profile is None:
+            return response
+        profile.disable()
+        path = self.save(profile, request.endpoint or 'unmatched')
+        response.headers['X-Trivia-Profile-File'] = path
+        return response
+
+    def teardown(self, exception):
+        profile = request.environ.pop('trivia.profile', None)
+        if profile is None:
+            return
+        # Already disabled by finish() unless the request failed before it
+        profile.disable()
+        self.lock.release()
+
+    def save(self, profile, route):
+        route_directory = os.path.join(self.directory, route)
+        os.makedirs(route_directory, exist_ok=True)
+        path = os.path.join(route_directory, f"{time.time_ns()}-{request.method}.prof")
+        profile.dump_stats(path)
+        profiles = sorted(name for name in os.listdir(route_directory) if name.endswith('.prof'))
+        for name in profiles[:-self.keep]:
+            os.remove(os.path.join(route_directory, name))
+        return path
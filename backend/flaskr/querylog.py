@@ -0,0 +1,84 @@
+import logging
+import time
+from contextvars import ContextVar
+
+from flask import request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which a request is logged with its SQL statements
+SLOW_REQUEST_THRESHOLD = 1.0
+# Statements listed in a slow request entry, and characters kept of each
+MAX_LOGGED_STATEMENTS = 50
+MAX_STATEMENT_LENGTH = 300
+
+# [(statement, seconds)] run by the request of the current context
+request_statements = ContextVar('request_statements', default=None)
+
+
+def current_statements():
+    # Statements of the running request, None outside of a request
+    return request_statements.get()
+
+
+class QueryLog:
+    """
+    QueryLog
+        records every SQL statement a request runs, with its duration, from
+        the engine's cursor events. Requests slower than `slow_threshold`
+        seconds are logged together with those statements.
+    """
+    def __init__(self, slow_threshold=SLOW_REQUEST_THRESHOLD):
+        self.slow_threshold = slow_threshold
+
+    def init_app(self, app, engine):
+        self.watch(engine)
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        app.teardown_request(self.teardown)
+
+    def watch(self, engine):
+        # Record the statements run through `engine` (also used for the async engine)
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if request_statements.get() is not None:
+            conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        statements = request_statements.get()
+        if statements is None or not conn.info.get('query_started'):
+            return
+        statements.append((statement, time.perf_counter() - conn.info['query_started'].pop()))
+
+    def start(self):
+        request.environ['trivia.request_started'] = time.perf_counter()
+        request_statements.set([])
+
+    def finish(self, response):
+        started = request.environ.get('trivia.request_started')
+        statements = request_statements.get()
+        if started is None or statements is None or not self.slow_threshold:
+            return response
+        elapsed = time.perf_counter() - started
+        if elapsed >= self.slow_threshold:
+            self.log_slow_request(elapsed, response.status_code, statements)
+        return response
+
+    def teardown(self, exception):
+        request_statements.set(None)
+
+    def log_slow_request(self, elapsed, status, statements):
+        lines = [
+            f"  {seconds * 1000:8.2f}ms  {' '.join(statement.split())[:MAX_STATEMENT_LENGTH]}"
+            for statement, seconds in statements[:MAX_LOGGED_STATEMENTS]
+        ]
+        if len(statements) > MAX_LOGGED_STATEMENTS:
+            lines.append(f"  ... {len(statements) - MAX_LOGGED_STATEMENTS} more statements")
+        logger.warning(
+            "Slow request %s %s took %.1fms (status %s, %d SQL statements, %.1fms in SQL)\n%s",
+            request.method, request.full_path.rstrip('?'), elapsed * 1000, status, len(statements),
+            sum(seconds for _, seconds in statements) * 1000, "\n".join(lines)
+        )
@@ -0,0 +1,572 @@
+import base64
+import logging
+import random
+import secrets
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+
+from flask import current_app
+
+from models import db, Question
+
+logger = logging.getLogger(__name__)
+
+# Random draws attempted before falling back to a linear pass over the pool
+MAX_REJECTIONS = 32
+# Difficulty band of a progression without difficulty_range
+DIFFICULTY_RANGE = (1, 5)
+# Questions served at each level of a 'ramp' progression
+QUESTIONS_PER_LEVEL = 3
+PROGRESSIONS = ('ramp', 'adaptive')
+
+
+class IdPool:
+    """
+    IdPool
+        sorted, compact array of question ids that supports O(1) random picks
+    """
+    def __init__(self, ids=()):
+        self.ids = array('i', sorted(ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, question_id):
+        position = bisect_left(self.ids, question_id)
+        return position < len(self.ids) and self.ids[position] == question_id
+
+    def add(self, question_id):
+        if question_id not in self:
+            insort(self.ids, question_id)
+
+    def discard(self, question_id):
+        position = bisect_left(self.ids, question_id)
+        if position < len(self.ids) and self.ids[position] == question_id:
+            del self.ids[position]
+
+    def pick(self, excluded, seen, rng=random):
+        """
+        Return a random id not in `excluded`, or None if there is none left.
+        `seen` is the (estimated) number of pool ids inside `excluded`.
+        """
+        # Rejection sampling: cheap as long as most of the pool is unseen
+        if seen < len(self.ids):
+            for _ in range(MAX_REJECTIONS):
+                question_id = self.ids[rng.randrange(len(self.ids))]
+                if question_id not in excluded:
+                    return question_id
+
+        # Almost everything was served already, pick among the leftovers
+        remaining = [question_id for question_id in self.ids if question_id not in excluded]
+        return rng.choice(remaining) if remaining else None
+
+
+class Deck:
+    """
+    Deck
+        pre-shuffled array('i') of question ids dealt in order to quiz
+        sessions. A new id is swapped with a random slot (one inside-out
+        Fisher-Yates step) and a deleted id leaves a hole, so the positions
+        held by sessions stay valid.
+    """
+    HOLE = -1
+
+    def __init__(self, ids=(), rng=random):
+        ids = list(ids)
+        rng.shuffle(ids)
+        self.ids = array('i', ids)
+        self.rng = rng
+        self.holes = 0
+
+    def __len__(self):
+        return len(self.ids) - self.holes
+
+    def add(self, question_id):
+        self.ids.append(question_id)
+        slot = self.rng.randrange(len(self.ids))
+        self.ids[-1], self.ids[slot] = self.ids[slot], self.ids[-1]
+
+    def discard(self, question_id):
+        try:
+            position = self.ids.index(question_id)
+        except ValueError:
+            return
+        self.ids[position] = self.HOLE
+        self.holes += 1
+
+    def deal(self, position, excluded):
+        """
+        Return the first id at or after `position` not in `excluded` and the
+        position after it, or (None, end of deck) once the deck is dealt.
+        """
+        ids = self.ids
+        while position < len(ids):
+            question_id = ids[position]
+            position += 1
+            if question_id != self.HOLE and question_id not in excluded:
+                return question_id, position
+        return None, position
+
+
+class QuizOptionsError(ValueError):
+    """
+    QuizOptionsError
+        the difficulty options of a quiz request are invalid (400)
+    """
+
+
+class DifficultyPlan:
+    """
+    DifficultyPlan
+        difficulty levels a quiz draws from: one `difficulty`, a band
+        (`difficulty_range`, a random level of it at each step) or a
+        progression through the band. 'ramp' moves up a level every
+        `per_level` questions, 'adaptive' moves up after a correct answer
+        and down after a wrong one. When the target level has nothing left,
+        the nearest levels of the band are used.
+    """
+    def __init__(self, low, high, progression=None, per_level=QUESTIONS_PER_LEVEL):
+        self.low = low
+        self.high = high
+        self.progression = progression
+        self.per_level = per_level
+
+    def to_state(self):
+        return [self.low, self.high, self.progression, self.per_level]
+
+    @classmethod
+    def from_state(cls, state):
+        return None if state is None else cls(*state)
+
+    @classmethod
+    def from_body(cls, body, per_level=QUESTIONS_PER_LEVEL):
+        """
+        Plan requested by a quiz request body, None if it has no difficulty
+        options. Raises QuizOptionsError for invalid ones.
+        """
+        difficulty = body.get('difficulty')
+        difficulty_range = body.get('difficulty_range')
+        progression = body.get('progression')
+        if difficulty is None and difficulty_range is None and progression is None:
+            return None
+        if difficulty is not None and difficulty_range is not None:
+            raise QuizOptionsError("difficulty and difficulty_range are exclusive")
+        if progression is not None and progression not in PROGRESSIONS:
+            raise QuizOptionsError(f"progression must be one of {', '.join(PROGRESSIONS)}")
+
+        if difficulty is not None:
+            low = high = difficulty
+        elif difficulty_range is not None:
+            if not isinstance(difficulty_range, list) or len(difficulty_range) != 2:
+                raise QuizOptionsError("difficulty_range must be [lowest, highest]")
+            low, high = difficulty_range
+        else:
+            low, high = DIFFICULTY_RANGE
+        # bool is an int subclass, but true is not a difficulty
+        if not all(isinstance(level, int) and not isinstance(level, bool) for level in (low, high)) or low > high:
+            raise QuizOptionsError("difficulties must be integers, lowest first")
+        return cls(low, high, progression, per_level)
+
+    def target(self, served, last_difficulty=None, last_correct=None, rng=random):
+        # Level wanted for the next question, `served` questions into the quiz
+        if self.progression == 'ramp':
+            return min(self.high, self.low + served // self.per_level)
+        if self.progression == 'adaptive':
+            if last_difficulty is None:
+                return self.low
+            if last_correct is not None:
+                last_difficulty += 1 if last_correct else -1
+            return max(self.low, min(self.high, last_difficulty))
+        return rng.randint(self.low, self.high)
+
+    def levels(self, served, last_difficulty=None, last_correct=None, rng=random):
+        # Levels of the band to draw from in order: the target, then the nearest (harder first)
+        target = self.target(served, last_difficulty, last_correct, rng)
+        return sorted(range(self.low, self.high + 1), key=lambda level: (abs(level - target), -level))
+
+
+class QuestionPool:
+    """
+    QuestionPool
+        id pools used to pick quiz questions without loading rows, and a
+        shuffled deck for quiz sessions, per category and per (category,
+        difficulty) bucket. Kept current by the model write hooks. With a
+        `ttl`, a background thread rebuilds them every `ttl` seconds so
+        writes made by other worker processes are picked up, replays the
+        writes made meanwhile and swaps them in. Pass a seeded `rng` for
+        reproducible picks and decks.
+    """
+    def __init__(self, ttl=60, rng=None):
+        self.ttl = ttl
+        self.rng = rng or random.Random()
+        # Keyed by (category, difficulty), None standing for all of either
+        self.pools = None
+        self.decks = None
+        # Difficulties present in the bank, in order
+        self.difficulties = []
+        # Unique to every build, positions in other builds (or other processes' decks) are meaningless
+        self.generation = None
+        # Orders the hook writes with the swap of a rebuilt pool set, readers never iterate the dicts
+        self.lock = threading.Lock()
+        # One build at a time
+        self.loading = threading.Lock()
+        # Writes made while a build reads the table, replayed on the new pools
+        self.replay = None
+        self.stopped = threading.Event()
+
+    def setup(self):
+        self.load()
+        if self.ttl:
+            threading.Thread(
+                target=self.refresh, args=(current_app._get_current_object(),),
+                name='quiz-pool-rebuild', daemon=True
+            ).start()
+
+    def refresh(self, app):
+        while not self.stopped.wait(self.ttl):
+            try:
+                with app.app_context():
+                    self.load()
+            except Exception:
+                logger.exception("Rebuilding the quiz pools failed")
+
+    def close(self):
+        # Stop the background rebuilds
+        self.stopped.set()
+
+    def load(self):
+        with self.loading:
+            with self.lock:
+                self.replay = []
+            try:
+                # Only fetch (id, category, difficulty) tuples, never full ORM objects
+                self.build(db.session.query(Question.id, Question.category, Question.difficulty).all())
+            finally:
+                with self.lock:
+                    self.replay = None
+
+    def build(self, rows):
+        buckets = {}
+        for question_id, category, difficulty in rows:
+            for key in self.keys(category, difficulty):
+                buckets.setdefault(key, []).append(question_id)
+        buckets.setdefault((None, None), [])
+        pools, decks = {}, {}
+        for key, ids in buckets.items():
+            pools[key] = IdPool(ids)
+            decks[key] = Deck(pools[key].ids, self.rng)
+        difficulties = sorted({difficulty for _, difficulty in pools if difficulty is not None})
+
+        with self.lock:
+            # Writes are idempotent, rows the build already read are left as they are
+            for change in self.replay or ():
+                change(pools, decks, difficulties)
+            self.pools, self.decks, self.difficulties = pools, decks, difficulties
+            self.generation = secrets.token_hex(8)
+
+    @staticmethod
+    def keys(category, difficulty):
+        # Buckets a question of `category` and `difficulty` belongs to
+        category = int(category)
+        return (None, None), (category, None), (None, difficulty), (category, difficulty)
+
+    def get_pool(self, category=None, difficulty=None):
+        if self.pools is None:
+            # First use without setup(): concurrent requests wait for one load
+            with self.loading:
+                loaded = self.pools is not None
+            if not loaded:
+                self.load()
+        return self.pool_for(category, difficulty)
+
+    def pool_for(self, category, difficulty=None):
+        # Pool of a loaded bucket, empty for unknown ones
+        key = (None if category is None else int(category), difficulty)
+        return self.pools.get(key) or IdPool()
+
+    def deck_for(self, category, difficulty=None):
+        # Deck of a loaded bucket, empty for unknown ones
+        key = (None if category is None else int(category), difficulty)
+        return self.decks.get(key) or Deck()
+
+    def difficulty_of(self, question_id, category=None):
+        # Difficulty of a pooled question, from the bucket holding it
+        for difficulty in self.difficulties:
+            if question_id in self.pool_for(category, difficulty):
+                return difficulty
+        return None
+
+    def write(self, change):
+        # Apply change(pools, decks, difficulties) now, and to the pools being rebuilt
+        with self.lock:
+            if self.pools is not None:
+                change(self.pools, self.decks, self.difficulties)
+            if self.replay is not None:
+                self.replay.append(change)
+
+    def add(self, question_id, category, difficulty):
+        def change(pools, decks, difficulties):
+            for key in self.keys(category, difficulty):
+                pool = pools.setdefault(key, IdPool())
+                # Decks take an id once, a replayed insert may already be there
+                if question_id not in pool:
+                    pool.add(question_id)
+                    decks.setdefault(key, Deck(rng=self.rng)).add(question_id)
+            if difficulty not in difficulties:
+                insort(difficulties, difficulty)
+        self.write(change)
+
+    def discard(self, question_id, category, difficulty):
+        def change(pools, decks, difficulties):
+            for pool in pools.values():
+                pool.discard(question_id)
+            for key in self.keys(category, difficulty):
+                if key in decks:
+                    decks[key].discard(question_id)
+        self.write(change)
+
+    # Write notifications, see sync_question_indexes
+    def added(self, question):
+        self.add(question.id, question.category, question.difficulty)
+
+    def updated(self, question, old):
+        if 'category' not in old and 'difficulty' not in old:
+            return
+        self.discard(question.id, old.get('category', question.category), old.get('difficulty', question.difficulty))
+        self.add(question.id, question.category, question.difficulty)
+
+    def bulk_added(self, rows):
+        for row in rows:
+            self.add(row['id'], row['category'], row['difficulty'])
+
+    def removed(self, question):
+        self.discard(question.id, question.category, question.difficulty)
+
+    def candidates(self, category, previous_questions, plan=None, last_correct=None):
+        """
+        Yield the (pool, excluded ids, seen) to draw the next question of
+        `category` from, in order, skipping pools with nothing left. With a
+        `plan` these are the pools of its difficulty levels. The pools must
+        be loaded.
+        """
+        excluded = set(previous_questions)
+        if plan is None:
+            levels = [None]
+        else:
+            last_difficulty = None
+            if plan.progression == 'adaptive' and previous_questions:
+                last_difficulty = self.difficulty_of(previous_questions[-1], category)
+            levels = plan.levels(len(excluded), last_difficulty, last_correct, self.rng)
+        for level in levels:
+            pool = self.pool_for(category, level)
+            # Count how many of the previous questions actually belong to this pool
+            seen = sum(1 for question_id in excluded if question_id in pool)
+            if seen < len(pool):
+                yield pool, excluded, seen
+
+    def next_question(self, category, previous_questions, plan=None, last_correct=None):
+        """
+        Return a random question of `category` (None for all) whose id is not in
+        `previous_questions`, or None once every question has been served.
+        `plan` (a DifficultyPlan) restricts it to difficulty levels.
+        """
+        self.get_pool(category)
+        for pool, excluded, seen in self.candidates(category, previous_questions, plan, last_correct):
+            question = self.fetch(pool, excluded, seen)
+            if question is not None:
+                return question
+        return None
+
+    def fetch(self, pool, excluded, seen):
+        # Load the picked question, skipping ids deleted by another process
+        while True:
+            question_id = pool.pick(excluded, seen, self.rng)
+            if question_id is None:
+                return None
+            question = db.session.get(Question, question_id)
+            if question is not None:
+                return question
+            self.forget(question_id)
+
+    def forget(self, question_id):
+        # Deleted by another process since the pool was loaded
+        def change(pools, decks, difficulties):
+            for pool in pools.values():
+                pool.discard(question_id)
+            for deck in decks.values():
+                deck.discard(question_id)
+        self.write(change)
+
+
+class ServedIds:
+    """
+    ServedIds
+        sorted array('i') of the question ids already served in a quiz
+        session, as small as the number of questions served whatever the ids
+    """
+    def __init__(self, ids=()):
+        self.ids = array('i', sorted(ids))
+
+    @property
+    def count(self):
+        return len(self.ids)
+
+    def __contains__(self, question_id):
+        position = bisect_left(self.ids, question_id)
+        return position < len(self.ids) and self.ids[position] == question_id
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def add(self, question_id):
+        # Sorted insert, a memmove of at most the served count
+        position = bisect_left(self.ids, question_id)
+        if position == len(self.ids) or self.ids[position] != question_id:
+            self.ids.insert(position, question_id)
+
+    def to_state(self):
+        # Little-endian int32s in base64, the same bytes for every worker
+        ids = array('i', self.ids)
+        if sys.byteorder == 'big':
+            ids.byteswap()
+        return base64.b64encode(ids.tobytes()).decode('ascii')
+
+    @classmethod
+    def from_state(cls, state):
+        served = cls()
+        served.ids.frombytes(base64.b64decode(state))
+        if sys.byteorder == 'big':
+            served.ids.byteswap()
+        return served
+
+
+class QuizSession:
+    def __init__(self, token, category, plan=None):
+        self.token = token
+        self.category = category
+        self.plan = plan
+        self.served = ServedIds()
+        # Difficulty of the last served question
+        self.last_difficulty = None
+        # Where the session is in each deck it draws from, and which build of the decks that is
+        self.generation = None
+        self.positions = {}
+
+    def seen(self, pool):
+        # Served questions still in `pool`, those deleted since then do not count
+        return sum(1 for question_id in self.served if question_id in pool)
+
+    def to_state(self):
+        # JSON-safe state, integer and None keys kept as pairs
+        return {
+            "category": self.category,
+            "plan": None if self.plan is None else self.plan.to_state(),
+            "served": self.served.to_state(),
+            "last_difficulty": self.last_difficulty,
+            "generation": self.generation,
+            "positions": list(self.positions.items())
+        }
+
+    @classmethod
+    def from_state(cls, token, state):
+        session = cls(token, state["category"], DifficultyPlan.from_state(state["plan"]))
+        session.served = ServedIds.from_state(state["served"])
+        session.last_difficulty = state["last_difficulty"]
+        session.generation = state["generation"]
+        session.positions = dict(state["positions"])
+        return session
+
+
+class QuizSessionStore:
+    """
+    QuizSessionStore
+        server-side quiz sessions, so clients send a token instead of the
+        growing previous_questions list. Sessions are kept in a cache backend
+        (see cache.py), shared by every worker with Redis, and expire after
+        `ttl` seconds without a question. The steps of one session are
+        expected one at a time, concurrent ones may serve a question twice.
+    """
+    key_prefix = 'quiz:'
+
+    def __init__(self, question_pool, backend, ttl=3600):
+        self.question_pool = question_pool
+        self.backend = backend
+        self.ttl = ttl
+
+    def start(self, category, plan=None):
+        token = secrets.token_urlsafe(16)
+        self.save(QuizSession(token, category, plan))
+        return token
+
+    def get(self, token):
+        state = self.backend.get(self.key_prefix + token)
+        return None if state is None else QuizSession.from_state(token, state)
+
+    def save(self, session):
+        # Also restarts the session's ttl
+        self.backend.set(self.key_prefix + session.token, session.to_state(), ttl=self.ttl)
+
+    def levels(self, session, last_correct=None):
+        """
+        Yield the (difficulty, pool, seen) the session's next question is
+        drawn from, in order, skipping those it has been served entirely.
+        The pools must be loaded.
+        """
+        plan = session.plan
+        if plan is None:
+            levels = [None]
+        else:
+            levels = plan.levels(session.served.count, session.last_difficulty, last_correct, self.question_pool.rng)
+        for level in levels:
+            pool = self.question_pool.pool_for(session.category, level)
+            seen = session.seen(pool)
+            if seen < len(pool):
+                yield level, pool, seen
+
+    def next_candidate(self, session, level=None):
+        """
+        Deal the next id of the session's deck of `level` that it has not
+        been served, or None once that deck is dealt. The pool must be loaded.
+        """
+        question_pool = self.question_pool
+        if session.generation != question_pool.generation:
+            # The decks were rebuilt, start over: served ids are skipped anyway
+            session.generation, session.positions = question_pool.generation, {}
+        question_id, session.positions[level] = question_pool.deck_for(session.category, level).deal(
+            session.positions.get(level, 0), session.served
+        )
+        return question_id
+
+    def next_question(self, session, last_correct=None):
+        """
+        Return the next unseen question of the session and mark it as served,
+        or None once the session's category (and difficulty band) has been
+        exhausted, then save the session. Each step is one primary key lookup.
+        """
+        self.question_pool.get_pool(session.category)
+        for level, pool, seen in self.levels(session, last_correct):
+            while True:
+                question_id = self.next_candidate(session, level)
+                if question_id is None:
+                    # Questions created into slots the session already passed
+                    question = self.question_pool.fetch(pool, session.served, seen)
+                    break
+                question = db.session.get(Question, question_id)
+                if question is not None:
+                    break
+                self.question_pool.forget(question_id)
+            if question is not None:
+                self.served(session, question)
+                break
+        else:
+            question = None
+        self.save(session)
+        return question
+
+    def served(self, session, question):
+        # Record that `question` was served in `session`
+        session.served.add(question.id)
+        session.last_difficulty = question.difficulty
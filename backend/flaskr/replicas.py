@@ -0,0 +1,92 @@
+import itertools
+import math
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import create_engine
+
+from .pool import engine_options
+from .routing import is_read_request
+from .sqlite import configure_sqlite, sqlite_pragmas
+
+# Seconds reads stay on the primary after a write, longer than the replication lag
+REPLICA_STICKY_SECONDS = 5
+# Cookie holding the writing client's deadline, for the workers that did not see the write
+STICKY_COOKIE = 'trivia_primary_until'
+
+
+def replica_uris(config):
+    # REPLICA_DATABASE_URIS as a list, or a comma separated string from the environment
+    uris = config.get('REPLICA_DATABASE_URIS') or []
+    if isinstance(uris, str):
+        uris = [uri.strip() for uri in uris.split(',') if uri.strip()]
+    return list(uris)
+
+
+class ReplicaRouter:
+    """
+    ReplicaRouter
+        sends the reads of GET requests and read-only POSTs to the replica
+        engines in turn, through flask.g.read_engine (see RoutingSession in
+        models.py). Writes always go to the primary. For `sticky_seconds`
+        after a write, the writing client (through STICKY_COOKIE) reads from
+        the primary too, so it sees its writes before the replicas do.
+        Routed reads skip the response cache, which could otherwise hand a
+        lagging replica's answer to the writing client.
+    """
+    def __init__(self, engines, sticky_seconds=REPLICA_STICKY_SECONDS):
+        self.engines = engines
+        self.sticky_seconds = sticky_seconds
+        self.turns = itertools.cycle(engines)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        # One engine per replica, with the pool settings and pragmas of the primary
+        engines = []
+        for uri in replica_uris(config):
+            engine = create_engine(uri, **engine_options(config, uri))
+            if engine.dialect.name == 'sqlite':
+                configure_sqlite(engine, sqlite_pragmas(config, uri))
+            engines.append(engine)
+        return cls(engines, sticky_seconds=config.get('REPLICA_STICKY_SECONDS', REPLICA_STICKY_SECONDS))
+
+    def init_app(self, app):
+        app.before_request(self.route)
+        app.after_request(self.remember)
+
+    def sticky(self):
+        # Time is wall clock, the cookie deadline may come from another process
+        try:
+            return time.time() < float(request.cookies.get(STICKY_COOKIE, 0))
+        except ValueError:
+            return False
+
+    def route(self):
+        if not is_read_request():
+            return
+        if self.sticky():
+            # Read its own writes from the primary, not from entries cached off a lagging replica
+            g.skip_response_cache = True
+            return
+        with self.lock:
+            g.read_engine = next(self.turns)
+
+    def wrote(self):
+        # Only the writing client sticks to the primary, writes outside requests need no stickiness
+        if has_request_context():
+            g.primary_until = time.time() + self.sticky_seconds
+
+    def remember(self, response):
+        primary_until = g.get('primary_until')
+        if primary_until is not None:
+            response.set_cookie(
+                STICKY_COOKIE, f"{primary_until:.3f}",
+                max_age=math.ceil(self.sticky_seconds), httponly=True
+            )
+        return response
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
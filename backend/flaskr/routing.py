@@ -0,0 +1,9 @@
+from flask import request
+
+# POST endpoints that only read, handled like GET requests
+READ_ENDPOINTS = {'search_questions', 'get_questions_quiz', 'start_quiz_session'}
+
+
+def is_read_request():
+    # True for requests that never write, must run inside a request context
+    return request.method in ('GET', 'HEAD') or request.endpoint in READ_ENDPOINTS
@@ -0,0 +1,417 @@
+import logging
+import threading
+from array import array
+from bisect import bisect_left, insort
+
+from flask import current_app
+from sqlalchemy import and_, func, or_, select, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Question
+
+logger = logging.getLogger(__name__)
+
+
+class SearchUnavailable(Exception):
+    """Raised by setup() when the database lacks what a search backend needs."""
+
+
+class IlikeSearch:
+    """
+    IlikeSearch
+        case-insensitive substring match with ILIKE, works on every database
+        but scans the whole table. Results are ordered by id.
+    """
+    name = 'ilike'
+
+    def setup(self):
+        pass
+
+    # Write notifications, only index-backed searches need them
+    def added(self, question):
+        pass
+
+    def updated(self, question, old):
+        pass
+
+    def bulk_added(self, rows):
+        pass
+
+    def removed(self, question):
+        pass
+
+    def criterion(self, search_term, include_answers):
+        pattern = f"%{search_term}%"
+        if include_answers:
+            return or_(Question.question.ilike(pattern), Question.answer.ilike(pattern))
+        return Question.question.ilike(pattern)
+
+    def ordering(self, search_term, include_answers):
+        return [Question.id]
+
+    def search(self, search_term, include_answers=False, page=None, per_page=None):
+        """
+        Return (rows, total) for the term, rows being Question.columns()
+        tuples. Without `page` every match is returned, otherwise only the
+        requested slice of `per_page` rows.
+        """
+        query = Question.query.with_entities(*Question.columns()).filter(
+            self.criterion(search_term, include_answers)
+        ).order_by(*self.ordering(search_term, include_answers))
+
+        if page is None:
+            questions = query.all()
+            return questions, len(questions)
+
+        total = query.order_by(None).count()
+        questions = query.limit(per_page).offset((page - 1) * per_page).all()
+        return questions, total
+
+
+class TrigramSearch(IlikeSearch):
+    """
+    TrigramSearch
+        same ILIKE semantics, served by pg_trgm GIN indexes on question and
+        answer, with results ranked by trigram word similarity.
+    """
+    name = 'trigram'
+
+    def setup(self):
+        # The extension and its indexes come from migration 0003, only check it is there
+        with db.engine.connect() as connection:
+            installed = connection.execute(text(
+                "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+            )).first()
+        if installed is None:
+            raise SearchUnavailable("pg_trgm extension is not installed")
+
+    def ordering(self, search_term, include_answers):
+        rank = func.word_similarity(search_term, Question.question)
+        if include_answers:
+            rank = func.greatest(rank, func.word_similarity(search_term, Question.answer))
+        return [rank.desc(), Question.id]
+
+
+class FtsSearch(IlikeSearch):
+    """
+    FtsSearch
+        same ILIKE semantics on SQLite, served by an FTS5 trigram index over
+        question and answer. The index is an external content table kept in
+        step with questions by triggers, and the ILIKE criterion still checks
+        its matches. Terms shorter than a trigram or holding LIKE wildcards
+        use ILIKE alone.
+    """
+    name = 'fts'
+    TRIGGERS = {
+        'questions_fts_insert': (
+            "AFTER INSERT ON questions BEGIN "
+            "INSERT INTO questions_fts (rowid, question, answer) VALUES (new.id, new.question, new.answer); END"
+        ),
+        'questions_fts_delete': (
+            "AFTER DELETE ON questions BEGIN "
+            "INSERT INTO questions_fts (questions_fts, rowid, question, answer) "
+            "VALUES ('delete', old.id, old.question, old.answer); END"
+        ),
+        'questions_fts_update': (
+            "AFTER UPDATE OF question, answer ON questions BEGIN "
+            "INSERT INTO questions_fts (questions_fts, rowid, question, answer) "
+            "VALUES ('delete', old.id, old.question, old.answer); "
+            "INSERT INTO questions_fts (rowid, question, answer) VALUES (new.id, new.question, new.answer); END"
+        ),
+    }
+
+    def setup(self):
+        with db.engine.begin() as connection:
+            connection.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5("
+                "question, answer, content='questions', content_rowid='id', tokenize='trigram')"
+            ))
+            existing = set(connection.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'questions'"
+            )).scalars())
+            missing = [name for name in self.TRIGGERS if name not in existing]
+            for name in missing:
+                connection.execute(text(f"CREATE TRIGGER {name} {self.TRIGGERS[name]}"))
+            # New index, or questions recreated without the triggers: index the current rows
+            if missing:
+                connection.execute(text("INSERT INTO questions_fts (questions_fts) VALUES ('rebuild')"))
+
+    def criterion(self, search_term, include_answers):
+        like = super().criterion(search_term, include_answers)
+        if len(search_term) < 3 or '%' in search_term or '_' in search_term:
+            return like
+        # One quoted phrase matches it as a substring with the trigram tokenizer
+        phrase = '"' + search_term.replace('"', '""') + '"'
+        query = phrase if include_answers else f"question : {phrase}"
+        matches = select(text("rowid")).select_from(text("questions_fts")).where(
+            text("questions_fts MATCH :fts_query").bindparams(fts_query=query)
+        )
+        return and_(Question.id.in_(matches), like)
+
+
+def trigrams(value):
+    value = value.lower()
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class TrigramIndex:
+    """
+    TrigramIndex
+        maps every lowercase trigram to the sorted array('I') of ids whose
+        text contains it
+    """
+    def __init__(self):
+        self.postings = {}
+
+    def add(self, question_id, value):
+        for trigram in trigrams(value):
+            ids = self.postings.setdefault(trigram, array('I'))
+            # Ids mostly grow, so appending is the common case
+            if not ids or ids[-1] < question_id:
+                ids.append(question_id)
+            else:
+                position = bisect_left(ids, question_id)
+                if position == len(ids) or ids[position] != question_id:
+                    insort(ids, question_id)
+
+    def remove(self, question_id, value):
+        for trigram in trigrams(value):
+            ids = self.postings.get(trigram)
+            if ids is None:
+                continue
+            position = bisect_left(ids, question_id)
+            if position < len(ids) and ids[position] == question_id:
+                del ids[position]
+            if not ids:
+                del self.postings[trigram]
+
+    def candidates(self, search_term):
+        # Ids holding every trigram of the term, a superset of the real matches
+        lists = []
+        for trigram in trigrams(search_term):
+            ids = self.postings.get(trigram)
+            if ids is None:
+                return []
+            lists.append(ids)
+        lists.sort(key=len)
+        smallest, others = lists[0], lists[1:]
+        result = []
+        for question_id in smallest:
+            for ids in others:
+                position = bisect_left(ids, question_id)
+                if position == len(ids) or ids[position] != question_id:
+                    break
+            else:
+                result.append(question_id)
+        return result
+
+
+class MemorySearch(IlikeSearch):
+    """
+    MemorySearch
+        in-process trigram inverted index over question and answer texts for
+        databases without search extensions. Candidates from the index are
+        checked with the ILIKE criterion by id, so results match the ILIKE
+        backend exactly.
+        Terms shorter than a trigram, holding LIKE wildcards or too common
+        for the index to narrow the search use ILIKE.
+        The index is kept current by the model write hooks. With a `ttl`, a
+        background thread rebuilds it every `ttl` seconds to pick up writes
+        from other worker processes, and swaps it in once built.
+    """
+    name = 'memory'
+    # Candidate ids verified per query
+    VERIFY_BATCH_SIZE = 1000
+    # Past this share of the table, one ILIKE scan beats verifying candidates
+    SCAN_RATIO = 0.2
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.questions = None
+        self.answers = None
+        # Indexed questions
+        self.size = 0
+        # Orders the hook writes with the swap of a rebuilt index
+        self.lock = threading.Lock()
+        # Writes made while a rebuild reads the table, replayed on the new index
+        self.replay = None
+        self.stopped = threading.Event()
+
+    def setup(self):
+        self.build()
+        if self.ttl:
+            threading.Thread(
+                target=self.refresh, args=(current_app._get_current_object(),),
+                name='memory-search-rebuild', daemon=True
+            ).start()
+
+    def refresh(self, app):
+        while not self.stopped.wait(self.ttl):
+            try:
+                with app.app_context():
+                    self.build()
+            except Exception:
+                logger.exception("Rebuilding the in-memory search index failed")
+
+    def close(self):
+        # Stop the background rebuilds
+        self.stopped.set()
+
+    def build(self):
+        with self.lock:
+            self.replay = []
+        try:
+            questions, answers = TrigramIndex(), TrigramIndex()
+            rows = db.session.query(
+                Question.id, Question.question, Question.answer
+            ).order_by(Question.id).yield_per(self.VERIFY_BATCH_SIZE)
+            size = 0
+            for question_id, question, answer in rows:
+                questions.add(question_id, question)
+                answers.add(question_id, answer)
+                size += 1
+        except BaseException:
+            with self.lock:
+                self.replay = None
+            raise
+
+        with self.lock:
+            # Index operations are idempotent, rows the build already read are left as they are.
+            # The size stays the one read, it only weighs the index against a scan
+            for change in self.replay:
+                change(questions, answers)
+            self.questions, self.answers, self.size = questions, answers, size
+            self.replay = None
+
+    def write(self, *changes):
+        # Apply each change(questions, answers) -> size delta now, and to the index being rebuilt
+        with self.lock:
+            for change in changes:
+                if self.questions is not None:
+                    self.size += change(self.questions, self.answers)
+                if self.replay is not None:
+                    self.replay.append(change)
+
+    @staticmethod
+    def indexing(rows):
+        # Change adding the (id, question, answer) rows
+        def change(questions, answers):
+            for question_id, question, answer in rows:
+                questions.add(question_id, question)
+                answers.add(question_id, answer)
+            return len(rows)
+        return change
+
+    @staticmethod
+    def unindexing(rows):
+        # Change removing the (id, question, answer) rows
+        def change(questions, answers):
+            for question_id, question, answer in rows:
+                questions.remove(question_id, question)
+                answers.remove(question_id, answer)
+            return -len(rows)
+        return change
+
+    def added(self, question):
+        self.write(self.indexing([(question.id, question.question, question.answer)]))
+
+    def updated(self, question, old):
+        if 'question' not in old and 'answer' not in old:
+            return
+        self.write(
+            self.unindexing([(question.id, old.get('question', question.question), old.get('answer', question.answer))]),
+            self.indexing([(question.id, question.question, question.answer)])
+        )
+
+    def bulk_added(self, rows):
+        self.write(self.indexing([(row['id'], row['question'], row['answer']) for row in rows]))
+
+    def removed(self, question):
+        self.write(self.unindexing([(question.id, question.question, question.answer)]))
+
+    def matching_ids(self, search_term, include_answers):
+        """
+        Return the sorted ids matching the term, or None when the index does
+        not narrow the search enough to be worth it.
+        """
+        if self.questions is None:
+            self.build()
+
+        # Both indexes are complete on their own, a swap between the reads is harmless
+        questions, answers, size = self.questions, self.answers, self.size
+        candidates = set(questions.candidates(search_term))
+        if include_answers:
+            candidates.update(answers.candidates(search_term))
+        candidates = sorted(candidates)
+        if len(candidates) > size * self.SCAN_RATIO:
+            return None
+
+        # Keep the candidates whose text really matches, using the ILIKE criterion
+        criterion = self.criterion(search_term, include_answers)
+        matches = []
+        for start in range(0, len(candidates), self.VERIFY_BATCH_SIZE):
+            batch = candidates[start:start + self.VERIFY_BATCH_SIZE]
+            rows = db.session.query(Question.id).filter(
+                Question.id.in_(batch), criterion
+            ).order_by(Question.id)
+            matches.extend(question_id for question_id, in rows)
+        return matches
+
+    def search(self, search_term, include_answers=False, page=None, per_page=None):
+        if len(search_term) < 3 or '%' in search_term or '_' in search_term:
+            return super().search(search_term, include_answers, page, per_page)
+
+        ids = self.matching_ids(search_term, include_answers)
+        if ids is None:
+            return super().search(search_term, include_answers, page, per_page)
+        total = len(ids)
+        if page is not None:
+            ids = ids[(page - 1) * per_page:page * per_page]
+        questions = Question.query.with_entities(*Question.columns()).filter(
+            Question.id.in_(ids)
+        ).order_by(Question.id).all() if ids else []
+        return questions, total
+
+
+SEARCH_BACKENDS = {
+    IlikeSearch.name: IlikeSearch,
+    TrigramSearch.name: TrigramSearch,
+    FtsSearch.name: FtsSearch,
+    MemorySearch.name: MemorySearch,
+}
+
+
+def create_search_backend(name='auto', index_ttl=None):
+    """
+    Build and set up the search backend called `name`. 'auto' picks the
+    trigram backend on Postgres when pg_trgm is available, the FTS5 backend on
+    SQLite when it has the trigram tokenizer and ILIKE otherwise.
+    Must run inside an application context.
+    """
+    if name == MemorySearch.name:
+        backend = MemorySearch(ttl=index_ttl)
+        backend.setup()
+        return backend
+
+    if name != 'auto':
+        backend = SEARCH_BACKENDS[name]()
+        backend.setup()
+        return backend
+
+    if db.engine.dialect.name == 'postgresql':
+        try:
+            backend = TrigramSearch()
+            backend.setup()
+            return backend
+        except (SQLAlchemyError, SearchUnavailable) as e:
+            logger.warning("pg_trgm unavailable, searching with ILIKE: %s", e)
+
+    if db.engine.dialect.name == 'sqlite':
+        try:
+            backend = FtsSearch()
+            backend.setup()
+            return backend
+        except SQLAlchemyError as e:
+            logger.warning("FTS5 trigram tokenizer unavailable, searching with ILIKE: %s", e)
+
+    return IlikeSearch()
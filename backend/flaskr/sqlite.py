@@ -0,0 +1,63 @@
+from flask import has_request_context
+from sqlalchemy import event
+
+from .routing import is_read_request
+
+from .pool import is_memory_database
+
+# Applied to every new SQLite connection, SQLITE_PRAGMAS entries override them
+SQLITE_PRAGMAS = {
+    # Readers never block the writer and commits only append to the log
+    "journal_mode": "WAL",
+    # Durable at checkpoints, which is safe with WAL and saves an fsync per commit
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+    # Milliseconds a writer waits for the lock instead of failing with "database is locked"
+    "busy_timeout": 5000,
+    # 64 MiB page cache (negative values are KiB), temporary tables in memory
+    "cache_size": -65536,
+    "temp_store": "MEMORY",
+    "mmap_size": 268435456,
+}
+
+
+def sqlite_pragmas(config, database_path):
+    """
+    Pragmas for the SQLite database at `database_path`: SQLITE_PRAGMAS
+    merged with the SQLITE_PRAGMAS setting (None drops one). In-memory
+    databases have no journal file to put in WAL mode.
+    """
+    pragmas = dict(SQLITE_PRAGMAS)
+    if is_memory_database(database_path):
+        del pragmas["journal_mode"]
+    pragmas.update(config.get('SQLITE_PRAGMAS') or {})
+    return { name: value for name, value in pragmas.items() if value is not None }
+
+
+def configure_sqlite(engine, pragmas):
+    """
+    Apply `pragmas` to every connection of `engine` (the sync_engine of an
+    async one) and make SQLAlchemy own the transactions. pysqlite only
+    opens a transaction before DML, so SAVEPOINTs would otherwise run
+    outside of one; BEGIN is emitted when SQLAlchemy begins instead.
+    Transactions of write requests begin IMMEDIATE: once a deferred one
+    has read, it cannot take the write lock after another connection
+    committed (SQLITE_BUSY_SNAPSHOT, busy_timeout or not).
+    """
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        # On the DBAPI cursor, so BEGIN stays out of the query log like the implicit one of psycopg2
+        cursor = connection.connection.cursor()
+        cursor.execute("BEGIN" if not has_request_context() or is_read_request() else "BEGIN IMMEDIATE")
+        cursor.close()
+
+    return engine
+
@@ -0,0 +1,68 @@
+import csv
+import io
+
+from flask import current_app, stream_with_context
+
+from models import Question
+
+# Rows fetched from the server-side cursor, and rows written per chunk
+STREAM_BATCH_SIZE = 500
+
+
+def iter_questions(query, batch_size=STREAM_BATCH_SIZE):
+    # Walk the query's Question.columns() tuples through a server-side cursor so memory stays flat
+    return query.with_entities(*Question.columns()).order_by(Question.id).yield_per(batch_size)
+
+
+def chunked(pieces, batch_size=STREAM_BATCH_SIZE):
+    # Group many small strings into fewer, larger writes
+    chunk = []
+    for piece in pieces:
+        chunk.append(piece)
+        if len(chunk) == batch_size:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def ndjson_lines(questions):
+    for question in questions:
+        yield current_app.json.dumps(Question.format_row(question)) + "\n"
+
+
+def csv_lines(questions):
+    # Header row first, columns in the order POST /questions/bulk accepts them
+    columns = ["id", "question", "answer", "category", "difficulty"]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for question in questions:
+        # Same values as the NDJSON export and the API, category included
+        row = Question.format_row(question)
+        writer.writerow([row[column] for column in columns])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def json_document(questions, **fields):
+    """
+    Yield the same JSON object a buffered list response would hold, with
+    `questions` written row by row and `total_questions` counted on the way.
+    """
+    dumps = current_app.json.dumps
+    yield '{"questions": ['
+    total_questions = 0
+    for question in questions:
+        yield ("," if total_questions else "") + dumps(Question.format_row(question))
+        total_questions += 1
+    fields["total_questions"] = total_questions
+    yield "], " + dumps(fields)[1:]
+
+
+def stream_response(pieces, mimetype):
+    return current_app.response_class(
+        stream_with_context(chunked(pieces)), status=200, mimetype=mimetype
+    )
@@ -1,32 +1,87 @@
-from sqlalchemy import Column, String, Integer
+import logging
+from collections import Counter
+
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Index, func, insert, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 database_name = 'trivia'
 database_user = 'cristiancevasco'
 database_password = ''
 database_host = 'localhost:5432'
 database_path = f'postgresql://{database_user}:{database_password}@{database_host}/{database_name}'
 
-db = SQLAlchemy()
+logger = logging.getLogger(__name__)
+
+"""
+RoutingSession
+    session running the reads of a request on the engine in g.read_engine (a
+    read replica picked by flaskr.replicas) when one is set. Flushes, and
+    everything outside such requests, use the primary.
+"""
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context():
+            read_engine = g.get('read_engine')
+            if read_engine is not None:
+                return read_engine
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service. engine_options
+    (pool sizing, pre-ping, ...) are passed to the engine as
+    SQLALCHEMY_ENGINE_OPTIONS.
 """
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, engine_options=None):
     app.config['SQLALCHEMY_DATABASE_URI'] = database_path
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    if engine_options is not None:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
     db.init_app(app)
 
+"""
+on_write(hook)
+    registers a callable run as hook(action, instance, changes) after a
+    Question or Category write is committed. action is 'insert', 'update'
+    or 'delete', or 'bulk_insert' with the model class as instance.
+    changes holds the {column: old value} of the changed columns for
+    'update' and the inserted row dicts, ids included, for 'bulk_insert'.
+    A failing hook is logged and skipped: the write is committed already,
+    and raising would answer it with an error.
+"""
+write_hooks = []
+
+def on_write(hook):
+    if hook not in write_hooks:
+        write_hooks.append(hook)
+    return hook
+
+def notify_write(action, instance, changes=None):
+    for hook in write_hooks:
+        try:
+            hook(action, instance, changes)
+        except Exception:
+            logger.exception("Write hook %s failed after a committed %s", getattr(hook, '__name__', hook), action)
+
 """
 Question
 """
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # Category listings/quiz steps seek by (category, id), difficulty filters by (category, difficulty)
+        Index('ix_questions_category_id', 'category', 'id'),
+        Index('ix_questions_category_difficulty', 'category', 'difficulty'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String, nullable=False)
     answer = Column(String, nullable=False)
-    category = Column(String, nullable=False)
+    category = Column(Integer, ForeignKey('categories.id'), nullable=False)
     difficulty = Column(Integer, nullable=False)
 
     def __init__(self, question, answer, category, difficulty):
@@ -37,24 +92,124 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
+        QuestionCount.bump(self.category, 1)
         db.session.commit()
+        notify_write('insert', self)
 
     def update(self):
+        # Old values of the changed columns, for the counters and the write hooks
+        state = inspect(self)
+        changes = {
+            column: state.attrs[column].history.deleted[0]
+            for column in ('question', 'answer', 'category', 'difficulty')
+            if state.attrs[column].history.deleted
+        }
+        if 'category' in changes:
+            QuestionCount.bump(changes['category'], -1)
+            QuestionCount.bump(self.category, 1)
+        db.session.commit()
+        notify_write('update', self, changes)
+
+    @classmethod
+    def bulk_insert(cls, rows):
+        # Insert many question dicts with one batched statement, counters included
+        ids = db.session.execute(
+            insert(cls).returning(cls.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        for category, total in Counter(row['category'] for row in rows).items():
+            QuestionCount.bump(category, total)
         db.session.commit()
+        notify_write('bulk_insert', cls, [{**row, 'id': question_id} for row, question_id in zip(rows, ids)])
 
     def delete(self):
         db.session.delete(self)
+        QuestionCount.bump(self.category, -1)
         db.session.commit()
+        notify_write('delete', self)
 
     def format(self):
+        return Question.format_row((self.id, self.question, self.answer, self.category, self.difficulty))
+
+    @classmethod
+    def columns(cls):
+        # The columns format() reads, for queries that fetch tuples instead of ORM objects
+        return (cls.id, cls.question, cls.answer, cls.category, cls.difficulty)
+
+    @staticmethod
+    def format_row(row):
+        # format() of an (id, question, answer, category, difficulty) row selected with columns()
+        question_id, question, answer, category, difficulty = row
         return {
-            'id': self.id,
-            'question': self.question,
-            'answer': self.answer,
-            'category': self.category,
-            'difficulty': self.difficulty
+            'id': question_id,
+            'question': question,
+            'answer': answer,
+            # Kept a string for clients written against the old text column
+            'category': str(category),
+            'difficulty': difficulty
         }
 
+"""
+QuestionCount
+    number of questions per category, kept in step with Question.insert()
+    and Question.delete() inside the same transaction so totals never need
+    a COUNT(*) over the questions table
+"""
+class QuestionCount(db.Model):
+    __tablename__ = 'question_counts'
+
+    category = Column(Integer, ForeignKey('categories.id', ondelete='CASCADE'), primary_key=True)
+    total = Column(Integer, nullable=False)
+
+    def __init__(self, category, total=0):
+        self.category = category
+        self.total = total
+
+    @classmethod
+    def bump(cls, category, delta):
+        result = db.session.execute(
+            update(cls).where(cls.category == category).values(total=cls.total + delta)
+        )
+        if result.rowcount:
+            return
+        # First question of the category, a concurrent writer may create the row first
+        try:
+            with db.session.begin_nested():
+                db.session.add(cls(category, delta))
+        except IntegrityError:
+            db.session.execute(
+                update(cls).where(cls.category == category).values(total=cls.total + delta)
+            )
+
+    @classmethod
+    def total_query(cls, category=None):
+        query = select(func.coalesce(func.sum(cls.total), 0))
+        if category is not None:
+            query = query.where(cls.category == category)
+        return query
+
+    @classmethod
+    def total_for(cls, category=None):
+        return db.session.execute(cls.total_query(category)).scalar()
+
+    @classmethod
+    def rebuild(cls):
+        # Recount every category from the questions table (one grouped scan)
+        db.session.query(cls).delete()
+        rows = db.session.query(Question.category, func.count(Question.id)).group_by(Question.category)
+        for category, total in rows:
+            db.session.add(cls(category, total))
+        db.session.commit()
+
+"""
+SchemaMigration
+    names of the schema migrations already applied to the database
+"""
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+
+    name = Column(String, primary_key=True)
+    applied_at = Column(DateTime, nullable=False, server_default=func.now())
+
 """
 Category
 """
@@ -70,13 +225,16 @@ class Category(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        notify_write('insert', self)
 
     def update(self):
         db.session.commit()
+        notify_write('update', self)
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        notify_write('delete', self)
 
     def format(self):
         return {
@@ -1,58 +1,202 @@
 import os
 import unittest
 import json
+import tempfile
+import shutil
+import sqlite3
+import csv
+import io
+import asyncio
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
 
 from flaskr import create_app
-from models import db, Question, Category
+from models import db, Question, Category, QuestionCount, SchemaMigration
+from flaskr.migrations import run_migrations
+from flaskr.cache import LocalCacheBackend
+from flaskr.quiz import QuizSession
+from flaskr.pool import engine_options
+from flaskr.replicas import STICKY_COOKIE
 from test_data import categories_data, questions_data
 from unittest.mock import patch
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, inspect, Table, MetaData, Column, Integer, String, insert
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+try:
+    import greenlet
+    from flaskr.asgi import create_asgi_app
+except ImportError:
+    create_asgi_app = None
+
+# SQL statements a request may run once the category cache, quiz pools and
+# search index are warm. The response cache is off so every request reaches
+# the database. `budget` is an upper bound, or the exact count with `exact`.
+# An extra count(), a Category.query.all() or an N+1 over the 10 test
+# questions breaks these.
+QueryBudget = namedtuple('QueryBudget', ['method', 'url', 'budget', 'body', 'exact'], defaults=[None, False])
+QUERY_BUDGETS = [
+    # Total from question_counts, then the page
+    QueryBudget("GET", "/questions?page=1", 2),
+    QueryBudget("GET", "/categories", 0, exact=True),
+    QueryBudget("GET", "/categories/1/questions", 1),
+    QueryBudget("GET", "/categories/1/questions?page=1", 2),
+    QueryBudget("GET", "/categories/1/questions?stream=json", 1),
+    QueryBudget("GET", "/questions/export", 1),
+    QueryBudget("POST", "/questions/search", 1, { "searchTerm": "title" }),
+    QueryBudget("POST", "/questions/search", 2, { "searchTerm": "title", "page": 1 }),
+    # The picked question by primary key, nothing else
+    QueryBudget("POST", "/quizzes", 1, { "previous_questions": [], "quiz_category": { "id": 1 } }, exact=True),
+    QueryBudget("POST", "/quizzes", 1, {
+        "previous_questions": [1], "quiz_category": { "id": 0 }, "difficulty_range": [1, 2]
+    }, exact=True),
+    QueryBudget("POST", "/quizzes/sessions", 0, { "quiz_category": { "id": 1 } }, exact=True),
+    # Insert, counter bump, then the new row and the total for the response
+    QueryBudget("POST", "/questions", 4, { "question": "Q", "answer": "A", "category": 1, "difficulty": 1 }),
+]
+
+
+def question_rows(questions):
+    # test_data.py question dicts as Question.bulk_insert() rows
+    return [
+        {
+            'question': data['question'],
+            'answer': data['answer'],
+            'category': data['category_id'],
+            'difficulty': data['difficulty']
+        }
+        for data in questions
+    ]
+
+
+def load_fixtures(categories=categories_data, questions=questions_data):
+    """
+    Insert the fixture rows with one batched INSERT per table (the question
+    counters included). Must run inside an app context.
+    """
+    db.session.execute(insert(Category), [{ 'id': data['id'], 'type': data['type'] } for data in categories])
+    Question.bulk_insert(question_rows(questions))
+
+
+def committed(test):
+    """
+    Run `test` on committed data instead of inside the rolled back
+    transaction: for tests that open other apps or connections, which do
+    not see the transaction, or that change the schema.
+    """
+    test.committed = True
+    return test
+
+
+async def asgi_call(async_app, method, path, query="", body=None, headers=()):
+    # Drive the ASGI app the way a server would and collect (status, body)
+    payload = json.dumps(body).encode() if body is not None else b""
+    messages = []
+    async def receive():
+        return { "type": "http.request", "body": payload, "more_body": False }
+    async def send(message):
+        messages.append(message)
+    await async_app({
+        "type": "http", "method": method, "path": path, "query_string": query.encode(),
+        "headers": [(b"content-type", b"application/json"), *headers], "http_version": "1.1",
+        "scheme": "http", "server": ("localhost", 80), "root_path": ""
+    }, receive, send)
+    return messages[0]["status"], b"".join(message.get("body", b"") for message in messages[1:])
+
+
+class FixtureSession(Session):
+    # Session bound to the test's connection, whose transaction is rolled back after the test
+    def get_bind(self, *args, **kwargs):
+        return self.bind
 
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
-    def setUp(self):
-        """Define test variables and initialize app."""
-        self.database_name = "trivia_test"
-        self.database_user = "cristiancevasco"
-        self.database_password = ""
-        self.database_host = "localhost:5432"
-        self.database_path = f"postgresql://{self.database_user}:{self.database_password}@{self.database_host}/{self.database_name}"
+    @classmethod
+    def setUpClass(cls):
+        """Create the schema and load the fixtures once for every test."""
+        # TEST_DATABASE_URL, e.g. postgresql://user@localhost:5432/trivia_test, or a throwaway SQLite file
+        cls.database_dir = None
+        cls.database_path = os.environ.get("TEST_DATABASE_URL")
+        if not cls.database_path:
+            cls.database_dir = tempfile.mkdtemp(prefix="trivia_test")
+            cls.database_path = f"sqlite:///{cls.database_dir}/trivia_test.db"
+        cls.reset_database()
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.database_dir is not None:
+            shutil.rmtree(cls.database_dir, ignore_errors=True)
+
+    @classmethod
+    def reset_database(cls):
+        # Fresh schema and fixture rows, committed
+        app = create_app(cls.app_config())
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+            db.create_all()
+            load_fixtures()
+            db.session.remove()
+            db.engine.dispose()
 
-        # Create app with the test configuration
-        self.app = create_app({
-            "SQLALCHEMY_DATABASE_URI": self.database_path,
+    @classmethod
+    def app_config(cls):
+        return {
+            "SQLALCHEMY_DATABASE_URI": cls.database_path,
             "SQLALCHEMY_TRACK_MODIFICATIONS": False,
             "TESTING": True
-        })
+        }
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        # Create app with the test configuration
+        self.app = create_app(self.app_config())
         self.client = self.app.test_client()
 
-        # Bind the app to the current context and create all tables
-        with self.app.app_context():
-            db.drop_all()
-            db.create_all()
-        
-            # Create categories in database
-            for data in categories_data:
-                category_to_add = Category(type = data['type'])
-                category_to_add.id = data['id']
-                category_to_add.insert()
-            # Create questions in database
-            for data in questions_data:
-                question_to_add = Question(
-                    question=data['question'],
-                    answer = data['answer'],
-                    category = data['category_id'],
-                    difficulty = data['difficulty']
-                    )
-                question_to_add.insert()
+        # Every write of the test (commits included, as SAVEPOINTs) is rolled back in tearDown
+        self.isolated = not getattr(getattr(self, self._testMethodName), 'committed', False)
+        if self.isolated:
+            with self.app.app_context():
+                self.connection = db.engine.connect()
+            self.transaction = self.connection.begin()
+            self.app_session = db.session
+            db.session = db._make_scoped_session({
+                "class_": FixtureSession,
+                "bind": self.connection,
+                "join_transaction_mode": "create_savepoint"
+            })
 
 
     def tearDown(self):
         """Executed after each test"""
         with self.app.app_context():
             db.session.remove()
-            db.drop_all()
+        if self.isolated:
+            db.session = self.app_session
+            self.transaction.rollback()
+            self.connection.close()
+        else:
+            # The test committed its writes (or changed the schema), start the next one afresh
+            self.reset_database()
+        with self.app.app_context():
+            db.engine.dispose()
+
+    def load_questions(self, questions):
+        """
+        Add `questions` (test_data.py shaped dicts) to the test's data with
+        one batched insert, e.g. thousands of rows for a performance-sized test.
+        """
+        with self.app.app_context():
+            Question.bulk_insert(question_rows(questions))
     
     # Tests for /questions endpoint
     def test_get_paginated_questions(self):
@@ -123,6 +267,177 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["message"], "unprocessable")
     
 
+    def test_get_questions_with_keyset_cursor(self):
+        # First page returns a cursor for the next one
+        res = self.client.get("/questions")
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data["next_cursor"])
+        first_page_ids = [ question["id"] for question in data["questions"] ]
+
+        # Follow the cursor
+        res = self.client.get(f"/questions?cursor={data['next_cursor']}")
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data["questions"]), 2)
+        self.assertTrue(min(q["id"] for q in data["questions"]) > max(first_page_ids))
+        # Last page has no next cursor
+        self.assertIsNone(data["next_cursor"])
+
+        # Keyset and offset pagination return the same second page
+        res = self.client.get("/questions?page=2")
+        self.assertEqual(json.loads(res.data)["questions"], data["questions"])
+
+
+    def test_get_questions_after_id(self):
+        # Get response object
+        res = self.client.get("/questions?after_id=3&per_page=2")
+        data = json.loads(res.data)
+
+        # Check the rows follow the given id
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([ q["id"] for q in data["questions"] ], [4, 5])
+
+
+    def test_per_page_is_capped(self):
+        # Get response object
+        res = self.client.get("/questions?per_page=100000")
+        data = json.loads(res.data)
+
+        # Check all 12 questions fit the capped page
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data["questions"]), 12)
+        self.assertIsNone(data["next_cursor"])
+
+
+    def test_keyset_cursor_walks_a_large_bank(self):
+        # 5000 more questions, rolled back with the rest of the test
+        self.load_questions(
+            dict(questions_data[index % len(questions_data)], question=f"Generated question {index}")
+            for index in range(5000)
+        )
+
+        # Follow the cursors over the whole bank, 100 questions per page
+        seen, url = [], "/questions?per_page=100"
+        while url:
+            data = json.loads(self.client.get(url).data)
+            seen.extend(question["id"] for question in data["questions"])
+            url = f"/questions?per_page=100&cursor={data['next_cursor']}" if data["next_cursor"] else None
+
+        # Check every question came once, in order, and the total followed the insert
+        self.assertEqual(seen, list(range(1, 5013)))
+        self.assertEqual(data["total_questions"], 5012)
+
+
+    def test_422_if_cursor_is_invalid(self):
+        # Get response objects
+        res_cursor = self.client.get("/questions?cursor=garbage")
+        res_per_page = self.client.get("/questions?per_page=0")
+
+        # Check status codes
+        self.assertEqual(res_cursor.status_code, 422)
+        self.assertEqual(res_per_page.status_code, 422)
+        self.assertEqual(json.loads(res_cursor.data)["message"], "unprocessable")
+
+
+    def test_total_questions_follows_creations_and_deletions(self):
+        # Create a question
+        res = self.client.post("/questions", json={
+            "question": "What is acrophobia a fear of?",
+            "answer": "Heights",
+            "category": 2,
+            "difficulty": 3
+        })
+        data = json.loads(res.data)
+        self.assertEqual(data["total_questions"], len(questions_data) + 1)
+
+        # Delete two questions
+        self.client.delete(f"/questions/{data['created']}")
+        self.client.delete("/questions/1")
+        data = json.loads(self.client.get("/questions").data)
+
+        # Check the counters agree with a real count
+        with self.app.app_context():
+            self.assertEqual(data["total_questions"], Question.query.count())
+            self.assertEqual(data["total_questions"], len(questions_data) - 1)
+
+
+    def test_get_questions_does_not_count_the_questions_table(self):
+        # Record every SQL statement run by the request
+        statements = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement.lower())
+
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            res = self.client.get("/questions")
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+        # Check no COUNT over the questions table was issued
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(statements)
+        for statement in statements:
+            self.assertFalse("count(" in statement and "from questions" in statement, statement)
+
+
+    def test_json_providers_serve_the_same_documents(self):
+        def fetch(json_provider):
+            provider_app = create_app({
+                "SQLALCHEMY_DATABASE_URI": self.database_path,
+                "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+                "TESTING": True,
+                "JSON_PROVIDER": json_provider
+            })
+            client = provider_app.test_client()
+            return [json.loads(client.get(url).data) for url in
+                    ("/questions?page=1", "/categories/1/questions", "/categories/1/questions?stream=json")]
+
+        # Check orjson (when installed) and the standard library json module agree
+        self.assertEqual(fetch("auto"), fetch("default"))
+        self.assertEqual(fetch("default")[1]["questions"][0]["category"], "1")
+        with self.assertRaises(ValueError):
+            fetch("yaml")
+
+
+    @committed
+    def test_requests_stay_within_their_query_budget(self):
+        budget_app = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+            "TESTING": True,
+            "RESPONSE_CACHE_TTL": 0
+        })
+        client = budget_app.test_client()
+        with budget_app.app_context():
+            engine = db.engine
+
+        statements = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(" ".join(statement.split()))
+
+        for query_budget in QUERY_BUDGETS:
+            with self.subTest(query_budget.method + " " + query_budget.url):
+                # A first request warms the caches and pools, the second one is measured
+                for _ in range(2):
+                    statements.clear()
+                    event.listen(engine, "before_cursor_execute", record)
+                    try:
+                        res = client.open(query_budget.url, method=query_budget.method, json=query_budget.body)
+                        res.get_data()
+                    finally:
+                        event.remove(engine, "before_cursor_execute", record)
+                self.assertLess(res.status_code, 300)
+
+                # Check the number of statements, listing them on failure
+                if query_budget.exact:
+                    self.assertEqual(len(statements), query_budget.budget, "\n".join(statements))
+                else:
+                    self.assertLessEqual(len(statements), query_budget.budget, "\n".join(statements))
+
+
     def test_patch_method_not_allowed_questions(self):
         # Get response object
         res = self.client.patch("/questions")
@@ -180,6 +495,144 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(len(data['categories']), 6)
     
 
+    def test_categories_are_cached_until_a_category_write(self):
+        cache = self.app.extensions['category_cache']
+
+        # First request loads the categories, the next ones are served from the cache
+        self.client.get("/categories")
+        self.client.get("/questions")
+        self.client.get("/categories/1/questions")
+        self.assertEqual(cache.stats(), { "hits": 2, "misses": 1 })
+
+        # Inserting a category invalidates the cache
+        with self.app.app_context():
+            Category(type="Music").insert()
+        data = json.loads(self.client.get("/categories").data)
+        self.assertEqual(len(data["categories"]), 7)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+
+    def test_conditional_get_returns_304_without_database(self):
+        # First request returns the data with an ETag
+        res = self.client.get("/categories")
+        self.assertEqual(res.status_code, 200)
+        etag = res.headers["ETag"]
+        self.assertTrue(etag)
+        self.assertIn("must-revalidate", res.headers["Cache-Control"])
+
+        # Revalidating must not run any SQL
+        statements = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            res = self.client.get("/categories", headers={ "If-None-Match": etag })
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers["ETag"], etag)
+        self.assertEqual(statements, [])
+
+
+    def test_local_cache_is_safe_across_threads(self):
+        # Threads of one worker bumping a counter and filling the LRU at once
+        cache = LocalCacheBackend(max_entries=64)
+        def work(thread):
+            for step in range(2000):
+                cache.incr("hits")
+                cache.set(f"{thread}:{step}", step)
+                cache.get(f"{thread}:{step - 1}")
+        threads = [ threading.Thread(target=work, args=(thread,)) for thread in range(8) ]
+        # Switch threads as often as possible to surface races
+        previous = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(previous)
+
+        # No increment lost, and the LRU stayed within its bound
+        self.assertEqual(cache.get("hits"), 8 * 2000)
+        self.assertLessEqual(len(cache.entries), 64)
+
+
+    def test_response_cache_is_invalidated_by_writes(self):
+        # Cache the first page
+        res = self.client.get("/questions?page=2")
+        etag = res.headers["ETag"]
+        self.assertEqual(len(json.loads(res.data)["questions"]), 2)
+
+        # Create a question, the old ETag must no longer match
+        self.client.post("/questions", json={
+            "question": "What is acrophobia a fear of?",
+            "answer": "Heights",
+            "category": 2,
+            "difficulty": 3
+        })
+        res = self.client.get("/questions?page=2", headers={ "If-None-Match": etag })
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], etag)
+        self.assertEqual(len(json.loads(res.data)["questions"]), 3)
+
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_redis_cache_is_shared_and_invalidated_across_workers(self):
+        # Two apps standing for two workers sharing one Redis server
+        server = fakeredis.FakeServer()
+        workers = [
+            create_app({
+                "SQLALCHEMY_DATABASE_URI": self.database_path,
+                "CACHE_BACKEND": "redis",
+                "CACHE_REDIS_CLIENT": fakeredis.FakeRedis(server=server),
+                "TESTING": True
+            })
+            for _ in range(2)
+        ]
+        first, second = [ worker.test_client() for worker in workers ]
+
+        # A response cached by the first worker is a hit for the second
+        etag = first.get("/categories").headers["ETag"]
+        res = second.get("/categories", headers={ "If-None-Match": etag })
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(workers[1].extensions["response_cache"].stats()["hits"], 1)
+
+        # A write through the first worker invalidates the second one
+        first.post("/questions", json={
+            "question": "What is acrophobia a fear of?",
+            "answer": "Heights",
+            "category": 2,
+            "difficulty": 3
+        })
+        data = json.loads(second.get("/questions").data)
+        self.assertEqual(data["total_questions"], len(questions_data) + 1)
+        self.assertEqual(workers[1].extensions["response_cache"].stats()["misses"], 1)
+
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_redis_response_cache_can_be_turned_off(self):
+        client = fakeredis.FakeRedis()
+        uncached_app = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "CACHE_BACKEND": "redis",
+            "CACHE_REDIS_CLIENT": client,
+            "RESPONSE_CACHE_TTL": 0,
+            "TESTING": True
+        })
+
+        # Responses keep their ETag but nothing is stored
+        res = uncached_app.test_client().get("/questions")
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.headers["ETag"])
+        self.assertEqual([ key for key in client.keys() if b"responses:" in key ], [])
+
+
     def test_patch_method_not_allowed_categories(self):
         # Get response object
         res = self.client.patch("/categories")
@@ -380,6 +833,29 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['message'], 'unprocessable')
     
 
+    def test_create_question_succeeds_when_a_write_hook_fails(self):
+        # The response cache backend is down once the question is committed
+        response_cache = self.app.extensions["response_cache"]
+        with self.app.app_context():
+            total_questions_before = Question.query.count()
+        with patch.object(response_cache, "bump", side_effect=ConnectionError("cache down")), \
+                self.assertLogs("models", level="ERROR") as logs:
+            res = self.client.post("/questions", json={
+                "question": "Which planet is known as the Red Planet?",
+                "answer": "Mars",
+                "category": 1,
+                "difficulty": 1
+            })
+        data = json.loads(res.data)
+
+        # Check the committed question is reported as created, stored once and in the quiz pool
+        self.assertEqual(res.status_code, 201)
+        self.assertIn("sync_response_cache", logs.output[0])
+        with self.app.app_context():
+            self.assertEqual(Question.query.count(), total_questions_before + 1)
+        self.assertIn(data["created"], self.app.extensions["question_pool"].pool_for(1))
+
+
     def test_400_bad_request_create_question(self):
         # Use app context to call the db
         with self.app.app_context():
@@ -439,6 +915,172 @@ class TriviaTestCase(unittest.TestCase):
     
 
     # Test search questions
+    def test_bulk_create_questions_from_ndjson(self):
+        # Two valid rows, one with a bad difficulty, one missing its answer and broken JSON
+        lines = [
+            json.dumps({ "question": "Who sculpted David?", "answer": "Michelangelo", "category": 2, "difficulty": 2 }),
+            json.dumps({ "question": "What is acrophobia a fear of?", "answer": "Heights", "category": "2", "difficulty": 3 }),
+            json.dumps({ "question": "Bad difficulty", "answer": "x", "category": 2, "difficulty": "three" }),
+            json.dumps({ "question": "No answer", "category": 2, "difficulty": 1 }),
+            "{not json"
+        ]
+        res = self.client.post(
+            "/questions/bulk",
+            data="\n".join(lines),
+            content_type="application/x-ndjson"
+        )
+        data = json.loads(res.data)
+
+        # Check the report
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["inserted"], 2)
+        self.assertEqual(data["failed"], 3)
+        self.assertEqual([ error["line"] for error in data["errors"] ], [3, 4, 5])
+        self.assertIn("rows_per_second", data)
+        self.assertEqual(data["total_questions"], len(questions_data) + 2)
+
+        # Check the rows are in the database
+        with self.app.app_context():
+            self.assertEqual(Question.query.filter(Question.category == '2').count(), 4)
+
+
+    def test_bulk_create_questions_from_csv(self):
+        # CSV body with a header row
+        body = "question,answer,category,difficulty\n" \
+            "Who sculpted David?,Michelangelo,2,2\n" \
+            "\"What is acrophobia, exactly?\",Fear of heights,2,3\n" \
+            "Missing difficulty,x,2,\n"
+        res = self.client.post("/questions/bulk", data=body, content_type="text/csv")
+        data = json.loads(res.data)
+
+        # Check the report, the header counts as line 1
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["inserted"], 2)
+        self.assertEqual(data["errors"], [{ "line": 4, "error": "question, answer, category and difficulty are required" }])
+
+        # New rows are searchable right away
+        res = self.client.post("/questions/search", json={ "searchTerm": "acrophobia" })
+        self.assertEqual(json.loads(res.data)["total_questions"], 1)
+
+
+    def test_400_if_bulk_format_is_unknown(self):
+        # Get response object
+        res = self.client.post("/questions/bulk?format=xml", data="<questions/>")
+        data = json.loads(res.data)
+
+        # Check status code
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["message"], "bad request")
+
+
+    def test_400_if_bulk_body_is_unreadable(self):
+        # Bytes that are not UTF-8, then a CSV field past the csv module's size limit
+        bodies = [
+            (b"\xff\xfe" + json.dumps({ "question": "Q", "answer": "A", "category": 1, "difficulty": 1 }).encode(),
+             "application/x-ndjson"),
+            ("question,answer,category,difficulty\n" + "x" * 200000 + ",A,1,1\n", "text/csv"),
+        ]
+        for body, content_type in bodies:
+            res = self.client.post("/questions/bulk", data=body, content_type=content_type)
+            data = json.loads(res.data)
+
+            # Check status code
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(data["success"], False)
+            self.assertEqual(data["message"], "bad request")
+
+
+    def test_import_questions_command(self):
+        # Write an NDJSON file and load it through the CLI
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False) as f:
+            path = f.name
+            for index in range(25):
+                f.write(json.dumps({ "question": f"Imported question {index}?", "answer": "Yes", "category": 3, "difficulty": 1 }) + "\n")
+        try:
+            result = self.app.test_cli_runner().invoke(args=["import-questions", path, "--batch-size", "10"])
+        finally:
+            os.remove(path)
+
+        # Check the command output and the database
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Imported 25 questions (0 failed)", result.output)
+        self.assertIn("rows/s", result.output)
+        with self.app.app_context():
+            self.assertEqual(Question.query.filter(Question.category == '3').count(), 25)
+
+
+    def test_export_questions_as_ndjson(self):
+        # Get response object
+        res = self.client.get("/questions/export")
+
+        # Check every question is exported, one per line
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/x-ndjson")
+        self.assertIn("attachment", res.headers["Content-Disposition"])
+        exported = [ json.loads(line) for line in res.get_data(as_text=True).splitlines() ]
+        self.assertEqual(len(exported), len(questions_data))
+        self.assertEqual(exported[0]["question"], questions_data[0]["question"])
+
+
+    def test_export_questions_as_filtered_csv(self):
+        # Only 'Science' questions of difficulty 1
+        res = self.client.get("/questions/export?format=csv&category=1&difficulty=1")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "text/csv")
+
+        rows = list(csv.DictReader(io.StringIO(res.get_data(as_text=True))))
+        expected = [ q for q in questions_data if q["category_id"] == 1 and q["difficulty"] == 1 ]
+        self.assertEqual(len(rows), len(expected))
+        for row in rows:
+            self.assertEqual(row["category"], "1")
+            self.assertEqual(row["difficulty"], "1")
+
+
+    def test_export_then_import_round_trip(self):
+        # Export the bank as CSV and import it back
+        body = self.client.get("/questions/export?format=csv").get_data(as_text=True)
+        res = self.client.post("/questions/bulk", data=body, content_type="text/csv")
+        data = json.loads(res.data)
+
+        # Check every exported row was accepted
+        self.assertEqual(data["inserted"], len(questions_data))
+        self.assertEqual(data["total_questions"], 2 * len(questions_data))
+
+
+    def test_csv_and_ndjson_exports_hold_the_same_values(self):
+        # Export the bank in both formats
+        ndjson_rows = [ json.loads(line) for line in self.client.get("/questions/export").get_data(as_text=True).splitlines() ]
+        csv_rows = list(csv.DictReader(io.StringIO(self.client.get("/questions/export?format=csv").get_data(as_text=True))))
+
+        # Check the category is written the same way, as the API returns it
+        self.assertEqual([ row["category"] for row in csv_rows ], [ row["category"] for row in ndjson_rows ])
+        self.assertEqual(
+            [ { **row, "id": int(row["id"]), "difficulty": int(row["difficulty"]) } for row in csv_rows ],
+            ndjson_rows
+        )
+
+
+    def test_422_if_export_filter_is_not_an_integer(self):
+        # Get response object
+        res = self.client.get("/questions/export?category=science")
+        data = json.loads(res.data)
+
+        # Check status code
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["message"], "unprocessable")
+
+
+    def test_export_questions_command(self):
+        # Export the 'Art' category through the CLI to stdout
+        result = self.app.test_cli_runner().invoke(args=["export-questions", "--category", "2"])
+
+        # Check the output
+        self.assertEqual(result.exit_code, 0, result.output)
+        exported = [ json.loads(line) for line in result.output.splitlines() ]
+        self.assertEqual([ q["category"] for q in exported ], ["2", "2"])
+
+
     def test_search_questions_with_results(self):
         # Payload to send
         search_data = {"searchTerm": "planet"}
@@ -512,6 +1154,175 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["total_questions"], 0)
     
 
+    def test_search_questions_paginated(self):
+        # 'What' matches several questions, ask for pages of 2
+        search_data = { "searchTerm": "what", "page": 1, "per_page": 2 }
+        res = self.client.post("/questions/search", json=search_data)
+        data = json.loads(res.data)
+
+        # Check the page holds 2 rows while the total counts every match
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data["questions"]), 2)
+        with self.app.app_context():
+            total_matches = Question.query.filter(Question.question.ilike("%what%")).count()
+        self.assertEqual(data["total_questions"], total_matches)
+
+
+    def test_search_can_match_answers(self):
+        # 'Jupiter' only appears in an answer
+        res = self.client.post("/questions/search", json={ "searchTerm": "jupiter" })
+        self.assertEqual(json.loads(res.data)["total_questions"], 0)
+
+        res = self.client.post("/questions/search", json={
+            "searchTerm": "jupiter",
+            "searchAnswers": True
+        })
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["total_questions"], 1)
+        self.assertEqual(data["questions"][0]["answer"], "Jupiter")
+
+
+    def test_422_if_search_page_is_invalid(self):
+        # Get response object
+        res = self.client.post("/questions/search", json={ "searchTerm": "what", "page": 0 })
+        data = json.loads(res.data)
+
+        # Check status code
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["message"], "unprocessable")
+
+
+    def test_400_if_search_term_is_not_a_string(self):
+        memory_app = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "SEARCH_BACKEND": "memory",
+            "TESTING": True
+        })
+        for client in (self.client, memory_app.test_client()):
+            for term in (5, ["what"], { "term": "what" }, None):
+                res = client.post("/questions/search", json={ "searchTerm": term })
+                data = json.loads(res.data)
+
+                # Check status code
+                self.assertEqual(res.status_code, 400)
+                self.assertEqual(data["success"], False)
+
+
+    def test_memory_search_matches_ilike_search(self):
+        # App serving search from the in-process inverted index
+        memory_app = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "SEARCH_BACKEND": "memory",
+            "TESTING": True
+        })
+        memory_client = memory_app.test_client()
+
+        for term in ["what", "WHAT", "the", "mona", "is the", "no such thing", "ph", "h2o", "pl_net"]:
+            for search_answers in [False, True]:
+                search_data = { "searchTerm": term, "searchAnswers": search_answers }
+                expected = json.loads(self.client.post("/questions/search", json=search_data).data)
+                actual = json.loads(memory_client.post("/questions/search", json=search_data).data)
+                self.assertEqual(actual["questions"], expected["questions"])
+                self.assertEqual(actual["total_questions"], expected["total_questions"])
+
+
+    def test_memory_search_follows_created_and_deleted_questions(self):
+        # App serving search from the in-process inverted index
+        memory_app = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "SEARCH_BACKEND": "memory",
+            "TESTING": True
+        })
+        memory_client = memory_app.test_client()
+        search_data = { "searchTerm": "acrophobia" }
+
+        # Create a question, the index must find it without a rebuild
+        res = memory_client.post("/questions", json={
+            "question": "What is acrophobia a fear of?",
+            "answer": "Heights",
+            "category": 2,
+            "difficulty": 3
+        })
+        created_id = json.loads(res.data)["created"]
+        data = json.loads(memory_client.post("/questions/search", json=search_data).data)
+        self.assertEqual([ q["id"] for q in data["questions"] ], [created_id])
+
+        # Delete it again
+        memory_client.delete(f"/questions/{created_id}")
+        data = json.loads(memory_client.post("/questions/search", json=search_data).data)
+        self.assertEqual(data["total_questions"], 0)
+
+
+    def test_memory_search_follows_bulk_inserts_and_updates(self):
+        # App serving search and quizzes from in-process indexes
+        memory_app = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "SEARCH_BACKEND": "memory",
+            "TESTING": True
+        })
+        memory_client = memory_app.test_client()
+        index = memory_app.extensions["search"]
+        questions = index.questions
+
+        # Bulk insert, applied to the index in place
+        body = json.dumps({ "question": "What is acrophobia a fear of?", "answer": "Heights", "category": 2, "difficulty": 3 })
+        memory_client.post("/questions/bulk", data=body, content_type="application/x-ndjson")
+        data = json.loads(memory_client.post("/questions/search", json={ "searchTerm": "acrophobia" }).data)
+        self.assertEqual(len(data["questions"]), 1)
+        created_id = data["questions"][0]["id"]
+
+        # Update the text and the category
+        with memory_app.app_context():
+            question = db.session.get(Question, created_id)
+            question.question = "What is claustrophobia a fear of?"
+            question.category = 3
+            question.update()
+
+        # The index follows without being rebuilt, and so do the quiz pools and counters
+        self.assertIs(index.questions, questions)
+        data = json.loads(memory_client.post("/questions/search", json={ "searchTerm": "acrophobia" }).data)
+        self.assertEqual(data["total_questions"], 0)
+        data = json.loads(memory_client.post("/questions/search", json={ "searchTerm": "claustrophobia" }).data)
+        self.assertEqual([ q["id"] for q in data["questions"] ], [created_id])
+        with memory_app.app_context():
+            pool = memory_app.extensions["question_pool"]
+            self.assertIn(created_id, pool.get_pool(3))
+            self.assertNotIn(created_id, pool.get_pool(2))
+        data = json.loads(memory_client.get("/categories/2/questions").data)
+        self.assertEqual(data["total_questions"], 2)
+
+
+    @committed
+    def test_memory_search_rebuilds_in_the_background(self):
+        # Worker rebuilding its index every 0.1s, and another worker writing
+        memory_app = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "SEARCH_BACKEND": "memory",
+            "SEARCH_INDEX_TTL": 0.1,
+            "TESTING": True
+        })
+        memory_client = memory_app.test_client()
+        index = memory_app.extensions["search"]
+        try:
+            self.client.post("/questions", json={
+                "question": "What is acrophobia a fear of?",
+                "answer": "Heights",
+                "category": 2,
+                "difficulty": 3
+            })
+
+            # The other worker's question shows up once a rebuild has been swapped in
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline and not index.questions.candidates("acrophobia"):
+                time.sleep(0.05)
+            self.assertTrue(index.questions.candidates("acrophobia"))
+            data = json.loads(memory_client.post("/questions/search", json={ "searchTerm": "acrophobia" }).data)
+            self.assertEqual(data["total_questions"], 1)
+        finally:
+            index.close()
+
+
     def test_405_if_search_attempted_with_delete(self):
         # Get response object
         res = self.client.delete(f"/questions/search")
@@ -578,6 +1389,53 @@ class TriviaTestCase(unittest.TestCase):
             self.assertEqual(question["category"], "1")
 
 
+    def test_get_questions_by_category_paginated(self):
+        # Walk the 'Science' category 4 questions at a time
+        served_ids = []
+        url = "/categories/1/questions?per_page=4"
+        while url:
+            res = self.client.get(url)
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertLessEqual(len(data["questions"]), 4)
+            self.assertEqual(data["total_questions"], 10)
+            served_ids += [ question["id"] for question in data["questions"] ]
+            url = data["next_cursor"] and f"/categories/1/questions?per_page=4&cursor={data['next_cursor']}"
+
+        # Check every question was listed once, in id order
+        self.assertEqual(served_ids, list(range(1, 11)))
+
+
+    def test_get_questions_by_category_streamed(self):
+        buffered = json.loads(self.client.get("/categories/1/questions").data)
+
+        # NDJSON: one question per line
+        res = self.client.get("/categories/1/questions?stream=ndjson")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/x-ndjson")
+        lines = res.get_data(as_text=True).splitlines()
+        self.assertEqual([ json.loads(line) for line in lines ], buffered["questions"])
+
+        # JSON: the same document as the buffered response
+        res = self.client.get("/categories/1/questions?stream=json")
+        self.assertEqual(res.status_code, 200)
+        streamed = json.loads(res.data)
+        self.assertEqual(streamed["questions"], buffered["questions"])
+        self.assertEqual(streamed["total_questions"], buffered["total_questions"])
+        self.assertEqual(streamed["current_category"], 1)
+        self.assertEqual(streamed["success"], True)
+
+
+    def test_422_if_category_stream_format_is_unknown(self):
+        # Get response object
+        res = self.client.get("/categories/1/questions?stream=xml")
+        data = json.loads(res.data)
+
+        # Check status code
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["message"], "unprocessable")
+
+
     def test_404_if_get_questions_for_invalid_category(self):
         # Get response object
         res = self.client.get(f"/categories/1000/questions")
@@ -745,6 +1603,355 @@ class TriviaTestCase(unittest.TestCase):
         self.assertIsNone(data["question"])
     
 
+    def test_quiz_serves_every_question_once(self):
+        # Play a whole quiz over the 'Science' category
+        previous_ids = []
+        while True:
+            payload = {
+                'previous_questions': previous_ids,
+                'quiz_category': { 'id': '1', 'type': 'Science' }
+            }
+            res = self.client.post("/quizzes", json=payload)
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            if data["question"] is None:
+                break
+            # Check the question was not served before
+            self.assertNotIn(data["question"]["id"], previous_ids)
+            self.assertEqual(data["question"]["category"], "1")
+            previous_ids.append(data["question"]["id"])
+
+        # Check every science question was served
+        with self.app.app_context():
+            total_science = Question.query.filter(Question.category == '1').count()
+        self.assertEqual(len(previous_ids), total_science)
+
+
+    def test_quiz_pool_follows_created_and_deleted_questions(self):
+        # Exhaust the 'Art' category so the quiz pool gets loaded
+        payload = {
+            'previous_questions': [11, 12],
+            'quiz_category': { 'id': 2, 'type': 'Art' }
+        }
+        res = self.client.post("/quizzes", json=payload)
+        self.assertIsNone(json.loads(res.data)["question"])
+
+        # Create a new art question, it must be served next
+        res = self.client.post("/questions", json={
+            "question": "Who sculpted David?",
+            "answer": "Michelangelo",
+            "category": 2,
+            "difficulty": 2
+        })
+        created_id = json.loads(res.data)["created"]
+        res = self.client.post("/quizzes", json=payload)
+        self.assertEqual(json.loads(res.data)["question"]["id"], created_id)
+
+        # Delete it again, the quiz must be over
+        self.client.delete(f"/questions/{created_id}")
+        res = self.client.post("/quizzes", json=payload)
+        self.assertIsNone(json.loads(res.data)["question"])
+
+
+    def test_quiz_pool_rebuild_replays_writes_made_meanwhile(self):
+        pool = self.app.extensions["question_pool"]
+        build = pool.build
+
+        def build_after_writes(rows):
+            # Writes committed after the rebuild read its rows
+            pool.add(9999, 2, 3)
+            pool.discard(11, 2, 4)
+            build(rows)
+
+        with self.app.app_context(), patch.object(pool, "build", side_effect=build_after_writes):
+            pool.load()
+        self.assertIn(9999, pool.pool_for(2))
+        self.assertIn(9999, pool.pool_for(2, 3))
+        self.assertNotIn(11, pool.pool_for(2))
+        self.assertEqual(len(pool.deck_for(2)), len(pool.pool_for(2)))
+
+
+    @committed
+    def test_quiz_pool_rebuilds_in_the_background(self):
+        # Worker rebuilding its quiz pools every 0.1s, and another worker writing
+        quiz_app = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "QUIZ_POOL_TTL": 0.1,
+            "TESTING": True
+        })
+        pool = quiz_app.extensions["question_pool"]
+        try:
+            res = self.client.post("/questions", json={
+                "question": "Who sculpted David?",
+                "answer": "Michelangelo",
+                "category": 2,
+                "difficulty": 2
+            })
+            created_id = json.loads(res.data)["created"]
+
+            # The other worker's question shows up once a rebuild has been swapped in
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline and created_id not in pool.pool_for(2):
+                time.sleep(0.05)
+            self.assertIn(created_id, pool.pool_for(2))
+            res = quiz_app.test_client().post("/quizzes", json={
+                'previous_questions': [11, 12],
+                'quiz_category': { 'id': 2, 'type': 'Art' }
+            })
+            self.assertEqual(json.loads(res.data)["question"]["id"], created_id)
+        finally:
+            pool.close()
+
+
+    def test_quiz_session_serves_every_question_once(self):
+        # Start a server-side session for the 'Science' category
+        res = self.client.post("/quizzes/sessions", json={
+            'quiz_category': { 'id': '1', 'type': 'Science' }
+        })
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(data["success"], True)
+        token = data["session"]
+
+        # Play the quiz only sending the session token
+        served_ids = []
+        while True:
+            res = self.client.post("/quizzes", json={ 'session': token })
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data["session"], token)
+            if data["question"] is None:
+                break
+            self.assertNotIn(data["question"]["id"], served_ids)
+            self.assertEqual(data["question"]["category"], "1")
+            served_ids.append(data["question"]["id"])
+
+        # Check every science question was served
+        with self.app.app_context():
+            total_science = Question.query.filter(Question.category == '1').count()
+        self.assertEqual(len(served_ids), total_science)
+
+
+    def test_quiz_session_deck_follows_created_and_deleted_questions(self):
+        res = self.client.post("/quizzes/sessions", json={ 'quiz_category': { 'id': 1, 'type': 'Science' } })
+        token = json.loads(res.data)["session"]
+        res = self.client.post("/quizzes", json={ 'session': token })
+        served_ids = [json.loads(res.data)["question"]["id"]]
+
+        # Create a science question and delete one the session has not seen yet
+        res = self.client.post("/questions", json={
+            "question": "What is H2O?", "answer": "Water", "category": 1, "difficulty": 1
+        })
+        created_id = json.loads(res.data)["created"]
+        with self.app.app_context():
+            science_ids = [ question.id for question in Question.query.filter(Question.category == 1) ]
+        deleted_id = next(question_id for question_id in science_ids
+                          if question_id not in served_ids and question_id != created_id)
+        self.client.delete(f"/questions/{deleted_id}")
+
+        # Play to the end of the deck
+        while True:
+            res = self.client.post("/quizzes", json={ 'session': token })
+            question = json.loads(res.data)["question"]
+            if question is None:
+                break
+            served_ids.append(question["id"])
+
+        # Check the new question was dealt, the deleted one was not, and nothing twice
+        self.assertEqual(sorted(served_ids), sorted(set(science_ids) - { deleted_id }))
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_quiz_session_is_shared_across_workers(self):
+        # Two apps standing for two workers sharing one Redis server
+        server = fakeredis.FakeServer()
+        workers = [
+            create_app({
+                "SQLALCHEMY_DATABASE_URI": self.database_path,
+                "CACHE_BACKEND": "redis",
+                "CACHE_REDIS_CLIENT": fakeredis.FakeRedis(server=server),
+                "TESTING": True
+            })
+            for _ in range(2)
+        ]
+        clients = [ worker.test_client() for worker in workers ]
+        res = clients[0].post("/quizzes/sessions", json={
+            'quiz_category': { 'id': 0, 'type': 'All' },
+            'difficulty_range': [1, 4],
+            'progression': 'ramp'
+        })
+        token = json.loads(res.data)["session"]
+
+        # Alternate between the workers, each picks up where the other left off
+        served_ids, difficulties = [], []
+        while True:
+            res = clients[len(served_ids) % 2].post("/quizzes", json={ 'session': token })
+            self.assertEqual(res.status_code, 200)
+            question = json.loads(res.data)["question"]
+            if question is None:
+                break
+            served_ids.append(question["id"])
+            difficulties.append(question["difficulty"])
+        self.assertEqual(sorted(served_ids), sorted(set(served_ids)))
+        self.assertEqual(len(served_ids), len([ q for q in questions_data if 1 <= q["difficulty"] <= 4 ]))
+        self.assertEqual(difficulties[:6], [1, 1, 1, 2, 2, 2])
+
+
+    def test_quiz_session_continues_after_a_served_question_is_deleted(self):
+        res = self.client.post("/quizzes/sessions", json={ 'quiz_category': { 'id': 1, 'type': 'Science' } })
+        token = json.loads(res.data)["session"]
+        with self.app.app_context():
+            science_ids = [ question.id for question in Question.query.filter(Question.category == 1) ]
+
+        # Serve all but one science question, then delete one of those served
+        served_ids = []
+        for _ in range(len(science_ids) - 1):
+            res = self.client.post("/quizzes", json={ 'session': token })
+            served_ids.append(json.loads(res.data)["question"]["id"])
+        self.client.delete(f"/questions/{served_ids[0]}")
+
+        # The unseen question is still served before the quiz ends
+        res = self.client.post("/quizzes", json={ 'session': token })
+        question = json.loads(res.data)["question"]
+        self.assertIsNotNone(question)
+        self.assertEqual(question["id"], (set(science_ids) - set(served_ids)).pop())
+        res = self.client.post("/quizzes", json={ 'session': token })
+        self.assertIsNone(json.loads(res.data)["question"])
+
+
+    def test_quiz_session_state_grows_with_served_questions_not_ids(self):
+        session = QuizSession("token", 1)
+        for question_id in (999_983, 5, 500_000):
+            session.served.add(question_id)
+
+        # A few bytes per served id, read back without recounting
+        state = session.to_state()
+        self.assertLess(len(state["served"]), 32)
+        restored = QuizSession.from_state("token", json.loads(json.dumps(state)))
+        self.assertEqual(list(restored.served), [5, 500_000, 999_983])
+        self.assertEqual(restored.served.count, 3)
+        self.assertIn(999_983, restored.served)
+        self.assertNotIn(999_984, restored.served)
+
+
+    def test_quiz_decks_are_reproducible_with_a_seed(self):
+        def play(seed):
+            seeded_app = create_app({
+                "SQLALCHEMY_DATABASE_URI": self.database_path,
+                "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+                "TESTING": True,
+                "QUIZ_RANDOM_SEED": seed
+            })
+            client = seeded_app.test_client()
+            res = client.post("/quizzes/sessions", json={ 'quiz_category': { 'id': 0, 'type': 'All' } })
+            token = json.loads(res.data)["session"]
+            order = []
+            while True:
+                question = json.loads(client.post("/quizzes", json={ 'session': token }).data)["question"]
+                if question is None:
+                    return order
+                order.append(question["id"])
+
+        # Check the same seed deals the same quiz, a different seed another order
+        self.assertEqual(play(7), play(7))
+        self.assertNotEqual(play(7), play(8))
+        self.assertEqual(sorted(play(7)), sorted(play(8)))
+
+
+    def test_quiz_filters_by_difficulty(self):
+        # Play the 'Science' questions of difficulty 2 and 3 to the end
+        previous_ids = []
+        while True:
+            res = self.client.post("/quizzes", json={
+                'previous_questions': previous_ids,
+                'quiz_category': { 'id': '1', 'type': 'Science' },
+                'difficulty_range': [2, 3]
+            })
+            self.assertEqual(res.status_code, 200)
+            question = json.loads(res.data)["question"]
+            if question is None:
+                break
+            self.assertIn(question["difficulty"], (2, 3))
+            previous_ids.append(question["id"])
+        self.assertEqual(len(previous_ids), 5)
+
+        # A single difficulty has a single science question
+        res = self.client.post("/quizzes", json={
+            'previous_questions': [],
+            'quiz_category': { 'id': '1', 'type': 'Science' },
+            'difficulty': 4
+        })
+        self.assertEqual(json.loads(res.data)["question"]["difficulty"], 4)
+
+
+    def test_quiz_ramps_up_difficulty(self):
+        # Three questions per level, then the nearest level with questions left once one runs out
+        previous_ids, difficulties = [], []
+        while True:
+            res = self.client.post("/quizzes", json={
+                'previous_questions': previous_ids,
+                'quiz_category': { 'id': '1', 'type': 'Science' },
+                'difficulty_range': [1, 4],
+                'progression': 'ramp'
+            })
+            question = json.loads(res.data)["question"]
+            if question is None:
+                break
+            previous_ids.append(question["id"])
+            difficulties.append(question["difficulty"])
+        self.assertEqual(difficulties, [1, 1, 1, 2, 2, 2, 3, 3, 4, 1])
+
+
+    def test_quiz_session_adapts_difficulty_to_answers(self):
+        res = self.client.post("/quizzes/sessions", json={
+            'quiz_category': { 'id': '1', 'type': 'Science' },
+            'difficulty_range': [1, 4],
+            'progression': 'adaptive'
+        })
+        token = json.loads(res.data)["session"]
+
+        # Starts at the easiest level, moves up after a correct answer and down after a wrong one
+        difficulties = []
+        for last_correct in (None, True, True, False, False):
+            res = self.client.post("/quizzes", json={ 'session': token, 'last_correct': last_correct })
+            difficulties.append(json.loads(res.data)["question"]["difficulty"])
+        self.assertEqual(difficulties, [1, 2, 3, 2, 1])
+
+
+    def test_400_if_quiz_difficulty_options_are_invalid(self):
+        for options in ({ 'difficulty': 'hard' }, { 'difficulty_range': [3, 1] },
+                        { 'difficulty': 1, 'difficulty_range': [1, 2] }, { 'progression': 'zigzag' }):
+            res = self.client.post("/quizzes", json={
+                'previous_questions': [],
+                'quiz_category': { 'id': 0, 'type': 'All' },
+                **options
+            })
+            self.assertEqual(res.status_code, 400)
+            res = self.client.post("/quizzes/sessions", json={ 'quiz_category': { 'id': 0, 'type': 'All' }, **options })
+            self.assertEqual(res.status_code, 400)
+
+
+    def test_404_if_quiz_session_is_unknown(self):
+        # Get response object
+        res = self.client.post("/quizzes", json={ 'session': 'not-a-session' })
+        data = json.loads(res.data)
+
+        # Check status code
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "resource not found")
+
+
+    def test_422_if_quiz_session_started_without_category(self):
+        # Get response object
+        res = self.client.post("/quizzes/sessions", json={})
+        data = json.loads(res.data)
+
+        # Check status code
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "unprocessable")
+
+
     def test_405_if_quiz_started_with_delete(self):
         # Get response object
         res = self.client.delete("/quizzes")
@@ -813,6 +2020,584 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['message'], 'unprocessable')
 
 
+    @committed
+    def test_migration_converts_text_category_to_integer_foreign_key(self):
+        with self.app.app_context():
+            # Recreate the questions table the way older versions did
+            Question.__table__.drop(db.engine)
+            legacy_questions = Table(
+                'questions', MetaData(),
+                Column('id', Integer, primary_key=True),
+                Column('question', String, nullable=False),
+                Column('answer', String, nullable=False),
+                Column('category', String, nullable=False),
+                Column('difficulty', Integer, nullable=False)
+            )
+            legacy_questions.create(db.engine)
+            with db.engine.begin() as connection:
+                connection.execute(insert(legacy_questions), [
+                    { 'question': data['question'], 'answer': data['answer'],
+                      'category': str(data['category_id']), 'difficulty': data['difficulty'] }
+                    for data in questions_data
+                ])
+            db.session.query(SchemaMigration).delete()
+            db.session.commit()
+
+            # Apply the migration
+            self.assertEqual(run_migrations(), [
+                "0001_question_category_integer_fk", "0002_question_counts_category_integer_fk",
+                "0003_question_trigram_indexes"
+            ])
+            self.assertEqual(run_migrations(), [])
+
+            # Check the column, foreign key and indexes
+            inspector = inspect(db.engine)
+            category_column = next(c for c in inspector.get_columns('questions') if c['name'] == 'category')
+            self.assertIsInstance(category_column['type'], Integer)
+            self.assertTrue(any(
+                fk['constrained_columns'] == ['category'] and fk['referred_table'] == 'categories'
+                for fk in inspector.get_foreign_keys('questions')
+            ))
+            index_names = { index['name'] for index in inspector.get_indexes('questions') }
+            self.assertIn('ix_questions_category_id', index_names)
+            self.assertIn('ix_questions_category_difficulty', index_names)
+            self.assertEqual(Question.query.count(), len(questions_data))
+
+        # The API still returns the category as a string
+        data = json.loads(self.client.get("/categories/2/questions").data)
+        self.assertEqual([ q["category"] for q in data["questions"] ], ["2", "2"])
+
+
+    @committed
+    def test_new_databases_still_run_migrations_outside_models(self):
+        applied = []
+        migrations = [
+            ("9001_in_models", lambda connection: applied.append("9001_in_models"), False),
+            ("9002_outside_models", lambda connection: applied.append("9002_outside_models"), True),
+        ]
+        with self.app.app_context(), patch("flaskr.migrations.MIGRATIONS", migrations):
+            # Both are recorded, only the one create_all() cannot build runs
+            self.assertEqual(run_migrations(stamp_only=True), ["9001_in_models", "9002_outside_models"])
+            self.assertEqual(applied, ["9002_outside_models"])
+
+
+    @committed
+    def test_migration_converts_text_question_counts_to_integer_foreign_key(self):
+        with self.app.app_context():
+            # Recreate the counters table with the text category older versions used
+            QuestionCount.__table__.drop(db.engine)
+            legacy_counts = Table(
+                'question_counts', MetaData(),
+                Column('category', String, primary_key=True),
+                Column('total', Integer, nullable=False)
+            )
+            legacy_counts.create(db.engine)
+            totals = Counter(str(data['category_id']) for data in questions_data)
+            with db.engine.begin() as connection:
+                connection.execute(insert(legacy_counts), [
+                    { 'category': category, 'total': total } for category, total in totals.items()
+                ] + [ { 'category': '99', 'total': 0 } ])
+            db.session.query(SchemaMigration).delete()
+            db.session.commit()
+
+            # Apply the migrations, the questions table is already up to date
+            run_migrations()
+            # SQLite pragmas answer from a pooled connection's cached schema, reflect on fresh ones
+            db.engine.dispose()
+
+            # Check the column and foreign key, the counter of the missing category is gone
+            inspector = inspect(db.engine)
+            category_column = next(c for c in inspector.get_columns('question_counts') if c['name'] == 'category')
+            self.assertIsInstance(category_column['type'], Integer)
+            self.assertTrue(any(
+                fk['constrained_columns'] == ['category'] and fk['referred_table'] == 'categories'
+                for fk in inspector.get_foreign_keys('question_counts')
+            ))
+            self.assertEqual(
+                dict(db.session.query(QuestionCount.category, QuestionCount.total)),
+                { int(category): total for category, total in totals.items() }
+            )
+
+        # Totals still come from the counters
+        data = json.loads(self.client.get("/categories/2/questions").data)
+        self.assertEqual(data["total_questions"], 2)
+
+
+    # Tests for the connection pool settings and metrics
+    def test_pool_settings_come_from_config(self):
+        # Build an app with explicit pool settings and pre-warmed connections
+        pooled_app = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+            "TESTING": True,
+            "DB_POOL_SIZE": 3,
+            "DB_MAX_OVERFLOW": 2,
+            "DB_POOL_RECYCLE": 600,
+            "DB_POOL_PREWARM": 2
+        })
+        options = pooled_app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+
+        with pooled_app.app_context():
+            # Check the pool was sized from the config and pre-ping is on by default
+            self.assertEqual(options["pool_recycle"], 600)
+            self.assertTrue(options["pool_pre_ping"])
+            self.assertEqual(db.engine.pool.size(), 3)
+            # Check the pre-warmed connections wait in the pool
+            self.assertGreaterEqual(db.engine.pool.checkedin(), 2)
+            self.assertEqual(pooled_app.extensions["pool_metrics"].stats()["capacity"], 5)
+
+    def test_statement_timeout_only_applies_to_postgres(self):
+        # Check the timeout becomes a server option on Postgres only
+        config = { "DB_STATEMENT_TIMEOUT": 5000 }
+        postgres_options = engine_options(config, "postgresql://user@localhost/trivia")
+        sqlite_options = engine_options(config, "sqlite:///trivia.db")
+
+        self.assertEqual(postgres_options["connect_args"], { "options": "-c statement_timeout=5000" })
+        self.assertNotIn("connect_args", sqlite_options)
+
+    @committed
+    def test_sqlite_database_gets_pragmas_and_fts_search(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sqlite_path = f"sqlite:///{directory}/trivia.db"
+            sqlite_app = create_app({ "SQLALCHEMY_DATABASE_URI": sqlite_path, "TESTING": True })
+            with sqlite_app.app_context():
+                load_fixtures()
+                # Check the pragmas were applied on connect
+                self.assertEqual(db.session.execute(db.text("PRAGMA journal_mode")).scalar(), "wal")
+                self.assertEqual(db.session.execute(db.text("PRAGMA foreign_keys")).scalar(), 1)
+                self.assertEqual(sqlite_app.extensions["search"].name, "fts")
+            sqlite_client = sqlite_app.test_client()
+            ilike_client = create_app({
+                "SQLALCHEMY_DATABASE_URI": sqlite_path,
+                "SEARCH_BACKEND": "ilike",
+                "TESTING": True
+            }).test_client()
+
+            # The FTS5 index returns what ILIKE does
+            for term in ["what", "WHAT", "the", "mona", "is the", "no such thing", "ph", "h2o", "pl_net", '"']:
+                for search_answers in [False, True]:
+                    search_data = { "searchTerm": term, "searchAnswers": search_answers }
+                    expected = json.loads(ilike_client.post("/questions/search", json=search_data).data)
+                    actual = json.loads(sqlite_client.post("/questions/search", json=search_data).data)
+                    self.assertEqual(actual["questions"], expected["questions"])
+                    self.assertEqual(actual["total_questions"], expected["total_questions"])
+
+            # The triggers index new questions and drop deleted ones
+            res = sqlite_client.post("/questions", json={
+                "question": "What is acrophobia a fear of?",
+                "answer": "Heights",
+                "category": 2,
+                "difficulty": 3
+            })
+            created_id = json.loads(res.data)["created"]
+            data = json.loads(sqlite_client.post("/questions/search", json={ "searchTerm": "acrophobia" }).data)
+            self.assertEqual([ q["id"] for q in data["questions"] ], [created_id])
+            sqlite_client.delete(f"/questions/{created_id}")
+            data = json.loads(sqlite_client.post("/questions/search", json={ "searchTerm": "acrophobia" }).data)
+            self.assertEqual(data["total_questions"], 0)
+
+            with sqlite_app.app_context():
+                db.engine.dispose()
+
+    @committed
+    def test_sqlite_write_requests_take_the_write_lock_up_front(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sqlite_app = create_app({ "SQLALCHEMY_DATABASE_URI": f"sqlite:///{directory}/trivia.db", "TESTING": True })
+            with sqlite_app.app_context():
+                load_fixtures()
+                db.session.commit()
+            other_worker = sqlite3.connect(f"{directory}/trivia.db", timeout=0.1)
+
+            # A read request leaves the database open to other writers
+            with sqlite_app.test_request_context("/questions"):
+                db.session.get(Question, 1)
+                other_worker.execute("UPDATE categories SET type = type WHERE id = 1")
+                other_worker.commit()
+                db.session.rollback()
+
+            # DELETE reads the question then deletes it: nobody may commit in between
+            with sqlite_app.test_request_context("/questions/1", method="DELETE"):
+                question = db.session.get(Question, 1)
+                with self.assertRaises(sqlite3.OperationalError):
+                    other_worker.execute("UPDATE categories SET type = type WHERE id = 1")
+                question.delete()
+            other_worker.close()
+            with sqlite_app.app_context():
+                self.assertIsNone(db.session.get(Question, 1))
+                db.engine.dispose()
+
+    @committed
+    def test_in_memory_sqlite_database_outlives_requests(self):
+        memory_app = create_app({ "SQLALCHEMY_DATABASE_URI": "sqlite://", "TESTING": True })
+        options = memory_app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+        # Recycling the one connection would drop the database
+        self.assertNotIn("pool_recycle", options)
+        with memory_app.app_context():
+            load_fixtures()
+            db.session.commit()
+        memory_client = memory_app.test_client()
+
+        # A question created by one request is served by the next ones
+        res = memory_client.post("/questions", json={
+            "question": "What is acrophobia a fear of?",
+            "answer": "Heights",
+            "category": 2,
+            "difficulty": 3
+        })
+        self.assertEqual(res.status_code, 201)
+        data = json.loads(memory_client.get("/questions?page=1").data)
+        self.assertEqual(data["total_questions"], len(questions_data) + 1)
+        data = json.loads(memory_client.post("/questions/search", json={ "searchTerm": "acrophobia" }).data)
+        self.assertEqual(data["total_questions"], 1)
+
+    @committed
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_reads_go_to_the_replica_unless_the_client_just_wrote(self):
+        with tempfile.TemporaryDirectory() as directory:
+            primary_path = f"sqlite:///{directory}/primary.db"
+            replica_path = f"sqlite:///{directory}/replica.db"
+            # Two databases with the same fixtures, nothing replicates between them
+            for path in (primary_path, replica_path):
+                seed_app = create_app({ "SQLALCHEMY_DATABASE_URI": path, "TESTING": True })
+                with seed_app.app_context():
+                    load_fixtures()
+                    db.session.commit()
+                    db.engine.dispose()
+
+            # Two workers sharing a Redis response cache
+            server = fakeredis.FakeServer()
+            config = {
+                "SQLALCHEMY_DATABASE_URI": primary_path,
+                "REPLICA_DATABASE_URIS": replica_path,
+                "REPLICA_STICKY_SECONDS": 0.5,
+                "CACHE_BACKEND": "redis",
+                "TESTING": True
+            }
+            workers = [
+                create_app({ **config, "CACHE_REDIS_CLIENT": fakeredis.FakeRedis(server=server) })
+                for _ in range(2)
+            ]
+            writer, reader = workers[0].test_client(), workers[1].test_client()
+            search_data = { "searchTerm": "acrophobia" }
+
+            # The write goes to the primary
+            res = writer.post("/questions", json={
+                "question": "What is acrophobia a fear of?",
+                "answer": "Heights",
+                "category": 2,
+                "difficulty": 3
+            })
+            self.assertEqual(res.status_code, 201)
+            sticky_cookie = writer.get_cookie(STICKY_COOKIE).value
+
+            # Other clients read the replica
+            data = json.loads(reader.get("/questions").data)
+            self.assertEqual(data["total_questions"], len(questions_data))
+            data = json.loads(workers[0].test_client().get("/questions").data)
+            self.assertEqual(data["total_questions"], len(questions_data))
+
+            # The writer reads its write back from the primary, on any worker
+            data = json.loads(writer.post("/questions/search", json=search_data).data)
+            self.assertEqual(data["total_questions"], 1)
+            reader.set_cookie(STICKY_COOKIE, sticky_cookie)
+            data = json.loads(reader.get("/questions").data)
+            self.assertEqual(data["total_questions"], len(questions_data) + 1)
+
+            # Async mode routes its reads the same way
+            if create_asgi_app is not None:
+                async_app = create_asgi_app({ **config, "CACHE_REDIS_CLIENT": fakeredis.FakeRedis(server=server) })
+
+                async def serve():
+                    try:
+                        replica = await asgi_call(async_app, "GET", "/questions")
+                        primary = await asgi_call(async_app, "GET", "/questions", headers=[
+                            (b"cookie", f"{STICKY_COOKIE}={sticky_cookie}".encode())
+                        ])
+                        return replica, primary
+                    finally:
+                        await async_app.dispose()
+                        async_app.flask_app.extensions["replicas"].dispose()
+
+                replica, primary = asyncio.run(serve())
+                self.assertEqual(json.loads(replica[1])["total_questions"], len(questions_data))
+                self.assertEqual(json.loads(primary[1])["total_questions"], len(questions_data) + 1)
+
+            # Once the window is over, GET and read-only POST requests use the replica again
+            time.sleep(0.6)
+            data = json.loads(writer.post("/questions/search", json=search_data).data)
+            self.assertEqual(data["total_questions"], 0)
+            data = json.loads(writer.get("/questions").data)
+            self.assertEqual(data["total_questions"], len(questions_data))
+            res = writer.post("/quizzes", json={ "previous_questions": [], "quiz_category": { "id": 0 } })
+            self.assertEqual(res.status_code, 200)
+
+            for worker in workers:
+                worker.extensions["replicas"].dispose()
+                with worker.app_context():
+                    db.engine.dispose()
+
+    @committed
+    def test_replica_reads_use_the_response_cache_unless_sticky(self):
+        # The test database standing in for its own replica
+        replica_app = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "REPLICA_DATABASE_URIS": self.database_path,
+            "TESTING": True
+        })
+        client = replica_app.test_client()
+        response_cache = replica_app.extensions["response_cache"]
+        try:
+            first = client.get("/categories/1/questions")
+            second = client.get("/categories/1/questions")
+            self.assertEqual(second.data, first.data)
+            self.assertEqual(response_cache.stats(), { "hits": 1, "misses": 1 })
+
+            # A client that just wrote reads past the cache
+            client.set_cookie(STICKY_COOKIE, str(time.time() + 60))
+            client.get("/categories/1/questions")
+            self.assertEqual(response_cache.stats(), { "hits": 1, "misses": 1 })
+        finally:
+            replica_app.extensions["replicas"].dispose()
+
+    @committed
+    def test_pool_metrics_track_checkouts(self):
+        metrics = self.app.extensions["pool_metrics"]
+        checkouts = metrics.stats()["checkouts"]
+
+        res = self.client.get("/categories")
+
+        # Check the request checked a connection out, waited for it and gave it back
+        stats = metrics.stats()
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(stats["checkouts"], checkouts)
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertGreaterEqual(stats["peak_checked_out"], 1)
+        self.assertIsNotNone(stats["p99_wait_ms"])
+
+    # Tests for the /metrics endpoint
+    def test_metrics_report_requests_queries_and_caches(self):
+        self.client.get("/questions?page=1")
+        self.client.get("/questions?page=1")
+        self.client.delete("/questions/1000")
+
+        res = self.client.get("/metrics")
+        body = res.data.decode()
+
+        # Check latency and statuses are labelled by route pattern, not by raw path
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_request_duration_seconds_count{endpoint="/questions",method="GET"} 2.0', body)
+        self.assertIn('trivia_responses_total{endpoint="/questions/<int:question_id>",method="DELETE",status="404"} 1.0', body)
+        # Check the first request ran SQL and the second was a response cache hit
+        self.assertIn('trivia_request_queries_bucket{endpoint="/questions",le="0.0"} 1.0', body)
+        self.assertIn('trivia_cache_hit_ratio{cache="response_cache"} 0.5', body)
+        self.assertIn("trivia_db_pool_checkouts_total", body)
+
+    def test_metrics_can_be_disabled(self):
+        quiet_app = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+            "TESTING": True,
+            "METRICS_ENABLED": False
+        })
+
+        res = quiet_app.test_client().get("/metrics")
+
+        self.assertEqual(res.status_code, 404)
+
+    # Tests for the slow request log and request profiling
+    def test_slow_requests_are_logged_with_their_sql(self):
+        # Treat every request as slow
+        self.app.extensions["query_log"].slow_threshold = 1e-9
+
+        with self.assertLogs("flaskr.querylog", level="WARNING") as logs:
+            res = self.client.get("/categories/1/questions")
+
+        # Check the entry names the request and lists the statements it ran
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("Slow request GET /categories/1/questions", logs.output[0])
+        self.assertIn("SELECT", logs.output[0])
+
+    def test_profile_is_saved_for_trusted_callers_only(self):
+        with tempfile.TemporaryDirectory() as profile_dir:
+            profiled_app = create_app({
+                "SQLALCHEMY_DATABASE_URI": self.database_path,
+                "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+                "TESTING": True,
+                "PROFILE_TOKEN": "let-me-profile",
+                "PROFILE_DIR": profile_dir
+            })
+            client = profiled_app.test_client()
+
+            untrusted = client.get("/categories", headers={ "X-Trivia-Profile": "guess" })
+            trusted = client.get("/categories", headers={ "X-Trivia-Profile": "let-me-profile" })
+
+            # Check only the request with the right token was profiled, into its route's directory
+            self.assertNotIn("X-Trivia-Profile-File", untrusted.headers)
+            path = trusted.headers["X-Trivia-Profile-File"]
+            self.assertEqual(os.path.dirname(path), os.path.join(profile_dir, "get_categories"))
+            self.assertTrue(pstats.Stats(path).total_calls)
+
+    def test_profile_token_check_survives_odd_headers_and_numeric_tokens(self):
+        with tempfile.TemporaryDirectory() as profile_dir:
+            # TRIVIA_PROFILE_TOKEN=12345 is JSON-decoded to an int
+            with patch.dict(os.environ, { "TRIVIA_PROFILE_TOKEN": "12345" }):
+                profiled_app = create_app({
+                    "SQLALCHEMY_DATABASE_URI": self.database_path,
+                    "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+                    "TESTING": True,
+                    "PROFILE_DIR": profile_dir
+                })
+            self.assertEqual(profiled_app.config["PROFILE_TOKEN"], 12345)
+            client = profiled_app.test_client()
+
+            non_ascii = client.get("/categories", headers={ "X-Trivia-Profile": "gr\u00fc\u00dfe" })
+            trusted = client.get("/categories", headers={ "X-Trivia-Profile": "12345" })
+
+            self.assertEqual(non_ascii.status_code, 200)
+            self.assertNotIn("X-Trivia-Profile-File", non_ascii.headers)
+            self.assertEqual(trusted.status_code, 200)
+            self.assertIn("X-Trivia-Profile-File", trusted.headers)
+
+    # Tests for the async (ASGI) serving mode
+    @unittest.skipUnless(create_asgi_app, "async mode needs greenlet and an asyncio database driver")
+    @committed
+    def test_async_mode_serves_the_same_responses(self):
+        async_app = create_asgi_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+            "TESTING": True
+        })
+
+        async def call(method, path, query="", body=None):
+            return await asgi_call(async_app, method, path, query, body)
+
+        requests = [
+            ("GET", "/questions", "page=1", None),
+            ("GET", "/questions", "page=1000", None),
+            ("GET", "/categories", "", None),
+            ("GET", "/categories/1/questions", "", None),
+            ("GET", "/categories/1/questions", "per_page=1", None),
+            ("GET", "/categories/1/questions", "stream=ndjson", None),
+            ("GET", "/categories/1000/questions", "", None),
+            ("POST", "/questions/search", "", { "searchTerm": "title", "page": 1 }),
+            ("POST", "/questions/search", "", {}),
+            ("POST", "/quizzes", "", { "previous_questions": [] }),
+            ("POST", "/quizzes", "", { "previous_questions": [], "quiz_category": { "id": 1 }, "difficulty": 4 }),
+            ("POST", "/quizzes", "", { "previous_questions": [], "quiz_category": { "id": 1 }, "progression": "up" }),
+            ("POST", "/quizzes", "", { "session": "unknown" }),
+        ]
+
+        # Responses of the sync app, before anything is written
+        expected = []
+        for method, path, query, body in requests:
+            url = f"{path}?{query}" if query else path
+            expected.append(self.client.get(url) if method == "GET" else self.client.post(url, json=body))
+
+        async def serve_all():
+            try:
+                responses = [await call(*request) for request in requests]
+                # A question created through the async app is served by it right away
+                created = await call("POST", "/questions", body={
+                    "question": "Async?", "answer": "Yes", "category": 1, "difficulty": 1
+                })
+                after_create = await call("GET", "/categories/1/questions")
+                return responses, created, after_create
+            finally:
+                await async_app.dispose()
+
+        responses, created, after_create = asyncio.run(serve_all())
+
+        # Check every response matches the sync app, status and body
+        for request, (status, data), sync_response in zip(requests, responses, expected):
+            self.assertEqual(status, sync_response.status_code, request)
+            self.assertEqual(data, sync_response.data, request)
+
+        self.assertEqual(created[0], 201)
+        self.assertIn(b"Async?", after_create[1])
+
+    @unittest.skipUnless(create_asgi_app, "async mode needs greenlet and an asyncio database driver")
+    @committed
+    def test_async_mode_streams_request_bodies_to_the_sync_views(self):
+        async_app = create_asgi_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+            "TESTING": True
+        })
+        lines = [
+            json.dumps({ "question": f"Streamed {number}?", "answer": "Yes", "category": 1, "difficulty": 1 }) + "\n"
+            for number in range(3)
+        ]
+
+        async def upload():
+            # One receive() message per line, without a Content-Length
+            chunks = [ line.encode() for line in lines ]
+            messages = []
+            async def receive():
+                body = chunks.pop(0)
+                return { "type": "http.request", "body": body, "more_body": bool(chunks) }
+            async def send(message):
+                messages.append(message)
+            try:
+                await async_app({
+                    "type": "http", "method": "POST", "path": "/questions/bulk", "query_string": b"",
+                    "headers": [(b"content-type", b"application/x-ndjson"), (b"transfer-encoding", b"chunked")],
+                    "http_version": "1.1", "scheme": "http", "server": ("localhost", 80), "root_path": ""
+                }, receive, send)
+            finally:
+                await async_app.dispose()
+            return messages[0]["status"], b"".join(message.get("body", b"") for message in messages[1:])
+
+        # The bulk view reads the body itself, it is never buffered up front
+        with patch("flaskr.asgi.read_body", side_effect=AssertionError("body buffered")):
+            status, body = asyncio.run(upload())
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["inserted"], 3)
+
+    @unittest.skipUnless(create_asgi_app, "async mode needs greenlet and an asyncio database driver")
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    @committed
+    def test_async_mode_calls_redis_off_the_event_loop(self):
+        client = fakeredis.FakeRedis()
+        async_app = create_asgi_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+            "CACHE_BACKEND": "redis",
+            "CACHE_REDIS_CLIENT": client,
+            "TESTING": True
+        })
+        # Threads every Redis command ran on
+        threads = set()
+        execute_command = client.execute_command
+        def record(*args, **kwargs):
+            threads.add(threading.current_thread())
+            return execute_command(*args, **kwargs)
+        client.execute_command = record
+
+        async def serve():
+            try:
+                session = json.loads((await asgi_call(async_app, "POST", "/quizzes/sessions", body={
+                    "quiz_category": { "id": 1, "type": "Science" }
+                }))[1])["session"]
+                threads.clear()
+                responses = [
+                    await asgi_call(async_app, "GET", "/categories"),
+                    await asgi_call(async_app, "GET", "/categories"),
+                    await asgi_call(async_app, "GET", "/categories/1/questions"),
+                    await asgi_call(async_app, "POST", "/quizzes", body={ "session": session }),
+                ]
+                return responses, threading.current_thread()
+            finally:
+                await async_app.dispose()
+
+        responses, loop_thread = asyncio.run(serve())
+        self.assertEqual([ status for status, _ in responses ], [200, 200, 200, 200])
+        self.assertIsNotNone(json.loads(responses[3][1])["question"])
+        self.assertEqual(responses[1][1], responses[0][1])
+        self.assertTrue(threads)
+        self.assertNotIn(loop_thread, threads)
+        self.assertEqual(async_app.flask_app.extensions["response_cache"].stats()["hits"], 1)
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()